@@ -0,0 +1,201 @@
+"""
+Backlog approver: drains join requests that queued up while the bot was
+offline, through a Telethon user session (the Bot API cannot list them).
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+from config import API_HASH, API_ID, BACKLOG_CONCURRENCY, BACKLOG_PAGE_SIZE, BACKLOG_SESSION, SESSION_DIR
+from persistence import STORE
+from subscriptions import get_subscription_states
+from chat_owners import CHAT_OWNERS
+
+log = logging.getLogger(__name__)
+
+
+class BacklogApprover:
+    """
+    Drains join requests that piled up while the bot was offline (or before it
+    was added). A chat whose recorded owner has an active plan is approved in
+    one call. Otherwise (no owner, or the owner's plan lapsed) it pages
+    through pending importers over the MTProto user session, resolves plan
+    state for each page in one bulk lookup and approves the eligible users
+    concurrently. A FloodWait pauses every in-flight call for the advertised
+    time instead of hammering Telegram.
+    """
+
+    def __init__(
+        self,
+        client,
+        page_size: int = BACKLOG_PAGE_SIZE,
+        concurrency: int = BACKLOG_CONCURRENCY,
+        dry_run: bool = False,
+    ):
+        self.client = client
+        self.page_size = page_size
+        self.dry_run = dry_run
+        self._sem = asyncio.Semaphore(max(1, concurrency))
+        self._paused_until = 0.0
+        self.stats: Dict[str, int] = {"scanned": 0, "approved": 0, "skipped": 0, "failed": 0, "flood_waits": 0}
+
+    async def _call(self, request):
+        from telethon.errors import FloodWaitError
+
+        while True:
+            delay = self._paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                return await self.client(request)
+            except FloodWaitError as ex:
+                self.stats["flood_waits"] += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + ex.seconds + 1)
+                log.warning("Backlog flood wait: sleeping %ss", ex.seconds)
+
+    async def _approve(self, peer, user) -> None:
+        from telethon import utils
+        from telethon.tl.functions.messages import HideChatJoinRequestRequest
+
+        async with self._sem:
+            try:
+                await self._call(HideChatJoinRequestRequest(peer=peer, user_id=utils.get_input_user(user), approved=True))
+                self.stats["approved"] += 1
+            except Exception as ex:
+                self.stats["failed"] += 1
+                log.error("Backlog approve error for user %s: %s", user.id, ex)
+
+    async def _drain_owned(self, chat, peer, owner_id: int) -> Optional[Dict[str, int]]:
+        # None when the owner's plan lapsed: the caller then checks each joiner, like the pipeline
+        from telethon import types
+        from telethon.tl.functions.messages import GetChatInviteImportersRequest, HideAllChatJoinRequestsRequest
+
+        states = await get_subscription_states([owner_id])
+        if owner_id in states and not (states[owner_id] and states[owner_id].is_active()):
+            log.info("Backlog %s: owner %s has no active plan, checking each joiner", chat, owner_id)
+            return None
+
+        res = await self._call(
+            GetChatInviteImportersRequest(
+                peer=peer, offset_date=None, offset_user=types.InputUserEmpty(), limit=1, requested=True
+            )
+        )
+        pending = res.count
+        self.stats["scanned"] += pending
+
+        if owner_id not in states:
+            self.stats["skipped"] += pending
+            log.warning("Backlog %s: owner %s plan state unavailable, skipped %d", chat, owner_id, pending)
+            return self.stats
+
+        approved = 0
+        if pending and not self.dry_run:
+            try:
+                await self._call(HideAllChatJoinRequestsRequest(peer=peer, approved=True))
+                approved = pending
+                self.stats["approved"] += pending
+            except Exception as ex:
+                self.stats["failed"] += pending
+                log.error("Backlog approve-all error for %s: %s", chat, ex)
+
+        log.info("Backlog %s: owner %s active, approved %d of %d", chat, owner_id, approved, pending)
+        return self.stats
+
+    async def drain(self, chat) -> Dict[str, int]:
+        from telethon import types, utils
+        from telethon.tl.functions.messages import GetChatInviteImportersRequest
+
+        peer = await self.client.get_input_entity(chat)
+        chat_id = utils.get_peer_id(peer)
+        owner_id = (await CHAT_OWNERS.get_owners([chat_id])).get(chat_id)
+        if owner_id is not None:
+            stats = await self._drain_owned(chat, peer, owner_id)
+            if stats is not None:
+                return stats
+
+        offset_date, offset_user = None, types.InputUserEmpty()
+
+        while True:
+            res = await self._call(
+                GetChatInviteImportersRequest(
+                    peer=peer,
+                    offset_date=offset_date,
+                    offset_user=offset_user,
+                    limit=self.page_size,
+                    requested=True,
+                )
+            )
+            if not res.importers:
+                break
+
+            users = {u.id: u for u in res.users}
+            ids = [imp.user_id for imp in res.importers]
+            states = await get_subscription_states(ids)
+            now = time.time()
+            eligible = [users[uid] for uid in ids if uid in users and states.get(uid) and states[uid].is_active(now)]
+
+            self.stats["scanned"] += len(ids)
+            self.stats["skipped"] += len(ids) - len(eligible)
+            if not self.dry_run:
+                await asyncio.gather(*(self._approve(peer, user) for user in eligible))
+
+            log.info(
+                "Backlog %s: scanned %d, approved %d, skipped %d, failed %d, flood waits %d",
+                chat,
+                self.stats["scanned"],
+                self.stats["approved"],
+                self.stats["skipped"],
+                self.stats["failed"],
+                self.stats["flood_waits"],
+            )
+
+            # (date, user) cursor – approved users leave the list, skipped ones stay behind it
+            last = res.importers[-1]
+            offset_date = last.date
+            offset_user = utils.get_input_user(users[last.user_id]) if last.user_id in users else types.InputUserEmpty()
+            if len(res.importers) < self.page_size:
+                break
+
+        return self.stats
+
+
+def _parse_chat_ref(ref: str):
+    return int(ref) if ref.lstrip("-").isdigit() else ref
+
+
+async def run_backlog(chats: List[str], dry_run: bool = False) -> Dict[str, int]:
+    from telethon import TelegramClient
+
+    if not (API_ID and API_HASH):
+        raise RuntimeError("❌ Backlog mode needs API_ID and API_HASH in .env file")
+
+    client = TelegramClient(os.path.join(SESSION_DIR, BACKLOG_SESSION), API_ID, API_HASH)
+    await client.start()
+    approver = BacklogApprover(client, dry_run=dry_run)
+    try:
+        for chat in chats:
+            started = time.monotonic()
+            await approver.drain(_parse_chat_ref(chat))
+            log.info("✅ Backlog for %s drained in %.1fs", chat, time.monotonic() - started)
+    finally:
+        await client.disconnect()
+    return approver.stats
+
+
+async def startup_backlog(chats: List[str]) -> None:
+    try:
+        await run_backlog(chats)
+    except asyncio.CancelledError:
+        raise
+    except Exception as ex:
+        log.error("Startup backlog error: %s", ex)
+
+
+async def backlog_cli(chats: List[str], dry_run: bool) -> None:
+    try:
+        await run_backlog(chats, dry_run)
+    finally:
+        await STORE.close()
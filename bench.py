@@ -0,0 +1,560 @@
+"""
+Load / latency benchmark for the bot's hot paths.
+
+Feeds synthetic ChatJoinRequest and CallbackQuery updates into the real
+Dispatcher built by login.setup_dispatcher(), with every external service
+replaced by a local stand-in:
+
+* Telegram Bot API – FakeTelegramSession (latency + random RetryAfter)
+* Supabase        – the in-memory storage backend behind LatencyStorage
+* Razorpay        – razorpay_stub.py served on a local port
+
+Usage:
+
+    python bench.py                              # all scenarios
+    python bench.py viral_burst --updates 20000 --tg-latency-ms 40
+    python bench.py --out bench.json             # machine-readable results
+    python bench.py viral_burst --startup-runs 0  # skip the cold-start samples
+
+Every scenario reports throughput, p50/p95/p99 latency, event-loop lag and
+peak RSS as one JSON document so runs can be diffed for regressions. Cold
+start (import, dispatcher setup, first join request handled) is measured in
+fresh child processes so nothing is already imported or warmed.
+"""
+
+import abc
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import socket
+import sys
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+RAZORPAY_STUB_PORT = _free_port()
+
+# config.py reads the environment at import time – point everything at local stand-ins first
+os.environ.update(
+    {
+        "BOT_TOKEN": "123456:BENCHMARK-TOKEN",
+        "BOT_USERNAME": "bench_bot",
+        "STORAGE_BACKEND": "memory",
+        "RAZORPAY_KEY_ID": "rzp_test_bench",
+        "RAZORPAY_KEY_SECRET": "bench",
+        "RAZORPAY_API_BASE": f"http://127.0.0.1:{RAZORPAY_STUB_PORT}/v1",
+        "RAZORPAY_WEBHOOK_SECRET": "",
+        "SWEEP_INTERVAL": "0",
+        "BACKLOG_CHATS": "",
+        "WEB_PORT": "",
+    }
+)
+# Telegram limits are lifted unless the caller pins them, so the bot itself is measured
+os.environ.setdefault("TG_GLOBAL_RATE", "100000")
+os.environ.setdefault("TG_APPROVE_CHAT_RATE", "100000")
+os.environ.setdefault("TG_DM_CHAT_RATE", "100000")
+
+# imported first so LOGIN_IMPORT_MS covers aiogram/aiohttp as a cold process pays for them
+_import_started = time.perf_counter()
+import login  # noqa: E402
+
+LOGIN_IMPORT_MS = (time.perf_counter() - _import_started) * 1000
+
+from aiohttp import web  # noqa: E402
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.exceptions import TelegramRetryAfter  # noqa: E402
+from aiogram.methods import SendMessage  # noqa: E402
+from aiogram.types import Chat, Message  # noqa: E402
+
+import chat_owners  # noqa: E402
+import join_pipeline  # noqa: E402
+import persistence  # noqa: E402
+import razorpay_stub  # noqa: E402
+import subscriptions  # noqa: E402
+from storage import Storage, make_storage  # noqa: E402
+
+
+# ---------------- STAND-INS ----------------
+
+
+class FakeTelegramSession(BaseSession):
+    """Answers every Bot API method locally after a simulated round trip."""
+
+    def __init__(self, latency_ms: float = 0.0, retry_after_rate: float = 0.0, retry_after: int = 1):
+        super().__init__()
+        self.latency_ms = latency_ms
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.retry_afters = 0
+
+    async def make_request(self, bot: Bot, method, timeout: Optional[int] = None):
+        name = type(method).__name__
+        self.calls[name] += 1
+        if self.latency_ms:
+            await asyncio.sleep(random.expovariate(1000.0 / self.latency_ms))
+        if self.retry_after_rate and random.random() < self.retry_after_rate:
+            self.retry_afters += 1
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=self.retry_after)
+        if isinstance(method, SendMessage):
+            return Message(
+                message_id=self.calls[name],
+                date=datetime.now(timezone.utc),
+                chat=Chat(id=int(method.chat_id), type="private"),
+                text=method.text,
+            )
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        # never used by the bot; BaseSession requires an async generator here
+        if False:
+            yield b""
+
+    async def close(self) -> None:
+        pass
+
+
+class LatencyStorage(Storage):
+    """Wraps a Storage and delays every call, standing in for a remote Supabase."""
+
+    def __init__(self, inner: Storage, latency_ms: float):
+        self.inner = inner
+        self.latency_ms = latency_ms
+        self.calls: Dict[str, int] = defaultdict(int)
+
+    async def close(self) -> None:
+        await self.inner.close()
+
+
+def _delayed(name: str):
+    async def method(self: LatencyStorage, *args, **kwargs):
+        self.calls[name] += 1
+        if self.latency_ms:
+            await asyncio.sleep(random.expovariate(1000.0 / self.latency_ms))
+        return await getattr(self.inner, name)(*args, **kwargs)
+
+    method.__name__ = name
+    return method
+
+
+for _name, _value in list(vars(Storage).items()):
+    if callable(_value) and not _name.startswith("_") and _name != "close":
+        setattr(LatencyStorage, _name, _delayed(_name))
+abc.update_abstractmethods(LatencyStorage)
+
+
+# ---------------- MEASUREMENT ----------------
+
+
+class LoopLagMonitor:
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - start - self.interval))
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+def summarize_ms(values: List[float]) -> Dict[str, float]:
+    return {
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "max_ms": round(max(values) * 1000, 3) if values else 0.0,
+    }
+
+
+class JoinTracker:
+    """Times each join request from feed until process_join_request finishes."""
+
+    def __init__(self):
+        self.pending: Dict[Any, deque] = defaultdict(deque)
+        self.latencies: List[float] = []
+        self.done = asyncio.Event()
+        self.expected = 0
+        self._original = join_pipeline.process_join_request
+
+    def started(self, chat_id: int, user_id: int) -> None:
+        self.pending[(chat_id, user_id)].append(time.perf_counter())
+
+    def install(self) -> None:
+        original = self._original
+
+        async def tracked(event, *args, **kwargs):
+            try:
+                return await original(event, *args, **kwargs)
+            finally:
+                starts = self.pending.get((event.chat.id, event.from_user.id))
+                if starts:
+                    self.latencies.append(time.perf_counter() - starts.popleft())
+                if len(self.latencies) >= self.expected:
+                    self.done.set()
+
+        join_pipeline.process_join_request = tracked
+
+    def uninstall(self) -> None:
+        join_pipeline.process_join_request = self._original
+
+
+# ---------------- UPDATE FACTORIES ----------------
+
+_update_ids = iter(range(1, 1 << 62))
+
+
+def user_dict(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+
+def join_update(chat_id: int, user_id: int) -> dict:
+    return {
+        "update_id": next(_update_ids),
+        "chat_join_request": {
+            "chat": {"id": chat_id, "type": "channel", "title": f"Bench {chat_id}"},
+            "from": user_dict(user_id),
+            "user_chat_id": user_id,
+            "date": int(time.time()),
+        },
+    }
+
+
+def callback_update(user_id: int, data: str) -> dict:
+    uid = next(_update_ids)
+    return {
+        "update_id": uid,
+        "callback_query": {
+            "id": str(uid),
+            "from": user_dict(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "plans",
+            },
+        },
+    }
+
+
+# ---------------- HARNESS ----------------
+
+
+class Harness:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.session = FakeTelegramSession(args.tg_latency_ms, args.retry_after_rate, args.retry_after)
+        self.bot = Bot(login.BOT_TOKEN, session=self.session)
+        self.store = LatencyStorage(persistence.STORE, args.db_latency_ms)
+        persistence.STORE = self.store
+        self.dp = None
+        self.stub_runner: Optional[web.AppRunner] = None
+        self.stub_app: Optional[web.Application] = None
+
+    async def __aenter__(self) -> "Harness":
+        self.stub_app = razorpay_stub.build_app(latency_ms=self.args.rzp_latency_ms)
+        self.stub_runner = web.AppRunner(self.stub_app)
+        await self.stub_runner.setup()
+        await web.TCPSite(self.stub_runner, "127.0.0.1", RAZORPAY_STUB_PORT).start()
+
+        self.dp = login.setup_dispatcher(self.bot)
+        login.start_services(self.dp)
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await login.stop_services(self.dp)
+        if self.stub_runner:
+            await self.stub_runner.cleanup()
+
+    async def seed_subscribers(self, user_ids) -> None:
+        exp = (datetime.now(timezone.utc) + timedelta(days=30)).isoformat()
+        now = datetime.now(timezone.utc).isoformat()
+        for uid in user_ids:
+            await self.store.inner.upsert_subscription(
+                {"user_id": uid, "plan_id": "pro", "plan_label": "⚡️ PRO", "expires_at": exp, "updated_at": now}
+            )
+
+    async def feed(self, updates: List[dict], rate: float, on_feed=None) -> List[float]:
+        """Feed updates as concurrent tasks (like polling) and return per-update handler latency."""
+        latencies: List[float] = []
+        tasks = []
+        interval = 1.0 / rate if rate else 0.0
+        start = time.perf_counter()
+
+        async def one(update: dict) -> None:
+            t0 = time.perf_counter()
+            await self.dp.feed_raw_update(self.bot, update)
+            latencies.append(time.perf_counter() - t0)
+
+        for i, update in enumerate(updates):
+            if interval:
+                delay = start + i * interval - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            if on_feed:
+                on_feed(update)
+            tasks.append(asyncio.create_task(one(update)))
+            if not interval and i % 500 == 499:
+                await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        return latencies
+
+
+# ---------------- SCENARIOS ----------------
+
+
+async def run_join_scenario(h: Harness, name: str, updates: List[dict]) -> Dict[str, Any]:
+    tracker = JoinTracker()
+    tracker.expected = len(updates)
+    tracker.install()
+    try:
+        started = time.perf_counter()
+
+        def on_feed(update: dict) -> None:
+            req = update["chat_join_request"]
+            tracker.started(req["chat"]["id"], req["from"]["id"])
+
+        await h.feed(updates, h.args.rate, on_feed)
+        try:
+            await asyncio.wait_for(tracker.done.wait(), h.args.timeout)
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.perf_counter() - started
+    finally:
+        tracker.uninstall()
+
+    return {
+        "scenario": name,
+        "updates": len(updates),
+        "completed": len(tracker.latencies),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_per_s": round(len(tracker.latencies) / elapsed, 1) if elapsed else 0.0,
+        **summarize_ms(tracker.latencies),
+    }
+
+
+async def scenario_viral_burst(h: Harness) -> Dict[str, Any]:
+    # one channel, a small repeating pool of mostly-subscribed users
+    pool = list(range(10_000, 10_000 + h.args.users))
+    await h.seed_subscribers(u for u in pool if random.random() < 0.9)
+    chat_id = -1001000000001
+    updates = [join_update(chat_id, random.choice(pool)) for _ in range(h.args.updates)]
+    return await run_join_scenario(h, "viral_burst", updates)
+
+
+async def scenario_owned_channel(h: Harness) -> Dict[str, Any]:
+    # one channel owned by a subscriber, every joiner unique and unsubscribed
+    owner_id, chat_id = 4_000_000, -1004000000001
+    await h.seed_subscribers([owner_id])
+    await h.store.inner.set_chat_owner(chat_id, owner_id)
+    updates = [join_update(chat_id, 4_100_000 + i) for i in range(h.args.updates)]
+    return await run_join_scenario(h, "owned_channel", updates)
+
+
+async def scenario_mostly_unsubscribed(h: Harness) -> Dict[str, Any]:
+    # many channels, mostly unique joiners, ~10% subscribed
+    base = 2_000_000
+    users = [base + i for i in range(h.args.updates)]
+    await h.seed_subscribers(u for u in users if random.random() < 0.1)
+    chats = [-1002000000000 - i for i in range(50)]
+    updates = [join_update(random.choice(chats), uid) for uid in users]
+    return await run_join_scenario(h, "mostly_unsubscribed", updates)
+
+
+async def scenario_payment_storm(h: Harness) -> Dict[str, Any]:
+    # every user taps Buy, then hammers Verify
+    users = [3_000_000 + i for i in range(max(1, h.args.updates // 10))]
+    started = time.perf_counter()
+    buy_lat = await h.feed([callback_update(u, "buy_pro") for u in users], h.args.rate)
+    verify_updates = [callback_update(u, "verify_pro") for u in users for _ in range(3)]
+    random.shuffle(verify_updates)
+    verify_lat = await h.feed(verify_updates, h.args.rate)
+    elapsed = time.perf_counter() - started
+    total = len(buy_lat) + len(verify_lat)
+    stub_links = len(h.stub_app[razorpay_stub.LINKS]) if h.stub_app else 0
+    return {
+        "scenario": "payment_storm",
+        "updates": total,
+        "completed": total,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_per_s": round(total / elapsed, 1) if elapsed else 0.0,
+        **summarize_ms(buy_lat + verify_lat),
+        "buy": summarize_ms(buy_lat),
+        "verify": summarize_ms(verify_lat),
+        "razorpay_links_created": stub_links,
+        "single_flight": {"buy": dict(login.BUY_FLIGHTS.stats), "verify": dict(login.VERIFY_FLIGHTS.stats)},
+    }
+
+
+# ---------------- STARTUP ----------------
+
+
+async def first_update_probe() -> Dict[str, float]:
+    """Dispatcher setup + first join request, timed from a cold import of login."""
+    exp = (datetime.now(timezone.utc) + timedelta(days=30)).isoformat()
+    await persistence.STORE.upsert_subscription(
+        {"user_id": 42, "plan_id": "pro", "plan_label": "⚡️ PRO", "expires_at": exp,
+         "updated_at": datetime.now(timezone.utc).isoformat()}
+    )
+    bot = Bot(login.BOT_TOKEN, session=FakeTelegramSession(0.0, 0.0, 1))
+
+    t0 = time.perf_counter()
+    dp = login.setup_dispatcher(bot)
+    login.start_services(dp)
+    setup_ms = (time.perf_counter() - t0) * 1000
+
+    tracker = JoinTracker()
+    tracker.expected = 1
+    tracker.install()
+    try:
+        tracker.started(-1005000000001, 42)
+        t1 = time.perf_counter()
+        await dp.feed_raw_update(bot, join_update(-1005000000001, 42))
+        await asyncio.wait_for(tracker.done.wait(), 30)
+        first_update_ms = (time.perf_counter() - t1) * 1000
+    finally:
+        tracker.uninstall()
+        await login.stop_services(dp)
+        await persistence.STORE.close()
+
+    return {"setup_ms": round(setup_ms, 3), "first_update_ms": round(first_update_ms, 3)}
+
+
+def measure_startup(runs: int) -> Dict[str, Any]:
+    """Spawn `runs` fresh interpreters and time each from exec to first handled update."""
+    import subprocess
+
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--startup-child"],
+            capture_output=True, text=True, check=True, env=os.environ.copy(),
+        ).stdout
+        child = json.loads(out.strip().splitlines()[-1])
+        child["process_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        samples.append(child)
+
+    def median(key: str) -> float:
+        values = sorted(s[key] for s in samples)
+        return values[len(values) // 2]
+
+    return {
+        "runs": runs,
+        **{f"{key}_median": median(key) for key in ("import_ms", "setup_ms", "first_update_ms", "process_ms")},
+        "samples": samples,
+    }
+
+
+SCENARIOS = {
+    "viral_burst": scenario_viral_burst,
+    "owned_channel": scenario_owned_channel,
+    "mostly_unsubscribed": scenario_mostly_unsubscribed,
+    "payment_storm": scenario_payment_storm,
+}
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    results = []
+    for name in args.scenarios or list(SCENARIOS):
+        subscriptions.SUB_CACHE.clear()
+        chat_owners.CHAT_OWNERS.clear()
+        persistence.STORE = make_storage("memory")
+        async with Harness(args) as h:
+            lag = LoopLagMonitor()
+            lag.start()
+            result = await SCENARIOS[name](h)
+            await lag.stop()
+            result["loop_lag"] = summarize_ms(lag.samples)
+            result["storage_calls"] = dict(h.store.calls)
+            result["bot_api_calls"] = dict(h.session.calls)
+            result["bot_api_retry_after"] = h.session.retry_afters
+            result["outbound"] = {
+                lane: dict(stats) for lane, stats in h.dp["outbound"].stats.items()
+            }
+            result["sub_cache"] = subscriptions.SUB_CACHE.stats()
+            result["join_events"] = dict(h.dp["join_events"].stats)
+            result["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+            results.append(result)
+        await persistence.STORE.close()
+
+    return {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "config": {
+            k: v for k, v in vars(args).items() if k not in ("out", "scenarios", "startup_child")
+        },
+        "startup": measure_startup(args.startup_runs) if args.startup_runs else None,
+        "results": results,
+    }
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Join-request / payment benchmark")
+    parser.add_argument("scenarios", nargs="*", help=f"any of {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--updates", type=int, default=5000, help="updates per scenario")
+    parser.add_argument("--users", type=int, default=500, help="user pool for viral_burst")
+    parser.add_argument("--rate", type=float, default=0.0, help="updates/sec fed in (0 = one burst)")
+    parser.add_argument("--tg-latency-ms", type=float, default=30.0)
+    parser.add_argument("--retry-after-rate", type=float, default=0.0, help="fraction of Bot API calls answered 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--db-latency-ms", type=float, default=20.0)
+    parser.add_argument("--rzp-latency-ms", type=float, default=150.0)
+    parser.add_argument("--timeout", type=float, default=120.0, help="max seconds to wait for completion")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default=None, help="write JSON here instead of stdout")
+    parser.add_argument("--startup-runs", type=int, default=3, help="cold-start samples in fresh processes (0 = skip)")
+    parser.add_argument("--startup-child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.startup_child:
+        probe = asyncio.run(first_update_probe())
+        print(json.dumps({"import_ms": round(LOGIN_IMPORT_MS, 3), **probe}))
+        sys.exit(0)
+    random.seed(args.seed)
+    report = asyncio.run(run(args))
+    payload = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            fh.write(payload)
+    else:
+        print(payload)
@@ -0,0 +1,148 @@
+"""
+Circuit breakers around the bot's two remote dependencies, storage and
+Razorpay, so an outage fails fast instead of stacking up timed-out calls.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from config import (
+    BREAKER_FAILURES,
+    BREAKER_MIN_TIMEOUT,
+    BREAKER_RESET_SECONDS,
+    RAZORPAY_FETCH_TIMEOUT,
+    SUPABASE_TIMEOUT,
+)
+from metrics import BREAKER_OPENED, BREAKER_REJECTED
+
+log = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str):
+        super().__init__(f"{name} circuit open")
+        self.name = name
+
+
+class CircuitBreaker:
+    """
+    closed → (`failure_threshold` consecutive failures) → open → (`reset_timeout`)
+    → half-open. While open every call fails fast; half-open lets one probe
+    through and its outcome closes the circuit or re-opens it for twice as long.
+
+    The call timeout follows observed latency (smoothed latency + 4× its mean
+    deviation, like TCP's RTO) within [min_timeout, max_timeout], so a
+    brownout costs a few hundred ms per call instead of the full timeout.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+    STATE_NAMES = ("closed", "half_open", "open")
+
+    def __init__(
+        self,
+        name: str,
+        max_timeout: float,
+        min_timeout: float = BREAKER_MIN_TIMEOUT,
+        failure_threshold: int = BREAKER_FAILURES,
+        reset_timeout: float = BREAKER_RESET_SECONDS,
+    ):
+        self.name = name
+        self.max_timeout = max_timeout
+        self.min_timeout = min(min_timeout, max_timeout)
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._open_for = reset_timeout
+        self._open_until = 0.0
+        self._probe_started: Optional[float] = None
+        self._srtt: Optional[float] = None
+        self._rttvar = 0.0
+
+    @property
+    def timeout(self) -> float:
+        if self._srtt is None:
+            return self.max_timeout
+        return min(self.max_timeout, max(self.min_timeout, self._srtt + 4 * self._rttvar))
+
+    def allow(self) -> None:
+        if self.state == self.CLOSED:
+            return
+        now = time.monotonic()
+        if self.state == self.OPEN and now >= self._open_until:
+            self.state = self.HALF_OPEN
+            self._probe_started = None
+        # one probe at a time; a probe that never reported back is replaced
+        if self.state == self.HALF_OPEN and (
+            self._probe_started is None or now - self._probe_started > 2 * self.max_timeout
+        ):
+            self._probe_started = now
+            return
+        BREAKER_REJECTED.inc(dependency=self.name)
+        raise CircuitOpenError(self.name)
+
+    def record_success(self, seconds: float) -> None:
+        if self._srtt is None:
+            self._srtt, self._rttvar = seconds, seconds / 2
+        else:
+            self._rttvar = 0.75 * self._rttvar + 0.25 * abs(self._srtt - seconds)
+            self._srtt = 0.875 * self._srtt + 0.125 * seconds
+        self.failures = 0
+        if self.state != self.CLOSED:
+            log.info("%s circuit closed", self.name)
+            self.state = self.CLOSED
+            self._open_for = self.reset_timeout
+            self._probe_started = None
+
+    def record_failure(self, timed_out: bool = False) -> None:
+        if timed_out and self._srtt is not None:
+            # back the timeout off like an RTO, so a slower-but-alive dependency isn't cut short forever
+            self._srtt = min(self.max_timeout, self._srtt * 2)
+        self.failures += 1
+        if self.state == self.HALF_OPEN:
+            self._open_for = min(self._open_for * 2, self.reset_timeout * 8)
+        elif self.failures < self.failure_threshold:
+            return
+        if self.state != self.OPEN:
+            BREAKER_OPENED.inc(dependency=self.name)
+            log.warning("%s circuit open for %.0fs after %d failures", self.name, self._open_for, self.failures)
+        self.state = self.OPEN
+        self._open_until = time.monotonic() + self._open_for
+        self._probe_started = None
+
+    def retry_after(self) -> float:
+        # seconds until an open circuit lets its next probe through; 0 when it isn't open
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self._open_until - time.monotonic())
+
+    async def call(self, fn, *args, **kwargs):
+        self.allow()
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(fn(*args, **kwargs), self.timeout)
+        except asyncio.TimeoutError:
+            self.record_failure(timed_out=True)
+            raise
+        except asyncio.CancelledError:
+            self._probe_started = None
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success(time.monotonic() - started)
+        return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "state": self.STATE_NAMES[self.state],
+            "failures": self.failures,
+            "timeout_s": round(self.timeout, 3),
+        }
+
+
+STORAGE_BREAKER = CircuitBreaker("storage", max_timeout=SUPABASE_TIMEOUT)
+RAZORPAY_BREAKER = CircuitBreaker("razorpay", max_timeout=RAZORPAY_FETCH_TIMEOUT)
+BREAKERS = (STORAGE_BREAKER, RAZORPAY_BREAKER)
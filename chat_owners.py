@@ -0,0 +1,84 @@
+"""
+chat_id → owner lookups over the `chat_owners` table, cached in front of storage.
+"""
+
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from config import CHAT_OWNER_CACHE_SIZE, CHAT_OWNER_NEGATIVE_TTL, CHAT_OWNER_TTL
+from persistence import sp_delete_chat_owner, sp_fetch_chat_owners, sp_set_chat_owner
+
+log = logging.getLogger(__name__)
+
+
+class ChatOwnerIndex:
+    """
+    chat_id → subscriber who added the bot, backed by the `chat_owners` table.
+
+    Join requests in an owned chat are gated on the owner's plan, so a burst
+    into one channel costs one owner lookup plus one (cached) plan lookup.
+    Chats without a recorded owner are cached as negative entries, and they,
+    like chats whose owner's plan has lapsed, fall back to gating on each
+    joiner's own plan.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, negative_ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries: "OrderedDict[int, Tuple[float, Optional[int]]]" = OrderedDict()
+
+    def _put(self, chat_id: int, owner_id: Optional[int]) -> None:
+        ttl = self.ttl if owner_id is not None else self.negative_ttl
+        self._entries[chat_id] = (time.time() + ttl, owner_id)
+        self._entries.move_to_end(chat_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def get_owners(self, chat_ids) -> Dict[int, Optional[int]]:
+        owners: Dict[int, Optional[int]] = {}
+        missing: List[int] = []
+        now = time.time()
+        for chat_id in set(chat_ids):
+            entry = self._entries.get(chat_id)
+            if entry is not None and now < entry[0]:
+                self._entries.move_to_end(chat_id)
+                owners[chat_id] = entry[1]
+            else:
+                missing.append(chat_id)
+
+        if not missing:
+            return owners
+
+        try:
+            rows = await sp_fetch_chat_owners(missing)
+        except Exception as ex:
+            # unknown for now (joiner fallback), but don't cache the outage
+            log.warning("sp_fetch_chat_owners error: %s", ex)
+            for chat_id in missing:
+                owners[chat_id] = None
+            return owners
+
+        for chat_id in missing:
+            owners[chat_id] = rows.get(chat_id)
+            self._put(chat_id, owners[chat_id])
+        return owners
+
+    async def set_owner(self, chat_id: int, owner_id: int) -> None:
+        await sp_set_chat_owner(chat_id, owner_id)
+        self._put(chat_id, owner_id)
+
+    async def remove(self, chat_id: int) -> None:
+        await sp_delete_chat_owner(chat_id)
+        self._put(chat_id, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+CHAT_OWNERS = ChatOwnerIndex(CHAT_OWNER_CACHE_SIZE, CHAT_OWNER_TTL, CHAT_OWNER_NEGATIVE_TTL)
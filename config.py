@@ -0,0 +1,167 @@
+"""
+Bot settings, read once from the environment (and .env) at import.
+
+Every other module takes its configuration from here; the comment above
+each group says what it controls.
+"""
+
+import os
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+BOT_USERNAME = os.getenv("BOT_USERNAME")  # without @ e.g. Getai_approvedbot
+
+# MTProto user session (Telethon) – only needed for the backlog approver
+API_ID = int(os.getenv("API_ID") or "0")
+API_HASH = os.getenv("API_HASH", "")
+SESSION_DIR = os.getenv("SESSION_DIR", ".")
+BACKLOG_SESSION = os.getenv("BACKLOG_SESSION", "auto_approve_bot")
+BACKLOG_CHATS = [c.strip() for c in os.getenv("BACKLOG_CHATS", "").split(",") if c.strip()]  # drained on startup
+BACKLOG_PAGE_SIZE = int(os.getenv("BACKLOG_PAGE_SIZE", "100"))
+BACKLOG_CONCURRENCY = int(os.getenv("BACKLOG_CONCURRENCY", "10"))
+
+SUPABASE_URL = os.getenv("SUPABASE_URL", "")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY") or os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
+
+RAZORPAY_KEY_ID = os.getenv("RAZORPAY_KEY_ID", "")
+RAZORPAY_KEY_SECRET = os.getenv("RAZORPAY_KEY_SECRET", "")
+RAZORPAY_API_BASE = os.getenv("RAZORPAY_API_BASE", "https://api.razorpay.com/v1")  # point at razorpay_stub.py locally
+RAZORPAY_CREATE_TIMEOUT = float(os.getenv("RAZORPAY_CREATE_TIMEOUT", "10"))
+RAZORPAY_FETCH_TIMEOUT = float(os.getenv("RAZORPAY_FETCH_TIMEOUT", "5"))
+RAZORPAY_MAX_RETRIES = int(os.getenv("RAZORPAY_MAX_RETRIES", "3"))
+RAZORPAY_MAX_CONNECTIONS = int(os.getenv("RAZORPAY_MAX_CONNECTIONS", "20"))
+
+PLAN_DURATION_DAYS = int(os.getenv("PLAN_DURATION_DAYS", "30"))
+BASIC_PRICE_PAISE = int(os.getenv("BASIC_PRICE_PAISE", "69900"))
+PRO_PRICE_PAISE = int(os.getenv("PRO_PRICE_PAISE", "149900"))
+PREMIUM_PRICE_PAISE = int(os.getenv("PREMIUM_PRICE_PAISE", "249900"))
+PLAN_CATALOG_PATH = os.getenv("PLAN_CATALOG_PATH", "")  # JSON plan list; unset = built-in BASIC/PRO/PREMIUM above
+PLAN_CATALOG_POLL = float(os.getenv("PLAN_CATALOG_POLL", "10"))  # seconds between reload checks (0 = no hot reload)
+
+# storage backend: "supabase" (default), "sqlite" (local file) or "memory" – see storage.py
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase")
+STORAGE_SQLITE_PATH = os.getenv("STORAGE_SQLITE_PATH", "bot.sqlite3")
+
+# Supabase Realtime listener: other bots' writes to the shared tables refresh/drop
+# cached plans immediately (lets SUB_CACHE_TTL be raised safely); heartbeat in seconds
+REALTIME_ENABLED = os.getenv("REALTIME_ENABLED", "1" if STORAGE_BACKEND == "supabase" else "0") == "1"
+REALTIME_HEARTBEAT = float(os.getenv("REALTIME_HEARTBEAT", "25"))
+
+# per-call timeout (seconds) for every Supabase round trip
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "5"))
+
+# in-process subscription cache (seconds / entries)
+SUB_CACHE_SIZE = int(os.getenv("SUB_CACHE_SIZE", "50000"))
+SUB_CACHE_TTL = float(os.getenv("SUB_CACHE_TTL", "300"))
+SUB_CACHE_NEGATIVE_TTL = float(os.getenv("SUB_CACHE_NEGATIVE_TTL", "60"))
+
+# startup warm-up of the subscription cache (rows per page, time budget in seconds);
+# SUB_SNAPSHOT_PATH (e.g. subs.snapshot) enables a binary snapshot written on shutdown and loaded on the next start
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "1") == "1"
+WARMUP_PAGE_SIZE = int(os.getenv("WARMUP_PAGE_SIZE", "1000"))
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "30"))
+SUB_SNAPSHOT_PATH = os.getenv("SUB_SNAPSHOT_PATH", "")
+
+# chat_id → owner index cache (seconds / entries); chats with no recorded owner are re-checked after the negative TTL
+CHAT_OWNER_CACHE_SIZE = int(os.getenv("CHAT_OWNER_CACHE_SIZE", "20000"))
+CHAT_OWNER_TTL = float(os.getenv("CHAT_OWNER_TTL", "3600"))
+CHAT_OWNER_NEGATIVE_TTL = float(os.getenv("CHAT_OWNER_NEGATIVE_TTL", "300"))
+
+# circuit breakers around storage / Razorpay: consecutive failures before opening, seconds open
+# before a half-open probe, adaptive-timeout floor (the ceiling is each dependency's own timeout)
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "10"))
+BREAKER_MIN_TIMEOUT = float(os.getenv("BREAKER_MIN_TIMEOUT", "1"))
+# while storage is failing, cached plans are served up to this long past their TTL
+SUB_STALE_SECONDS = float(os.getenv("SUB_STALE_SECONDS", "3600"))
+
+# max ids per `user_id IN (...)` query (keeps the PostgREST URL short)
+SUPABASE_IN_CHUNK = int(os.getenv("SUPABASE_IN_CHUNK", "200"))
+
+# join-request pipeline: micro-batch size / flush window, intake bound, approval workers
+JOIN_BATCH_SIZE = int(os.getenv("JOIN_BATCH_SIZE", "100"))
+JOIN_FLUSH_MS = float(os.getenv("JOIN_FLUSH_MS", "10"))
+JOIN_QUEUE_SIZE = int(os.getenv("JOIN_QUEUE_SIZE", "10000"))
+JOIN_WORKERS = int(os.getenv("JOIN_WORKERS", "16"))
+
+# Join event log: one row per processed request, bulk-inserted every JOIN_EVENTS_FLUSH_SECONDS
+# or JOIN_EVENTS_BATCH rows; past JOIN_EVENTS_BUFFER buffered rows new events are dropped (counted).
+# /stats is served from in-memory hourly counters for up to JOIN_STATS_MAX_CHATS chats.
+JOIN_EVENTS_ENABLED = os.getenv("JOIN_EVENTS_ENABLED", "1") == "1"
+JOIN_EVENTS_BATCH = int(os.getenv("JOIN_EVENTS_BATCH", "500"))
+JOIN_EVENTS_FLUSH_SECONDS = float(os.getenv("JOIN_EVENTS_FLUSH_SECONDS", "2"))
+JOIN_EVENTS_BUFFER = int(os.getenv("JOIN_EVENTS_BUFFER", "20000"))
+JOIN_STATS_MAX_CHATS = int(os.getenv("JOIN_STATS_MAX_CHATS", "10000"))
+
+# outbound Bot API scheduler (rates are calls/sec)
+TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "30"))
+TG_APPROVE_CHAT_RATE = float(os.getenv("TG_APPROVE_CHAT_RATE", "20"))
+TG_DM_CHAT_RATE = float(os.getenv("TG_DM_CHAT_RATE", "1"))
+TG_DM_QUEUE_SIZE = int(os.getenv("TG_DM_QUEUE_SIZE", "2000"))
+TG_DM_MAX_AGE = float(os.getenv("TG_DM_MAX_AGE", "60"))
+TG_MAX_INFLIGHT = int(os.getenv("TG_MAX_INFLIGHT", "32"))
+TG_MAX_RETRIES = int(os.getenv("TG_MAX_RETRIES", "5"))
+
+# DM suppression: a repeated "no active plan" DM to the same user is skipped for DM_DEDUP_WINDOW
+# seconds (0 disables; Bloom filter sized for DM_DEDUP_CAPACITY users per window), and users
+# Telegram refused a DM for (never /start-ed, blocked the bot) get none for DM_UNREACHABLE_TTL seconds
+DM_DEDUP_WINDOW = float(os.getenv("DM_DEDUP_WINDOW", "3600"))
+DM_DEDUP_CAPACITY = int(os.getenv("DM_DEDUP_CAPACITY", "100000"))
+DM_UNREACHABLE_TTL = float(os.getenv("DM_UNREACHABLE_TTL", "86400"))
+
+# Renewal reminders: DMs go out this many hours before a plan expires (empty = none), paced at
+# RENEWAL_DM_RATE per second and re-checked against storage RENEWAL_BATCH_SIZE users at a time
+RENEWAL_REMINDER_HOURS = [float(h) for h in os.getenv("RENEWAL_REMINDER_HOURS", "72,12").split(",") if h.strip()]
+RENEWAL_DM_RATE = float(os.getenv("RENEWAL_DM_RATE", "5"))
+RENEWAL_BATCH_SIZE = int(os.getenv("RENEWAL_BATCH_SIZE", "200"))
+
+# Sharded mode: an intake process receives updates and fans them out by chat to SHARD_WORKERS
+# worker processes (0 = handle everything in one process; overridable with --workers). Workers
+# borrow the global Bot API budget from the intake in SHARD_LEASE_SECONDS-sized leases.
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "0"))
+SHARD_SOCKET = os.getenv("SHARD_SOCKET", "bot-shards.sock")  # unix socket between intake and workers
+SHARD_LEASE_SECONDS = float(os.getenv("SHARD_LEASE_SECONDS", "0.1"))
+SHARD_RESPAWN_MAX = float(os.getenv("SHARD_RESPAWN_MAX", "30"))  # cap on the restart backoff for a dead worker
+
+# update ingestion: "polling" or "webhook" (overridable with --mode)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")  # public https://host Telegram can reach
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/tg/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_ENABLED = bool(os.getenv("WEB_PORT"))  # polling mode starts the HTTP server only if WEB_PORT is set (or a Razorpay webhook is configured)
+WEB_PORT = int(os.getenv("WEB_PORT") or "8080")
+
+# Razorpay `payment_link.paid` webhook (enables instant activation; Verify then answers locally)
+RAZORPAY_WEBHOOK_SECRET = os.getenv("RAZORPAY_WEBHOOK_SECRET", "")
+RAZORPAY_WEBHOOK_PATH = os.getenv("RAZORPAY_WEBHOOK_PATH", "/razorpay/webhook")
+
+# background reconciliation of unverified payment links (SWEEP_INTERVAL=0 disables)
+SWEEP_INTERVAL = float(os.getenv("SWEEP_INTERVAL", "300"))
+SWEEP_CONCURRENCY = int(os.getenv("SWEEP_CONCURRENCY", "5"))
+SWEEP_PAGE_SIZE = int(os.getenv("SWEEP_PAGE_SIZE", "200"))
+PAYMENT_LINK_TTL_HOURS = float(os.getenv("PAYMENT_LINK_TTL_HOURS", "48"))  # older unpaid links are cancelled at Razorpay
+
+# Razorpay payment-link fetches are memoized this long (seconds) for Verify taps / the sweeper
+PAYMENT_FETCH_MEMO_SECONDS = float(os.getenv("PAYMENT_FETCH_MEMO_SECONDS", "3"))
+
+# logging: level, json | text, per-template rate limit (records per window seconds), writer queue bound
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_RATE_LIMIT = int(os.getenv("LOG_RATE_LIMIT", "20"))
+LOG_RATE_WINDOW = float(os.getenv("LOG_RATE_WINDOW", "10"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# per-update trace spans (logged for updates slower than TRACE_SLOW_MS)
+TRACE_UPDATES = os.getenv("TRACE_UPDATES", "0") == "1"
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "250"))
+
+if not BOT_TOKEN:
+    raise RuntimeError("❌ BOT_TOKEN missing in .env file")
+
+if STORAGE_BACKEND == "supabase":
+    assert SUPABASE_URL and SUPABASE_KEY, "Set SUPABASE_URL and SUPABASE_KEY / SUPABASE_SERVICE_ROLE_KEY in .env"
@@ -0,0 +1,191 @@
+"""
+Join request outcomes: a write-behind log into the `join_events` table and
+the per-chat hourly counters behind /stats.
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from config import (
+    JOIN_EVENTS_BATCH,
+    JOIN_EVENTS_BUFFER,
+    JOIN_EVENTS_ENABLED,
+    JOIN_EVENTS_FLUSH_SECONDS,
+    JOIN_STATS_MAX_CHATS,
+)
+from persistence import sp_insert_join_events
+
+log = logging.getLogger(__name__)
+
+
+JOIN_OUTCOMES = ("approved", "no_plan", "unknown", "failed")
+_OUTCOME_INDEX = {name: i for i, name in enumerate(JOIN_OUTCOMES)}
+
+
+class ChatCounters:
+    """Per-chat outcome counts in 24 hourly slots (a ring indexed by hour % 24)."""
+
+    __slots__ = ("title", "hours", "counts", "latency_ms")
+
+    def __init__(self, title: Optional[str]):
+        self.title = title
+        self.hours = [-1] * 24
+        self.counts = [[0] * len(JOIN_OUTCOMES) for _ in range(24)]
+        self.latency_ms = [0.0] * 24
+
+    def add(self, hour: int, outcome: int, latency_ms: float) -> None:
+        slot = hour % 24
+        if self.hours[slot] != hour:
+            self.hours[slot] = hour
+            self.counts[slot] = [0] * len(JOIN_OUTCOMES)
+            self.latency_ms[slot] = 0.0
+        self.counts[slot][outcome] += 1
+        self.latency_ms[slot] += latency_ms
+
+    def window(self, hour: int, hours: int) -> Tuple[List[int], float]:
+        """Outcome counts and mean latency over the last `hours` hours (current one included)."""
+        totals = [0] * len(JOIN_OUTCOMES)
+        latency = 0.0
+        for slot in range(24):
+            if hour - hours < self.hours[slot] <= hour:
+                totals = [a + b for a, b in zip(totals, self.counts[slot])]
+                latency += self.latency_ms[slot]
+        n = sum(totals)
+        return totals, (latency / n if n else 0.0)
+
+
+class JoinEventLog:
+    """
+    Write-behind log of join-request outcomes.
+
+    record() only appends to a bounded in-memory buffer and bumps the chat's
+    rolling counters; a background task bulk-inserts the buffer every
+    `flush_interval` seconds, or as soon as `batch_size` rows are waiting.
+    Past `capacity` buffered rows new events are dropped and counted, and a
+    failed insert puts its rows back in front as far as capacity allows.
+
+    `sink` is sp_insert_join_events; shard workers relay to the intake instead,
+    which then holds the counters /stats is served from.
+    """
+
+    MAX_CHATS = JOIN_STATS_MAX_CHATS
+
+    def __init__(
+        self,
+        enabled: bool = JOIN_EVENTS_ENABLED,
+        batch_size: int = JOIN_EVENTS_BATCH,
+        flush_interval: float = JOIN_EVENTS_FLUSH_SECONDS,
+        capacity: int = JOIN_EVENTS_BUFFER,
+    ):
+        self.enabled = enabled
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.capacity = max(self.batch_size, capacity)
+        self.sink = sp_insert_join_events
+        self.chats: "OrderedDict[int, ChatCounters]" = OrderedDict()
+        self.stats: Dict[str, int] = {"recorded": 0, "written": 0, "dropped": 0, "flush_errors": 0}
+        self._buffer: deque = deque()
+        self._flush_now = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, chat_id: int, chat_title: Optional[str], user_id: int, outcome: str, latency_ms: float) -> None:
+        self.ingest(
+            [
+                {
+                    "chat_id": chat_id,
+                    "chat_title": chat_title,
+                    "user_id": user_id,
+                    "outcome": outcome,
+                    "latency_ms": round(latency_ms, 2),
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                }
+            ]
+        )
+
+    def ingest(self, rows: List[dict]) -> None:
+        hour = int(time.time() // 3600)
+        for row in rows:
+            self.stats["recorded"] += 1
+            self._count(hour, row)
+            if not self.enabled:
+                continue
+            if len(self._buffer) >= self.capacity:
+                self.stats["dropped"] += 1
+                continue
+            self._buffer.append(row)
+        if len(self._buffer) >= self.batch_size:
+            self._flush_now.set()
+
+    def _count(self, hour: int, row: dict) -> None:
+        chat_id = row["chat_id"]
+        counters = self.chats.get(chat_id)
+        if counters is None:
+            counters = self.chats[chat_id] = ChatCounters(row.get("chat_title"))
+            if len(self.chats) > self.MAX_CHATS:
+                self.chats.popitem(last=False)
+        else:
+            self.chats.move_to_end(chat_id)
+            counters.title = row.get("chat_title") or counters.title
+        counters.add(hour, _OUTCOME_INDEX.get(row["outcome"], _OUTCOME_INDEX["failed"]), row.get("latency_ms") or 0.0)
+
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    async def flush(self) -> None:
+        while self._buffer:
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            try:
+                await self.sink(batch)
+            except Exception as ex:
+                self.stats["flush_errors"] += 1
+                log.warning("Join event flush error (%d rows): %s", len(batch), ex)
+                room = max(0, self.capacity - len(self._buffer))
+                self.stats["dropped"] += max(0, len(batch) - room)
+                self._buffer.extendleft(reversed(batch[:room]))
+                return
+            self.stats["written"] += len(batch)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        if self.enabled:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._buffer:
+            try:
+                await asyncio.wait_for(self.flush(), 5)
+            except asyncio.TimeoutError:
+                log.warning("Join event log: %d rows not flushed at shutdown", len(self._buffer))
+
+    def render_stats(self, chat_ids: List[int]) -> str:
+        hour = int(time.time() // 3600)
+        blocks = []
+        for chat_id in chat_ids:
+            counters = self.chats.get(chat_id)
+            if counters is None:
+                blocks.append(f"📊 **{chat_id}**\nPichhle 24 ghante me koi join request nahi.")
+                continue
+            lines = [f"📊 **{counters.title or chat_id}**"]
+            for label, hours in (("1h", 1), ("24h", 24)):
+                totals, latency = counters.window(hour, hours)
+                approved = totals[_OUTCOME_INDEX["approved"]]
+                skipped = sum(totals) - approved
+                lines.append(f"`{label}`: ✅ {approved} approved · ⏸ {skipped} skipped · ⏱ {latency:.0f} ms avg")
+            blocks.append("\n".join(lines))
+        return "\n\n".join(blocks)
@@ -0,0 +1,185 @@
+"""
+Join request gating: batches incoming requests, looks up the deciding plan
+once per batch, and approves or rejects each through the outbound scheduler.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from aiogram.types import ChatJoinRequest
+
+from config import JOIN_BATCH_SIZE, JOIN_FLUSH_MS, JOIN_QUEUE_SIZE, JOIN_WORKERS
+from logs import bind_log_context
+from breakers import STORAGE_BREAKER, CircuitBreaker
+from subscriptions import SubState, get_subscription_states
+from chat_owners import CHAT_OWNERS
+from outbound import OutboundScheduler
+from join_events import JoinEventLog
+
+log = logging.getLogger(__name__)
+
+
+async def process_join_request(event: ChatJoinRequest, outbound: OutboundScheduler, active: Optional[bool]) -> str:
+    # returns the outcome recorded in the join event log (one of JOIN_OUTCOMES)
+    user_id = event.from_user.id
+
+    # 🔒 subscription gate
+    if active is None:
+        # plan state unknown (storage outage) – don't tell a paying user they have no plan
+        log.warning("Skip auto-approve for user %s: plan state unavailable, request left pending", user_id)
+        return "unknown"
+
+    if not active:
+        log.info("Skip auto-approve for user %s: no active plan", user_id)
+        # repeat rejections within DM_DEDUP_WINDOW and users who never /start-ed are suppressed by the scheduler
+        outbound.send_dm(
+            user_id,
+            "🔒 **No active subscription found.**\n\n"
+            "Aapka join request abhi auto-approve nahi ho sakta.\n"
+            "👉 Pehle `/upgrade` command run karke plan purchase karein,\n"
+            "phir dobara join request bhejein.",
+            dedup_key=f"no_plan:{user_id}",
+            parse_mode="Markdown",
+        )
+        return "no_plan"
+
+    # ✅ user has active plan → approve
+    try:
+        await outbound.approve_join(event.chat.id, user_id)
+    except Exception as e:
+        log.error("Error approving join request: %s", e)
+        return "failed"
+
+    outbound.send_dm(
+        user_id,
+        f"✅ Your request to join **{event.chat.title}** has been approved automatically.",
+        parse_mode="Markdown",
+    )
+    return "approved"
+
+
+class JoinRequestPipeline:
+    """
+    intake queue → micro-batcher (one bulk plan lookup per batch) → approval workers.
+
+    Each request is gated on its chat owner's plan (ChatOwnerIndex), or on the
+    joiner's own plan when the chat has no recorded owner or the owner's plan
+    is no longer active.
+
+    Both queues are bounded, so a burst that outruns Telegram/Supabase slows
+    `submit()` down instead of growing memory without limit. Every outcome,
+    with its latency from submit(), goes to the join event log.
+
+    While the storage circuit (`breaker`) is open, what each owner's plan
+    resolved to (stale or unknown) is held until the breaker may probe again,
+    instead of being looked up on every batch.
+    """
+
+    def __init__(
+        self,
+        outbound: OutboundScheduler,
+        events: JoinEventLog,
+        batch_size: int = JOIN_BATCH_SIZE,
+        flush_interval: float = JOIN_FLUSH_MS / 1000,
+        queue_size: int = JOIN_QUEUE_SIZE,
+        workers: int = JOIN_WORKERS,
+        breaker: CircuitBreaker = STORAGE_BREAKER,
+    ):
+        self.outbound = outbound
+        self.events = events
+        self.breaker = breaker
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.workers = max(1, workers)
+        self.intake: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.ready: asyncio.Queue = asyncio.Queue(maxsize=self.workers * 4)
+        self._tasks: List[asyncio.Task] = []
+        self._held: Dict[int, Tuple[bool, Optional[SubState]]] = {}  # owner → (known, state)
+        self._held_until = 0.0
+
+    async def submit(self, event: ChatJoinRequest) -> None:
+        await self.intake.put((event, time.perf_counter()))
+
+    def start(self) -> None:
+        self._tasks.append(asyncio.create_task(self._batcher()))
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def _next_batch(self) -> List[Tuple[ChatJoinRequest, float]]:
+        loop = asyncio.get_running_loop()
+        batch = [await self.intake.get()]
+        deadline = loop.time() + self.flush_interval
+
+        while len(batch) < self.batch_size:
+            if self.intake.empty():
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                await asyncio.sleep(remaining)
+                if self.intake.empty():
+                    break
+            batch.append(self.intake.get_nowait())
+        return batch
+
+    async def _batcher(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            now = time.time()
+            try:
+                owners = await CHAT_OWNERS.get_owners(e.chat.id for e, _ in batch)
+                held = self._held_states()
+                # distinct gate ids: one per owned chat, one per joiner elsewhere
+                gates = [owners.get(e.chat.id) or e.from_user.id for e, _ in batch]
+                looked_up = set(gates)
+                states = {g: held[g][1] for g in looked_up if g in held and held[g][0]}
+                states.update(await get_subscription_states(g for g in looked_up if g not in held))
+                # an owner whose plan lapsed gates nothing: those joiners fall back to their own plan
+                lapsed = {o for o in owners.values() if o in states and not (states[o] and states[o].is_active(now))}
+                gates = [e.from_user.id if g in lapsed else g for (e, _), g in zip(batch, gates)]
+                missing = [g for g in gates if g not in looked_up]
+                if missing:
+                    states.update(await get_subscription_states(missing))
+                self._hold(owners.values(), states)
+            except Exception as ex:
+                log.error("Join pipeline lookup error: %s", ex)
+                gates, states = [e.from_user.id for e, _ in batch], {}
+
+            for (event, received), gate_id in zip(batch, gates):
+                state = states.get(gate_id)
+                active = bool(state and state.is_active(now)) if gate_id in states else None
+                await self.ready.put((event, received, active))
+
+    def _held_states(self) -> Dict[int, Tuple[bool, Optional[SubState]]]:
+        if self._held and time.monotonic() >= self._held_until:
+            self._held.clear()
+        return self._held
+
+    def _hold(self, owner_ids, states: Dict[int, Optional[SubState]]) -> None:
+        wait = self.breaker.retry_after()
+        if wait <= 0:
+            return
+        for owner_id in owner_ids:
+            if owner_id is not None and owner_id not in self._held:
+                self._held[owner_id] = (owner_id in states, states.get(owner_id))
+        self._held_until = time.monotonic() + wait
+
+    async def _worker(self) -> None:
+        while True:
+            event, received, active = await self.ready.get()
+            bind_log_context(chat_id=event.chat.id, user_id=event.from_user.id)
+            try:
+                outcome = await process_join_request(event, self.outbound, active)
+            except Exception as ex:
+                log.exception("Join pipeline worker error: %s", ex)
+                outcome = "failed"
+            self.events.record(
+                event.chat.id, event.chat.title, event.from_user.id, outcome, (time.perf_counter() - received) * 1000
+            )
@@ -1,303 +1,379 @@
+import argparse
 import asyncio
+import json
+import logging
 import os
-from datetime import datetime, timezone, timedelta
-from typing import Optional, List, Dict, Any
-
-from dotenv import load_dotenv
+import signal
+from typing import Dict, List, NamedTuple, Optional, Tuple
 
 from aiogram import Bot, Dispatcher, F
-from aiogram.filters import CommandStart, Command
+from aiogram.enums import ChatMemberStatus
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import Command, CommandStart
 from aiogram.types import (
-    Message,
+    CallbackQuery,
     ChatJoinRequest,
-    InlineKeyboardMarkup,
+    ChatMemberUpdated,
     InlineKeyboardButton,
-    CallbackQuery,
+    InlineKeyboardMarkup,
+    Message,
 )
-from supabase import create_client, Client
-import razorpay
-
-# ---------------- ENV LOAD ----------------
-
-load_dotenv()
-
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-BOT_USERNAME = os.getenv("BOT_USERNAME")  # without @ e.g. Getai_approvedbot
-
-SUPABASE_URL = os.getenv("SUPABASE_URL", "")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY") or os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
-
-RAZORPAY_KEY_ID = os.getenv("RAZORPAY_KEY_ID", "")
-RAZORPAY_KEY_SECRET = os.getenv("RAZORPAY_KEY_SECRET", "")
-
-PLAN_DURATION_DAYS = int(os.getenv("PLAN_DURATION_DAYS", "30"))
-BASIC_PRICE_PAISE = int(os.getenv("BASIC_PRICE_PAISE", "69900"))
-PRO_PRICE_PAISE = int(os.getenv("PRO_PRICE_PAISE", "149900"))
-PREMIUM_PRICE_PAISE = int(os.getenv("PREMIUM_PRICE_PAISE", "249900"))
-
-if not BOT_TOKEN:
-    raise RuntimeError("❌ BOT_TOKEN missing in .env file")
+from aiogram.utils.callback_answer import CallbackAnswerMiddleware
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
+
+from config import (
+    BACKLOG_CHATS,
+    BASIC_PRICE_PAISE,
+    BOT_MODE,
+    BOT_TOKEN,
+    BOT_USERNAME,
+    PLAN_CATALOG_PATH,
+    PLAN_CATALOG_POLL,
+    PLAN_DURATION_DAYS,
+    PREMIUM_PRICE_PAISE,
+    PRO_PRICE_PAISE,
+    RAZORPAY_WEBHOOK_PATH,
+    RAZORPAY_WEBHOOK_SECRET,
+    SHARD_SOCKET,
+    SHARD_WORKERS,
+    STORAGE_BACKEND,
+    TRACE_UPDATES,
+    WARMUP_ENABLED,
+    WARMUP_TIMEOUT,
+    WEB_ENABLED,
+    WEB_HOST,
+    WEB_PORT,
+    WEBHOOK_BASE_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+)
+from logs import setup_logging
+from metrics import (
+    BREAKER_STATE,
+    BREAKER_TIMEOUT,
+    JOIN_EVENTS,
+    JOIN_EVENTS_PENDING,
+    JOIN_QUEUE_DEPTH,
+    METRICS,
+    OUTBOUND_JOBS,
+    OUTBOUND_QUEUE_DEPTH,
+    PAYMENT_SWEEP_LINKS,
+    PAYMENT_SWEEP_RUNS,
+    PAYMENT_SWEEP_SECONDS,
+    REALTIME_CONNECTED,
+    RENEWAL_REMINDERS,
+    SUB_CACHE_ENTRIES,
+    SUB_CACHE_HIT_RATIO,
+    SUB_CACHE_LOOKUPS,
+    SUBSCRIBERS_ACTIVE,
+    HandlerMetricsMiddleware,
+    LogContextMiddleware,
+    LoopLagMonitor,
+    TelegramMetricsMiddleware,
+    UpdateTraceMiddleware,
+)
+from breakers import BREAKERS
+from persistence import STORE, sp_fetch_owned_chats
+from subscriptions import (
+    EXPIRY_INDEX,
+    PLAN_STATUS_UNAVAILABLE_TEXT,
+    SUB_CACHE,
+    format_plan_status,
+    has_active_plan,
+)
+from chat_owners import CHAT_OWNERS
+from warmup import CacheWarmer
+from singleflight import SingleFlight
+from outbound import DmReachabilityMiddleware, OutboundScheduler
+from payments import (
+    RAZORPAY_CLIENT,
+    PaymentSweeper,
+    apply_paid_payment_link,
+    create_payment_link,
+    fetch_payment_link_info,
+    payment_success_text,
+    sp_apply_successful_payment,
+    sp_get_latest_payment_link,
+    verify_razorpay_signature,
+)
+from renewals import RenewalScheduler
+from join_events import JoinEventLog
+from join_pipeline import JoinRequestPipeline
+from realtime_listener import RealtimeListener
+from backlog import backlog_cli, startup_backlog
+from shards import ShardLink, ShardRouterMiddleware, ShardSupervisor
 
-assert SUPABASE_URL and SUPABASE_KEY, "Set SUPABASE_URL and SUPABASE_KEY / SUPABASE_SERVICE_ROLE_KEY in .env"
+log = logging.getLogger("login")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
-RAZORPAY_CLIENT: Optional[razorpay.Client] = None
-if RAZORPAY_KEY_ID and RAZORPAY_KEY_SECRET:
-    try:
-        RAZORPAY_CLIENT = razorpay.Client(auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET))
-    except Exception as e:
-        print("Razorpay client init error:", e)
+# ---------------- PLAN CATALOG (texts same as joining bot) ----------------
 
-# ---------------- SUBSCRIPTION HELPERS ----------------
+PLANS_INTRO_TEXT = """
+✨ **GetAIPilot — Plans**
 
+🎁 **Free with any plan:**
+• Auto approval bot — @Getai\_approvedbot
+• Join Tracking bot — @Getai\_joincountbot
+"""
 
-def sp_get_subscription(user_id: int) -> Optional[dict]:
-    try:
-        res = (
-            supabase.table("user_subscriptions")
-            .select("*")
-            .eq("user_id", user_id)
-            .limit(1)
-            .execute()
+FREE_WITH_PLAN_TEXT = """🎁 **Free with this plan:**
+• Auto approval bot — @Getai\_approvedbot
+• Join Tracking bot — @Getai\_joincountbot"""
+
+PLANS_SEPARATOR = "\n\n────────────────────────\n\n"
+
+# built-in catalog; a JSON list of the same objects at PLAN_CATALOG_PATH replaces it
+# ("duration_days" defaults to PLAN_DURATION_DAYS, "extra" to nothing)
+DEFAULT_PLANS = [
+    {
+        "id": "basic",
+        "emoji": "💠",
+        "name": "BASIC",
+        "price_paise": BASIC_PRICE_PAISE,
+        "summary": [
+            "Unlimited auto-forwarding between your selected chats",
+            "Choose sources & targets easily",
+            "Start/Stop forwarding anytime",
+            "Manage mappings (remove sources/targets)",
+            "⚠️ High-size file sending is NOT included",
+        ],
+        "features": [
+            "Unlimited auto-forwarding between your selected chats",
+            "Choose sources & targets easily",
+            "Start/Stop forwarding anytime",
+            "Manage mappings (remove sources/targets)",
+            "⚠️ High-size file sending is NOT included",
+        ],
+        "extra": (
+            "**Commands in this plan (AutoForward bot):**\n"
+            "• `/incoming`, `/outgoing`, `/work`, `/stop`\n"
+            "• `/remove_incoming`, `/remove_outgoing`\n\n"
+            "⚠️ High-size files not supported"
+        ),
+    },
+    {
+        "id": "pro",
+        "emoji": "⚡️",
+        "name": "PRO",
+        "price_paise": PRO_PRICE_PAISE,
+        "summary": [
+            "Everything in BASIC",
+            "Text replacement filters (@old → @new)",
+            "Show / delete one / delete all filters",
+            "Custom delay control between forwards",
+            "✅ High-size media & file sending supported",
+        ],
+        "features": [
+            "Everything in BASIC",
+            "Text replacement filters (@old → @new)",
+            "Show / delete one / delete all filters",
+            "Custom delay control between forwards",
+            "✅ High-size media & file sending supported",
+        ],
+    },
+    {
+        "id": "premium",
+        "emoji": "💎",
+        "name": "PREMIUM",
+        "price_paise": PREMIUM_PRICE_PAISE,
+        "summary": [
+            "Everything in PRO",
+            "Add custom text at the START of every forward",
+            "Add custom text at the END of every forward",
+            "Blacklist words (auto-remove from text)",
+            "✅ High-size media & file sending supported",
+        ],
+        "features": [
+            "Everything in PRO",
+            "Add custom text at the START/END of every forward",
+            "Blacklist words (auto-remove from text)",
+            "✅ High-size media & file sending supported",
+        ],
+    },
+]
+
+BACK_TO_PLANS_BUTTON = InlineKeyboardButton(text="⬅️ Back to Plans", callback_data="plans_root")
+BACK_TO_PLANS_KB = InlineKeyboardMarkup(inline_keyboard=[[BACK_TO_PLANS_BUTTON]])
+
+
+def verify_button(plan_id: str) -> InlineKeyboardButton:
+    return InlineKeyboardButton(text="✅ I have paid — Verify", callback_data=f"verify_{plan_id}")
+
+
+class Plan(NamedTuple):
+    plan_id: str
+    emoji: str
+    name: str
+    price_paise: int
+    duration_days: int
+    summary: Tuple[str, ...]
+    features: Tuple[str, ...]
+    extra: str
+
+    # callback data is "<action>_<plan_id>" and Telegram caps it at 64 bytes
+    MAX_ID_BYTES = 64 - len("verify_")
+
+    @classmethod
+    def from_config(cls, raw: dict) -> "Plan":
+        plan_id = str(raw["id"]).strip().lower()
+        if not plan_id or plan_id == "root" or len(plan_id.encode()) > cls.MAX_ID_BYTES:
+            raise ValueError(f"invalid plan id: {raw['id']!r}")
+        price = int(raw["price_paise"])
+        days = int(raw.get("duration_days") or PLAN_DURATION_DAYS)
+        if price <= 0 or days <= 0:
+            raise ValueError(f"plan {plan_id}: price_paise and duration_days must be positive")
+        return cls(
+            plan_id,
+            str(raw.get("emoji") or ""),
+            str(raw.get("name") or plan_id.upper()),
+            price,
+            days,
+            tuple(raw.get("summary") or ()),
+            tuple(raw.get("features") or ()),
+            str(raw.get("extra") or ""),
         )
-        return res.data[0] if res.data else None
-    except Exception as ex:
-        print("sp_get_subscription error:", ex)
-        return None
 
+    @property
+    def label(self) -> str:
+        return f"{self.emoji} {self.name}".strip()
 
-def is_plan_active(sub: dict) -> bool:
-    try:
-        exp = sub.get("expires_at")
-        if not exp:
-            return False
-        exp_dt = datetime.fromisoformat(str(exp).replace("Z", "")).astimezone(timezone.utc)
-        return datetime.now(timezone.utc) < exp_dt
-    except Exception:
-        return False
-
+    @property
+    def price_text(self) -> str:
+        return f"₹{self.price_paise / 100:.0f} / {self.duration_days} days"
 
-def format_plan_status(user_id: int) -> str:
-    sub = sp_get_subscription(user_id)
-    if not sub:
-        return "🔴 **No active plan found.**\nUse `/upgrade` to purchase any plan."
 
-    if not is_plan_active(sub):
-        return "🟠 **Your plan has expired.**\nUse `/upgrade` to renew."
+class PlanCatalog:
+    """
+    One version of the plan list with every static screen prerendered: the
+    /upgrade header and keyboard, each plan's detail text and keyboard, and
+    the Verify / Back rows of the payment screens. Built once per (re)load and
+    swapped in whole, so a tap only does dict lookups.
+    """
 
-    expires = str(sub.get("expires_at")).replace("Z", "")[:19]
-    label = sub.get("plan_label") or "Unknown Plan"
+    def __init__(self, plans: List[Plan], version: int):
+        self.version = version
+        self.plans: Dict[str, Plan] = {p.plan_id: p for p in plans}
+        if len(self.plans) != len(plans):
+            raise ValueError("duplicate plan id in catalog")
 
-    return (
-        f"🟢 **Active Plan: {label}**\n"
-        f"📅 **Expires at:** `{expires}`\n\n"
-        "Thank you for being a premium user! 🎉"
-    )
-
-
-def has_active_plan(user_id: int) -> bool:
-    sub = sp_get_subscription(user_id)
-    return bool(sub and is_plan_active(sub))
-
-
-def sp_get_latest_payment_link(user_id: int, plan_id: str) -> Optional[dict]:
-    try:
-        res = (
-            supabase.table("user_payment_links")
-            .select("*")
-            .eq("user_id", user_id)
-            .eq("plan_id", plan_id)
-            .order("created_at", desc=True)
-            .limit(1)
-            .execute()
+        blocks = [
+            "\n".join([f"{p.emoji} **{p.name} — {p.price_text}**"] + [f"• {line}" for line in p.summary])
+            for p in plans
+        ]
+        durations = {p.duration_days for p in plans}
+        footer = (
+            f"_Every payment extends your expiry by +{durations.pop()} days._"
+            if len(durations) == 1
+            else "_Every payment extends your expiry by the plan's validity._"
         )
-        return res.data[0] if res.data else None
-    except Exception as ex:
-        print("sp_get_latest_payment_link error:", ex)
-        return None
-
-
-def sp_apply_successful_payment(user_id: int, payment_row: dict) -> datetime:
-    now = datetime.now(timezone.utc)
-    plan_id = payment_row.get("plan_id") or "unknown"
-    plan_label = payment_row.get("plan_label") or plan_id.upper()
-    duration_days = int(payment_row.get("duration_days") or PLAN_DURATION_DAYS)
-
-    sub = sp_get_subscription(user_id)
-    if sub and is_plan_active(sub):
-        try:
-            base = datetime.fromisoformat(str(sub["expires_at"]).replace("Z", "")).astimezone(timezone.utc)
-        except Exception:
-            base = now
-    else:
-        base = now
-
-    new_exp = base + timedelta(days=duration_days)
-
-    payload = {
-        "user_id": user_id,
-        "plan_id": plan_id,
-        "plan_label": plan_label,
-        "expires_at": new_exp.isoformat(),
-        "updated_at": now.isoformat(),
-    }
-
-    try:
-        supabase.table("user_subscriptions").upsert(payload, on_conflict="user_id").execute()
-    except Exception as ex:
-        print("sp_apply_successful_payment upsert sub error:", ex)
-
-    try:
-        supabase.table("user_payment_links").update({"status": "paid"}).eq("id", payment_row["id"]).execute()
-    except Exception as ex:
-        print("sp_apply_successful_payment update payment error:", ex)
-
-    return new_exp
-
-
-def create_payment_link(user_id: int, amount_paise: int, plan_id: str, plan_label: str) -> Optional[str]:
-    if not RAZORPAY_CLIENT:
-        print("create_payment_link: Razorpay client not configured")
-        return None
-
-    # Razorpay ko emoji pasand nahi – ASCII clean label
-    try:
-        ascii_label = plan_label.encode("ascii", "ignore").decode().strip()
-        if not ascii_label:
-            ascii_label = plan_id.upper()
-    except Exception:
-        ascii_label = plan_id.upper()
-
-    try:
-        res = RAZORPAY_CLIENT.payment_link.create(
-            {
-                "amount": amount_paise,
-                "currency": "INR",
-                "description": f"GetAIPilot Subscription - {ascii_label}",
-                "customer": {"name": str(user_id)},
-                "notify": {"sms": True, "email": False},
-                "callback_url": "https://razorpay.com/",
-                "callback_method": "get",
-            }
+        self.header_text = PLANS_INTRO_TEXT + "\n\n" + PLANS_SEPARATOR.join(blocks) + "\n\n" + footer + "\n"
+        self.root_kb = InlineKeyboardMarkup(
+            inline_keyboard=[
+                [InlineKeyboardButton(text=f"{p.emoji} View {p.name}".strip(), callback_data=f"plans_{p.plan_id}")]
+                for p in plans
+            ]
         )
-        p_url = res.get("short_url") or res.get("url")
-        p_id = res.get("id")
-
-        supabase.table("user_payment_links").insert(
-            {
-                "user_id": user_id,
-                "plan_id": plan_id,
-                "plan_label": plan_label,
-                "price_paise": amount_paise,
-                "duration_days": PLAN_DURATION_DAYS,
-                "paymentlink_id": p_id,
-                "paymentlink_url": p_url,
-                "status": "created",
-                "created_at": datetime.now(timezone.utc).isoformat(),
-                "raw": res,
-            }
-        ).execute()
-
-        return p_url
-    except Exception as ex:
-        print("create_payment_link error:", ex)
-        return None
-
-
-# ---------------- PLAN TEXTS (same as joining bot) ----------------
-
-PLANS_HEADER_TEXT = """
-✨ **GetAIPilot — Plans**
 
-🎁 **Free with any plan:**
-• Auto approval bot — @Getai\_approvedbot
-• Join Tracking bot — @Getai\_joincountbot
+        self.details: Dict[str, Tuple[str, InlineKeyboardMarkup]] = {}
+        self.verify_kbs: Dict[str, InlineKeyboardMarkup] = {}
+        self.payment_rows: Dict[str, List[List[InlineKeyboardButton]]] = {}
+        for p in plans:
+            parts = [f"{p.emoji} **{p.name} — {p.price_text}**", FREE_WITH_PLAN_TEXT]
+            if p.features:
+                parts.append("**Features:**\n" + "\n".join(f"• {line}" for line in p.features))
+            if p.extra:
+                parts.append(p.extra)
+            parts.append(f"_Validity: {p.duration_days} days • Every renewal adds +{p.duration_days} days._")
+            kb = InlineKeyboardMarkup(
+                inline_keyboard=[
+                    [BACK_TO_PLANS_BUTTON],
+                    [InlineKeyboardButton(text=f"💳 Buy {p.price_text}", callback_data=f"buy_{p.plan_id}")],
+                ]
+            )
+            self.details[p.plan_id] = ("\n" + "\n\n".join(parts) + "\n", kb)
+            self.verify_kbs[p.plan_id] = InlineKeyboardMarkup(inline_keyboard=[[verify_button(p.plan_id)]])
+            self.payment_rows[p.plan_id] = [[verify_button(p.plan_id)], [BACK_TO_PLANS_BUTTON]]
 
+    def verify_kb(self, plan_id: str) -> InlineKeyboardMarkup:
+        # plan ids dropped from the catalog still verify (their payment rows remain)
+        kb = self.verify_kbs.get(plan_id)
+        return kb if kb is not None else InlineKeyboardMarkup(inline_keyboard=[[verify_button(plan_id)]])
 
-💠 **BASIC — ₹699 / 30 days**
-• Unlimited auto-forwarding between your selected chats
-• Choose sources & targets easily
-• Start/Stop forwarding anytime
-• Manage mappings (remove sources/targets)
-• ⚠️ High-size file sending is NOT included
+    def payment_kb(self, plan_id: str, link_url: str) -> InlineKeyboardMarkup:
+        rows = self.payment_rows.get(plan_id) or [[verify_button(plan_id)], [BACK_TO_PLANS_BUTTON]]
+        return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="💳 Pay Now", url=link_url)], *rows])
 
-────────────────────────
 
-⚡️ **PRO — ₹1499 / 30 days**
-• Everything in BASIC
-• Text replacement filters (@old → @new)
-• Show / delete one / delete all filters
-• Custom delay control between forwards
-• ✅ High-size media & file sending supported
+def load_plan_catalog(path: str = PLAN_CATALOG_PATH, version: int = 1) -> PlanCatalog:
+    raw = DEFAULT_PLANS
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as fh:
+            raw = json.load(fh)
+    if isinstance(raw, dict):
+        raw = raw.get("plans")
+    if not raw:
+        raise ValueError("plan catalog is empty")
+    return PlanCatalog([Plan.from_config(p) for p in raw], version)
 
-────────────────────────
 
-💎 **PREMIUM — ₹2499 / 30 days**
-• Everything in PRO
-• Add custom text at the START of every forward
-• Add custom text at the END of every forward
-• Blacklist words (auto-remove from text)
-• ✅ High-size media & file sending supported
+CATALOG = load_plan_catalog()
 
-_Every payment extends your expiry by +30 days._
-"""
 
-BASIC_PLAN_TEXT = """
-💠 **BASIC — ₹699 / 30 days**
+class PlanCatalogWatcher:
+    """
+    Hot reload: re-reads PLAN_CATALOG_PATH whenever its mtime changes and
+    swaps CATALOG. A file that fails to parse or validate is logged and the
+    current catalog stays; removing the file falls back to DEFAULT_PLANS.
+    """
 
-🎁 **Free with this plan:**
-• Auto approval bot — @Getai\_approvedbot
-• Join Tracking bot — @Getai\_joincountbot
+    def __init__(self, path: str = PLAN_CATALOG_PATH, interval: float = PLAN_CATALOG_POLL):
+        self.path = path
+        self.interval = interval
+        self._mtime = self._stat()
+        self._task: Optional[asyncio.Task] = None
 
-**Features:**
-• Unlimited auto-forwarding between your selected chats
-• Choose sources & targets easily
-• Start/Stop forwarding anytime
-• Manage mappings (remove sources/targets)
-• ⚠️ High-size file sending is NOT included
-
-**Commands in this plan (AutoForward bot):**
-• `/incoming`, `/outgoing`, `/work`, `/stop`
-• `/remove_incoming`, `/remove_outgoing`
-
-⚠️ High-size files not supported
-
-_Validity: 30 days • Every renewal adds +30 days._
-"""
+    def _stat(self) -> Optional[int]:
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
 
-PRO_PLAN_TEXT = """
-⚡️ **PRO — ₹1499 / 30 days**
+    def reload(self) -> bool:
+        global CATALOG
+        try:
+            catalog = load_plan_catalog(self.path, CATALOG.version + 1)
+        except (OSError, ValueError, KeyError, TypeError) as ex:
+            log.error("Plan catalog reload error, keeping v%d: %s", CATALOG.version, ex)
+            return False
+        CATALOG = catalog
+        log.info("Plan catalog v%d loaded: %s", catalog.version, ", ".join(catalog.plans))
+        return True
 
-🎁 **Free with this plan:**
-• Auto approval bot — @Getai\_approvedbot
-• Join Tracking bot — @Getai\_joincountbot
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            mtime = self._stat()
+            if mtime != self._mtime:
+                self._mtime = mtime
+                self.reload()
 
-**Features:**
-• Everything in BASIC
-• Text replacement filters (@old → @new)
-• Show / delete one / delete all filters
-• Custom delay control between forwards
-• ✅ High-size media & file sending supported
+    def start(self) -> None:
+        if self.path and self.interval > 0:
+            self._task = asyncio.create_task(self._loop())
 
-_Validity: 30 days • Every renewal adds +30 days._
-"""
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
 
-PREMIUM_PLAN_TEXT = """
-💎 **PREMIUM — ₹2499 / 30 days**
 
-🎁 **Free with this plan:**
-• Auto approval bot — @Getai\_approvedbot
-• Join Tracking bot — @Getai\_joincountbot
+# ---------------- SINGLE-FLIGHT ----------------
 
-**Features:**
-• Everything in PRO
-• Add custom text at the START/END of every forward
-• Blacklist words (auto-remove from text)
-• ✅ High-size media & file sending supported
 
-_Validity: 30 days • Every renewal adds +30 days._
-"""
+BUY_FLIGHTS = SingleFlight()  # (user_id, plan_id) → payment link view
+VERIFY_FLIGHTS = SingleFlight()  # (user_id, plan_id) → verify view
 
 
 # ---------------- COMMON UPGRADE UI HELPERS ----------------
@@ -305,16 +381,10 @@ _Validity: 30 days • Every renewal adds +30 days._
 
 async def show_plans_root(message_or_cb):
     user_id = message_or_cb.from_user.id if isinstance(message_or_cb, Message) else message_or_cb.from_user.id
-    status = format_plan_status(user_id)
-    txt = status + "\n\n" + PLANS_HEADER_TEXT
-
-    kb = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="💠 View BASIC", callback_data="plans_basic")],
-            [InlineKeyboardButton(text="⚡ View PRO", callback_data="plans_pro")],
-            [InlineKeyboardButton(text="💎 View PREMIUM", callback_data="plans_premium")],
-        ]
-    )
+    status = await format_plan_status(user_id)
+    catalog = CATALOG
+    txt = status + "\n\n" + catalog.header_text
+    kb = catalog.root_kb
 
     if isinstance(message_or_cb, Message):
         await message_or_cb.answer(txt, reply_markup=kb, parse_mode="Markdown")
@@ -322,135 +392,109 @@ async def show_plans_root(message_or_cb):
         await message_or_cb.message.edit_text(txt, reply_markup=kb, parse_mode="Markdown")
 
 
-async def show_payment_created(cb: CallbackQuery, plan_id: str, plan_label: str, amount_paise: int):
-    user_id = cb.from_user.id
-
-    existing = sp_get_latest_payment_link(user_id, plan_id)
-    if existing and (existing.get("status") or "").lower() == "created":
+async def edit_view(cb: CallbackQuery, txt: str, kb: InlineKeyboardMarkup):
+    # coalesced taps render the same view – Telegram rejects an identical edit
+    try:
+        await cb.message.edit_text(txt, reply_markup=kb, parse_mode="Markdown")
+    except TelegramBadRequest as ex:
+        if "message is not modified" not in str(ex):
+            raise
+
+
+async def payment_link_view(user_id: int, plan: Plan) -> Tuple[str, InlineKeyboardMarkup]:
+    existing = await sp_get_latest_payment_link(user_id, plan.plan_id)
+    # an open link is reused only while it still matches the catalog price
+    if (
+        existing
+        and (existing.get("status") or "").lower() == "created"
+        and existing.get("price_paise") in (None, plan.price_paise)
+    ):
         link_url = existing.get("paymentlink_url")
     else:
-        link_url = create_payment_link(user_id, amount_paise, plan_id, plan_label)
+        link_url = await create_payment_link(user_id, plan.price_paise, plan.plan_id, plan.label, plan.duration_days)
 
     if not link_url:
-        await cb.message.edit_text(
+        return (
             "❌ Unable to create payment link right now.\n"
             "Possible reason: Razorpay rate-limit / config issue.\n"
             "⏳ Thodi der baad fir se try karo.",
-            reply_markup=InlineKeyboardMarkup(
-                inline_keyboard=[[InlineKeyboardButton(text="⬅️ Back to Plans", callback_data="plans_root")]]
-            ),
-            parse_mode="Markdown",
+            BACK_TO_PLANS_KB,
         )
-        return
 
     txt = (
         "🔗 **Payment Link Created**\n"
-        f"Plan: {plan_label} (₹{amount_paise/100:.0f} / 30 days)\n\n"
+        f"Plan: {plan.label} ({plan.price_text})\n\n"
         "Payment complete hone ke baad **Verify** dabana mat bhoolna."
     )
-
-    kb = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="💳 Pay Now", url=link_url)],
-            [InlineKeyboardButton(text="✅ I have paid — Verify", callback_data=f"verify_{plan_id}")],
-            [InlineKeyboardButton(text="⬅️ Back to Plans", callback_data="plans_root")],
-        ]
-    )
-
-    await cb.message.edit_text(txt, reply_markup=kb, parse_mode="Markdown")
+    return txt, CATALOG.payment_kb(plan.plan_id, link_url)
 
 
-async def handle_verify(cb: CallbackQuery, plan_id: str):
+async def show_payment_created(cb: CallbackQuery, plan: Plan):
     user_id = cb.from_user.id
+    # double/triple taps share one lookup + one Razorpay create
+    txt, kb = await BUY_FLIGHTS.do((user_id, plan.plan_id), lambda: payment_link_view(user_id, plan))
+    await edit_view(cb, txt, kb)
 
-    if not RAZORPAY_CLIENT:
-        await cb.message.edit_text(
-            "❌ Razorpay client not configured on this bot.\nPlease contact support.",
-            reply_markup=InlineKeyboardMarkup(
-                inline_keyboard=[[InlineKeyboardButton(text="⬅️ Back to Plans", callback_data="plans_root")]]
-            ),
-            parse_mode="Markdown",
-        )
-        return
 
-    row = sp_get_latest_payment_link(user_id, plan_id)
+async def verify_view(user_id: int, plan_id: str) -> Tuple[str, InlineKeyboardMarkup]:
+    back_kb = BACK_TO_PLANS_KB
+
+    row = await sp_get_latest_payment_link(user_id, plan_id)
     if not row:
-        await cb.message.edit_text(
-            "❌ No recent payment link found for this plan.\nUse /upgrade → Buy again.",
-            reply_markup=InlineKeyboardMarkup(
-                inline_keyboard=[[InlineKeyboardButton(text="⬅️ Back to Plans", callback_data="plans_root")]]
-            ),
-            parse_mode="Markdown",
-        )
-        return
+        return "❌ No recent payment link found for this plan.\nUse /upgrade → Buy again.", back_kb
 
     if (row.get("status") or "").lower() == "paid":
-        msg = "✅ Payment already verified.\n\n" + format_plan_status(user_id)
-        await cb.message.edit_text(
-            msg,
-            reply_markup=InlineKeyboardMarkup(
-                inline_keyboard=[[InlineKeyboardButton(text="⬅️ Back to Plans", callback_data="plans_root")]]
-            ),
-            parse_mode="Markdown",
-        )
-        return
+        return "✅ Payment already verified.\n\n" + await format_plan_status(user_id), back_kb
 
     plink_id = row.get("paymentlink_id")
     if not plink_id:
-        await cb.message.edit_text(
-            "❌ This payment link record is missing an id.\nPlease create a new one via /upgrade.",
-            reply_markup=InlineKeyboardMarkup(
-                inline_keyboard=[[InlineKeyboardButton(text="⬅️ Back to Plans", callback_data="plans_root")]]
-            ),
-            parse_mode="Markdown",
-        )
-        return
+        return "❌ This payment link record is missing an id.\nPlease create a new one via /upgrade.", back_kb
 
-    try:
-        info = RAZORPAY_CLIENT.payment_link.fetch(plink_id)
-    except Exception as ex:
-        await cb.message.edit_text(
-            f"❌ Failed to verify payment:\n`{ex}`",
-            reply_markup=InlineKeyboardMarkup(
-                inline_keyboard=[[InlineKeyboardButton(text="⬅️ Back to Plans", callback_data="plans_root")]]
-            ),
-            parse_mode="Markdown",
-        )
-        return
+    if RAZORPAY_WEBHOOK_SECRET:
+        # payment_link.paid webhook keeps the row current – no Razorpay round trip here
+        status = (row.get("status") or "").lower()
+    else:
+        if not RAZORPAY_CLIENT:
+            return "❌ Razorpay client not configured on this bot.\nPlease contact support.", back_kb
+
+        try:
+            info = await fetch_payment_link_info(plink_id)
+        except Exception as ex:
+            return f"❌ Failed to verify payment:\n`{ex}`", back_kb
+
+        status = info.status
 
-    status = (info or {}).get("status", "").lower()
     if status != "paid":
         purl = row.get("paymentlink_url")
         rows = []
         if purl:
             rows.append([InlineKeyboardButton(text="💳 Pay Now", url=purl)])
-        rows.append([InlineKeyboardButton(text="⬅️ Back to Plans", callback_data="plans_root")])
+        rows.append([BACK_TO_PLANS_BUTTON])
 
-        await cb.message.edit_text(
+        return (
             f"⚠️ Payment is not completed yet.\n"
             f"Current status: `{status or 'unknown'}`.\n\n"
             "Please finish payment using *Pay Now*, then press **Verify** again.",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=rows),
-            parse_mode="Markdown",
+            InlineKeyboardMarkup(inline_keyboard=rows),
         )
-        return
 
-    new_exp = sp_apply_successful_payment(user_id, row)
-    new_exp_str = new_exp.strftime("%Y-%m-%d %H:%M UTC")
+    try:
+        new_exp = await sp_apply_successful_payment(user_id, row)
+    except Exception as ex:
+        log.error("sp_apply_successful_payment error: %s", ex)
+        return (
+            "❌ Payment received but activation failed.\nPlease press **Verify** again in a moment.",
+            CATALOG.verify_kb(plan_id),
+        )
 
-    msg = (
-        "✅ **Payment verified successfully!**\n\n"
-        f"Your plan is now active until: `{new_exp_str}`\n\n"
-        "Ab aap **Auto Forward bot + Join Counter + Auto Approve bot** sab use kar sakte ho. 🎉"
-    )
+    return payment_success_text(new_exp), back_kb
 
-    await cb.message.edit_text(
-        msg,
-        reply_markup=InlineKeyboardMarkup(
-            inline_keyboard=[[InlineKeyboardButton(text="⬅️ Back to Plans", callback_data="plans_root")]]
-        ),
-        parse_mode="Markdown",
-    )
+
+async def handle_verify(cb: CallbackQuery, plan_id: str):
+    user_id = cb.from_user.id
+    # concurrent Verify taps share one lookup / Razorpay fetch / apply
+    txt, kb = await VERIFY_FLIGHTS.do((user_id, plan_id), lambda: verify_view(user_id, plan_id))
+    await edit_view(cb, txt, kb)
 
 
 # ---------------- BOT COMMAND HANDLERS ----------------
@@ -461,7 +505,12 @@ async def cmd_start(message: Message):
         await message.answer("❌ BOT_USERNAME missing in .env file")
         return
 
-    if not has_active_plan(message.from_user.id):
+    active = await has_active_plan(message.from_user.id)
+    if active is None:
+        await message.answer(PLAN_STATUS_UNAVAILABLE_TEXT, parse_mode="Markdown")
+        return
+
+    if not active:
         await message.answer(
             "🔒 **No active subscription found for this account.**\n\n"
             "Is Auto Approve bot ka use karne ke liye pehle plan lena zaroori hai.\n"
@@ -497,44 +546,43 @@ async def cmd_start(message: Message):
     await message.answer(text, reply_markup=keyboard, parse_mode="Markdown")
 
 
-async def handle_join_request(event: ChatJoinRequest, bot: Bot):
-    user_id = event.from_user.id
-
-    # 🔒 subscription gate
-    if not has_active_plan(user_id):
-        print(f"Skip auto-approve for user {user_id}: no active plan")
-        try:
-            await bot.send_message(
-                user_id,
-                "🔒 **No active subscription found.**\n\n"
-                "Aapka join request abhi auto-approve nahi ho sakta.\n"
-                "👉 Pehle `/upgrade` command run karke plan purchase karein,\n"
-                "phir dobara join request bhejein.",
-                parse_mode="Markdown",
-            )
-        except Exception:
-            # user ne kabhi /start nahi kiya ho to DM fail ho sakta hai – ignore
-            pass
+async def handle_my_chat_member(event: ChatMemberUpdated, outbound: OutboundScheduler):
+    # a subscriber who makes the bot an admin owns the chat; any demotion, leaving or
+    # being kicked clears it, and the chat falls back to gating each joiner on their own plan
+    old, new = event.old_chat_member.status, event.new_chat_member.status
+    if new != ChatMemberStatus.ADMINISTRATOR:
+        if old == ChatMemberStatus.ADMINISTRATOR or new in (ChatMemberStatus.LEFT, ChatMemberStatus.KICKED):
+            try:
+                await CHAT_OWNERS.remove(event.chat.id)
+            except Exception as e:
+                log.error("Error clearing chat owner: %s", e)
+        return
+    if old == ChatMemberStatus.ADMINISTRATOR:
+        return  # admin rights edited, same owner
+
+    active = await has_active_plan(event.from_user.id)
+    if active is False:
+        # not recorded as owner: joiners keep being gated on their own plans
+        outbound.send_dm(
+            event.from_user.id,
+            f"⚠️ Bot **{event.chat.title}** me add ho gaya hai, lekin aapka koi active plan nahi hai.\n"
+            "👉 `/upgrade` karke plan lein, tab tak sirf active plan wale users ke join requests auto-approve honge.",
+            dedup_key=f"owner_no_plan:{event.from_user.id}",
+            parse_mode="Markdown",
+        )
         return
 
-    # ✅ user has active plan → approve
+    # unknown during an outage is recorded too: should the plan turn out to be gone,
+    # the pipeline gates joiners on their own plans, as for a lapsed owner
     try:
-        await bot.approve_chat_join_request(
-            chat_id=event.chat.id,
-            user_id=user_id,
-        )
+        await CHAT_OWNERS.set_owner(event.chat.id, event.from_user.id)
+    except Exception as e:
+        log.error("Error updating chat owner: %s", e)
 
-        try:
-            await bot.send_message(
-                user_id,
-                f"✅ Your request to join **{event.chat.title}** has been approved automatically.",
-                parse_mode="Markdown",
-            )
-        except Exception:
-            pass
 
-    except Exception as e:
-        print("Error approving join request:", e)
+async def handle_join_request(event: ChatJoinRequest, join_pipeline: JoinRequestPipeline):
+    # blocks only when the intake queue is full (backpressure)
+    await join_pipeline.submit(event)
 
 
 # /upgrade & /upgrade_status commands
@@ -544,102 +592,382 @@ async def cmd_upgrade(message: Message):
 
 
 async def cmd_upgrade_status(message: Message):
-    await message.answer(format_plan_status(message.from_user.id), parse_mode="Markdown")
+    await message.answer(await format_plan_status(message.from_user.id), parse_mode="Markdown")
+
+
+# /stats – join activity in the chats the user added the bot to, from in-memory counters
+async def cmd_stats(message: Message, join_events: JoinEventLog):
+    try:
+        chat_ids = await sp_fetch_owned_chats(message.from_user.id)
+    except Exception as ex:
+        log.warning("sp_fetch_owned_chats error: %s", ex)
+        await message.answer("⚠️ Stats abhi load nahi ho paaye, thodi der baad try karein.")
+        return
+    if not chat_ids:
+        await message.answer("ℹ️ Aapne bot ko abhi kisi channel/group me admin nahi banaya hai.")
+        return
+    await message.answer(join_events.render_stats(chat_ids), parse_mode="Markdown")
 
 
 # ---------------- CALLBACK HANDLERS ----------------
 
 
-async def cb_plans_root(cb: CallbackQuery):
-    await show_plans_root(cb)
+def parse_callback_data(data: str) -> Tuple[str, str]:
+    # "<action>_<plan_id>": plans_root, plans_<id>, buy_<id>, verify_<id>
+    action, _, plan_id = data.partition("_")
+    return action, plan_id
 
 
-async def cb_plans_basic(cb: CallbackQuery):
-    kb = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="⬅️ Back to Plans", callback_data="plans_root")],
-            [InlineKeyboardButton(text="💳 Buy ₹699 / 30 days", callback_data="buy_basic")],
-        ]
-    )
-    await cb.message.edit_text(BASIC_PLAN_TEXT, reply_markup=kb, parse_mode="Markdown")
+async def cb_plans(cb: CallbackQuery, plan_id: str):
+    screen = CATALOG.details.get(plan_id)
+    if screen is None:
+        # plans_root, or a tier dropped from the catalog since this message was sent
+        await show_plans_root(cb)
+        return
+    await edit_view(cb, *screen)
 
 
-async def cb_plans_pro(cb: CallbackQuery):
-    kb = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="⬅️ Back to Plans", callback_data="plans_root")],
-            [InlineKeyboardButton(text="💳 Buy ₹1499 / 30 days", callback_data="buy_pro")],
-        ]
-    )
-    await cb.message.edit_text(PRO_PLAN_TEXT, reply_markup=kb, parse_mode="Markdown")
+async def cb_buy(cb: CallbackQuery, plan_id: str):
+    plan = CATALOG.plans.get(plan_id)
+    if plan is None:
+        await show_plans_root(cb)
+        return
+    await show_payment_created(cb, plan)
 
 
-async def cb_plans_premium(cb: CallbackQuery):
-    kb = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="⬅️ Back to Plans", callback_data="plans_root")],
-            [InlineKeyboardButton(text="💳 Buy ₹2499 / 30 days", callback_data="buy_premium")],
-        ]
+async def cb_verify(cb: CallbackQuery, plan_id: str):
+    await handle_verify(cb, plan_id)
+
+
+CALLBACK_ACTIONS = {"plans": cb_plans, "buy": cb_buy, "verify": cb_verify}
+
+
+async def cb_router(cb: CallbackQuery):
+    # one registered handler: the action picks the coroutine, the catalog the plan
+    action, plan_id = parse_callback_data(cb.data or "")
+    handler = CALLBACK_ACTIONS.get(action)
+    if handler is None:
+        log.info("Unknown callback data: %r", cb.data)
+        return
+    await handler(cb, plan_id)
+
+
+# ---------------- WEB SERVER (webhook / health) ----------------
+
+APP_MODE = web.AppKey("mode", str)
+APP_OUTBOUND = web.AppKey("outbound", OutboundScheduler)
+APP_JOIN_PIPELINE = web.AppKey("join_pipeline", JoinRequestPipeline)
+APP_PAYMENT_SWEEPER = web.AppKey("payment_sweeper", PaymentSweeper)
+APP_REALTIME = web.AppKey("realtime", RealtimeListener)
+APP_RENEWALS = web.AppKey("renewals", RenewalScheduler)
+APP_JOIN_EVENTS = web.AppKey("join_events", JoinEventLog)
+APP_SHARDS: "web.AppKey[Optional[ShardSupervisor]]" = web.AppKey("shards")  # None without workers
+
+
+async def web_health(request: web.Request) -> web.Response:
+    outbound = request.app[APP_OUTBOUND]
+    join_pipeline = request.app[APP_JOIN_PIPELINE]
+    realtime = request.app[APP_REALTIME]
+    shards = request.app[APP_SHARDS]
+    join_events = request.app[APP_JOIN_EVENTS]
+    renewals = request.app[APP_RENEWALS]
+    return web.json_response(
+        {
+            "status": "ok",
+            "mode": request.app[APP_MODE],
+            "join_queue": join_pipeline.intake.qsize(),
+            "outbound_queues": outbound.queue_depths(),
+            "sub_cache": SUB_CACHE.stats(),
+            "breakers": {b.name: b.snapshot() for b in BREAKERS},
+            "payment_sweep": request.app[APP_PAYMENT_SWEEPER].stats,
+            "realtime": {"connected": realtime.connected, **realtime.stats},
+            "shards": shards.snapshot() if shards else None,
+            "join_events": {"pending": join_events.pending(), **join_events.stats},
+            "expiry": {"active": len(EXPIRY_INDEX), "loaded": renewals.loaded, **renewals.stats},
+            "plan_catalog": {"version": CATALOG.version, "plans": list(CATALOG.plans)},
+        }
     )
-    await cb.message.edit_text(PREMIUM_PLAN_TEXT, reply_markup=kb, parse_mode="Markdown")
 
 
-async def cb_buy_basic(cb: CallbackQuery):
-    await show_payment_created(cb, "basic", "💠 BASIC", BASIC_PRICE_PAISE)
+async def web_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=METRICS.render(), content_type="text/plain", charset="utf-8", headers={"X-Content-Type-Options": "nosniff"})
 
 
-async def cb_buy_pro(cb: CallbackQuery):
-    await show_payment_created(cb, "pro", "⚡️ PRO", PRO_PRICE_PAISE)
+def build_web_app(dp: Dispatcher, bot: Bot, mode: str) -> web.Application:
+    app = web.Application()
+    app[APP_MODE] = mode
+    app[APP_OUTBOUND] = dp["outbound"]
+    app[APP_JOIN_PIPELINE] = dp["join_pipeline"]
+    app[APP_PAYMENT_SWEEPER] = dp["payment_sweeper"]
+    app[APP_REALTIME] = dp["realtime"]
+    app[APP_RENEWALS] = dp["renewals"]
+    app[APP_JOIN_EVENTS] = dp["join_events"]
+    app[APP_SHARDS] = dp.get("shards")
+    app.router.add_get("/healthz", web_health)
+    app.router.add_get("/metrics", web_metrics)
+    if RAZORPAY_WEBHOOK_SECRET:
+        app.router.add_post(RAZORPAY_WEBHOOK_PATH, razorpay_webhook)
 
+    if mode == "webhook":
+        # handle_in_background → Telegram gets its 200 before the update is processed;
+        # requests without the right X-Telegram-Bot-Api-Secret-Token get 401
+        SimpleRequestHandler(
+            dispatcher=dp,
+            bot=bot,
+            secret_token=WEBHOOK_SECRET,
+            handle_in_background=True,
+        ).register(app, path=WEBHOOK_PATH)
+    return app
 
-async def cb_buy_premium(cb: CallbackQuery):
-    await show_payment_created(cb, "premium", "💎 PREMIUM", PREMIUM_PRICE_PAISE)
 
+async def start_web_app(app: web.Application) -> web.AppRunner:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEB_HOST, WEB_PORT).start()
+    log.info("🌐 HTTP server listening on %s:%s", WEB_HOST, WEB_PORT)
+    return runner
 
-async def cb_verify_basic(cb: CallbackQuery):
-    await handle_verify(cb, "basic")
 
+# ---------------- RAZORPAY WEBHOOK ----------------
 
-async def cb_verify_pro(cb: CallbackQuery):
-    await handle_verify(cb, "pro")
 
+async def razorpay_webhook(request: web.Request) -> web.Response:
+    body = await request.read()
+    if not verify_razorpay_signature(body, request.headers.get("X-Razorpay-Signature", "")):
+        return web.json_response({"error": "bad signature"}, status=401)
 
-async def cb_verify_premium(cb: CallbackQuery):
-    await handle_verify(cb, "premium")
+    try:
+        event = json.loads(body)
+    except ValueError:
+        return web.json_response({"error": "bad json"}, status=400)
 
+    if event.get("event") != "payment_link.paid":
+        return web.json_response({"result": "ignored"})
 
-# ---------------- MAIN ----------------
+    plink_id = (((event.get("payload") or {}).get("payment_link") or {}).get("entity") or {}).get("id")
+    if not plink_id:
+        return web.json_response({"error": "missing payment_link id"}, status=400)
+
+    try:
+        result = await apply_paid_payment_link(plink_id, request.app[APP_OUTBOUND])
+    except Exception as ex:
+        # non-2xx → Razorpay retries the delivery later
+        log.error("razorpay_webhook error: %s", ex)
+        return web.json_response({"error": "temporary failure"}, status=500)
+
+    return web.json_response({"result": result})
 
 
-async def main():
+# ---------------- SHARDED WORKERS ----------------
+
+
+async def run_worker(shard: int, socket_path: str = SHARD_SOCKET) -> None:
+    link = ShardLink(shard, socket_path)
     bot = Bot(BOT_TOKEN)
-    dp = Dispatcher()
+    dp = setup_dispatcher(bot, global_bucket=link.bucket)
+    dp["join_events"].sink = link.relay_join_events
+    if WARMUP_ENABLED:
+        await warm_cache(CacheWarmer())
+    # the outbound scheduler asks the intake for a lease as soon as it starts
+    await link.connect(dp)
+    start_services(dp, WORKER_SERVICES)
+
+    serving = asyncio.create_task(link.run(dp, bot))
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, serving.cancel)
+    log.info("🧩 Shard worker %s running (pid %s)", shard, os.getpid())
+    try:
+        await serving
+    except asyncio.CancelledError:
+        pass
+    finally:
+        await stop_services(dp)
+        await STORE.close()
+        if RAZORPAY_CLIENT:
+            await RAZORPAY_CLIENT.aclose()
+        await bot.session.close()
+
 
+# ---------------- MAIN ----------------
+
+
+def register_handlers(dp: Dispatcher):
     # Commands
     dp.message.register(cmd_start, CommandStart())
     dp.message.register(cmd_upgrade, Command("upgrade"))
     dp.message.register(cmd_upgrade_status, Command("upgrade_status"))
+    dp.message.register(cmd_stats, Command("stats"))
 
-    # Join request
+    # Join request / bot added to a chat
     dp.chat_join_request.register(handle_join_request)
+    dp.my_chat_member.register(handle_my_chat_member)
+
+    # Callback buttons – every plan/buy/verify tap goes through one dict dispatch
+    dp.callback_query.register(cb_router, F.data)
+
+
+# background services kept in dp workflow data; started in this order, stopped in reverse
+SERVICES = ("loop_lag", "plan_catalog", "realtime", "outbound", "join_events", "join_pipeline", "payment_sweeper", "renewals")
+# shard workers leave the payment sweep and renewal reminders to the intake, so each runs once
+WORKER_SERVICES = tuple(name for name in SERVICES if name not in ("payment_sweeper", "renewals"))
+
+
+def setup_dispatcher(bot: Bot, global_bucket=None) -> Dispatcher:
+    dp = Dispatcher()
+    register_handlers(dp)
+
+    # metrics: per-handler latency, optional per-update traces, Bot API call timing
+    for observer in (dp.message, dp.callback_query, dp.chat_join_request, dp.my_chat_member):
+        observer.middleware(HandlerMetricsMiddleware())
+    # stop the button spinner before any Supabase/Razorpay work, so Telegram doesn't re-deliver taps
+    dp.callback_query.middleware(CallbackAnswerMiddleware(pre=True))
+    dp.update.outer_middleware(LogContextMiddleware())
+    dp.message.outer_middleware(DmReachabilityMiddleware())
+    dp.callback_query.outer_middleware(DmReachabilityMiddleware())
+    if TRACE_UPDATES:
+        dp.update.outer_middleware(UpdateTraceMiddleware())
+    bot.session.middleware(TelegramMetricsMiddleware())
+
+    outbound = OutboundScheduler(bot, global_bucket=global_bucket)
+    dp["loop_lag"] = LoopLagMonitor()
+    dp["plan_catalog"] = PlanCatalogWatcher()
+    dp["realtime"] = RealtimeListener()
+    dp["outbound"] = outbound
+    dp["join_events"] = JoinEventLog()
+    dp["join_pipeline"] = JoinRequestPipeline(outbound, dp["join_events"])
+    dp["payment_sweeper"] = PaymentSweeper(outbound)
+    dp["renewals"] = RenewalScheduler(outbound)
+    bind_service_metrics(dp)
+    return dp
+
+
+def bind_service_metrics(dp: Dispatcher):
+    outbound: OutboundScheduler = dp["outbound"]
+    join_pipeline: JoinRequestPipeline = dp["join_pipeline"]
+
+    SUB_CACHE_LOOKUPS.set_function(
+        lambda: {("hit",): SUB_CACHE.hits, ("miss",): SUB_CACHE.misses, ("stale",): SUB_CACHE.stale_hits}
+    )
+    SUB_CACHE_HIT_RATIO.set_function(lambda: SUB_CACHE.stats()["hit_ratio"])
+    SUB_CACHE_ENTRIES.set_function(lambda: SUB_CACHE.stats()["size"])
+    BREAKER_STATE.set_function(lambda: {(b.name,): b.state for b in BREAKERS})
+    BREAKER_TIMEOUT.set_function(lambda: {(b.name,): b.timeout for b in BREAKERS})
+    REALTIME_CONNECTED.set_function(lambda: 1 if dp["realtime"].connected else 0)
+    SUBSCRIBERS_ACTIVE.set_function(lambda: len(EXPIRY_INDEX))
+    JOIN_EVENTS.set_function(lambda: {(k,): n for k, n in dp["join_events"].stats.items()})
+    JOIN_EVENTS_PENDING.set_function(lambda: dp["join_events"].pending())
+    PAYMENT_SWEEP_LINKS.set_function(
+        lambda: {(k,): dp["payment_sweeper"].stats[k] for k in ("scanned", "paid", "expired", "cancelled", "errors")}
+    )
+    PAYMENT_SWEEP_RUNS.set_function(lambda: dp["payment_sweeper"].stats["runs"])
+    PAYMENT_SWEEP_SECONDS.set_function(lambda: dp["payment_sweeper"].stats["last_duration_s"] or 0)
+    RENEWAL_REMINDERS.set_function(
+        lambda: {(k,): dp["renewals"].stats[k] for k in ("reminded", "suppressed", "renewed")}
+    )
+    JOIN_QUEUE_DEPTH.set_function(
+        lambda: {("intake",): join_pipeline.intake.qsize(), ("ready",): join_pipeline.ready.qsize()}
+    )
+    OUTBOUND_QUEUE_DEPTH.set_function(lambda: {(lane,): n for lane, n in outbound.queue_depths().items()})
+    OUTBOUND_JOBS.set_function(
+        lambda: {(lane, result): n for lane, stats in outbound.stats.items() for result, n in stats.items()}
+    )
 
-    # Callback buttons
-    dp.callback_query.register(cb_plans_root, F.data == "plans_root")
-    dp.callback_query.register(cb_plans_basic, F.data == "plans_basic")
-    dp.callback_query.register(cb_plans_pro, F.data == "plans_pro")
-    dp.callback_query.register(cb_plans_premium, F.data == "plans_premium")
 
-    dp.callback_query.register(cb_buy_basic, F.data == "buy_basic")
-    dp.callback_query.register(cb_buy_pro, F.data == "buy_pro")
-    dp.callback_query.register(cb_buy_premium, F.data == "buy_premium")
+def start_services(dp: Dispatcher, names: Tuple[str, ...] = SERVICES):
+    for name in names:
+        dp[name].start()
 
-    dp.callback_query.register(cb_verify_basic, F.data == "verify_basic")
-    dp.callback_query.register(cb_verify_pro, F.data == "verify_pro")
-    dp.callback_query.register(cb_verify_premium, F.data == "verify_premium")
 
-    print("🤖 Auto Approve Bot with subscription running...")
-    await dp.start_polling(bot)
+async def stop_services(dp: Dispatcher):
+    for name in reversed(SERVICES):
+        await dp[name].stop()
+
+
+async def warm_cache(warmer: CacheWarmer) -> None:
+    try:
+        stats = await asyncio.wait_for(warmer.warm(), WARMUP_TIMEOUT)
+        log.info("Cache warm-up: %s", stats)
+    except Exception as ex:
+        log.error("Cache warm-up error: %r", ex)
+
+
+async def main(mode: str = BOT_MODE, workers: int = SHARD_WORKERS):
+    if mode == "webhook" and not (WEBHOOK_BASE_URL and WEBHOOK_SECRET):
+        raise RuntimeError("❌ Webhook mode needs WEBHOOK_BASE_URL and WEBHOOK_SECRET in .env file")
+    if workers > 0 and STORAGE_BACKEND == "memory":
+        # every worker process would open its own empty :memory: database
+        raise RuntimeError("❌ Shard workers need a shared STORAGE_BACKEND (sqlite or supabase), not memory")
+
+    bot = Bot(BOT_TOKEN)
+    dp = setup_dispatcher(bot)
+
+    # fill the plan cache before any update (or the backlog drain) is consumed
+    warmer = CacheWarmer()
+    if WARMUP_ENABLED:
+        await warm_cache(warmer)
+    start_services(dp)
+
+    # sharded: this process only receives updates and hands them to the workers
+    shards: Optional[ShardSupervisor] = None
+    if workers > 0:
+        shards = ShardSupervisor(dp, bot, workers)
+        dp["shards"] = shards
+        dp.update.outer_middleware(ShardRouterMiddleware(shards))
+        shards.start()
+
+    app = build_web_app(dp, bot, mode)
+    runner: Optional[web.AppRunner] = None
+    backlog_task = asyncio.create_task(startup_backlog(BACKLOG_CHATS)) if BACKLOG_CHATS else None
+
+    log.info("🤖 Auto Approve Bot with subscription running (%s, %d shard workers)...", mode, workers)
+    try:
+        if mode == "webhook":
+            runner = await start_web_app(app)
+            await bot.set_webhook(
+                WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=dp.resolve_used_update_types(),
+            )
+            await asyncio.Event().wait()
+        else:
+            if WEB_ENABLED or RAZORPAY_WEBHOOK_SECRET:
+                runner = await start_web_app(app)
+            # getUpdates is rejected while a webhook is set
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        if backlog_task:
+            backlog_task.cancel()
+            await asyncio.gather(backlog_task, return_exceptions=True)
+        if runner:
+            await runner.cleanup()
+        if shards:
+            await shards.stop()
+        await stop_services(dp)
+        try:
+            warmer.save_snapshot()
+        except OSError as ex:
+            log.error("Snapshot save error: %s", ex)
+        await STORE.close()
+        if RAZORPAY_CLIENT:
+            await RAZORPAY_CLIENT.aclose()
+        await bot.session.close()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Auto Approve bot")
+    parser.add_argument("command", nargs="?", choices=("run", "backlog", "worker"), default="run")
+    parser.add_argument("--mode", choices=("polling", "webhook"), default=BOT_MODE)
+    parser.add_argument("--workers", type=int, default=SHARD_WORKERS, help="run: shard worker processes (0 = single process)")
+    parser.add_argument("--shard", type=int, default=0, help="worker: shard index (spawned by the intake)")
+    parser.add_argument("--socket", default=SHARD_SOCKET, help="worker: intake socket path")
+    parser.add_argument("--chat", action="append", default=[], help="backlog: chat id or @username (repeatable)")
+    parser.add_argument("--dry-run", action="store_true", help="backlog: count eligible requests without approving")
+    args = parser.parse_args()
+
+    setup_logging()
+    if args.command == "backlog":
+        asyncio.run(backlog_cli(args.chat or BACKLOG_CHATS, args.dry_run))
+    elif args.command == "worker":
+        asyncio.run(run_worker(args.shard, args.socket))
+    else:
+        asyncio.run(main(args.mode, args.workers))
@@ -0,0 +1,135 @@
+"""
+Logging: structured JSON (or text) records written by a listener thread.
+
+The event loop only enqueues records; per-update context (update, chat and
+user id) is copied onto each record from context variables, and repeated
+message templates are rate-limited.
+"""
+
+import atexit
+import json
+import logging
+import queue
+import sys
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import LOG_FORMAT, LOG_LEVEL, LOG_QUEUE_SIZE, LOG_RATE_LIMIT, LOG_RATE_WINDOW
+
+
+# set per update by LogContextMiddleware (and per job by the join pipeline); copied onto every record
+LOG_UPDATE_ID: ContextVar[Optional[int]] = ContextVar("log_update_id", default=None)
+LOG_CHAT_ID: ContextVar[Optional[int]] = ContextVar("log_chat_id", default=None)
+LOG_USER_ID: ContextVar[Optional[int]] = ContextVar("log_user_id", default=None)
+
+
+def bind_log_context(update_id: Optional[int] = None, chat_id: Optional[int] = None, user_id: Optional[int] = None):
+    LOG_UPDATE_ID.set(update_id)
+    LOG_CHAT_ID.set(chat_id)
+    LOG_USER_ID.set(user_id)
+
+
+class LogContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.update_id = LOG_UPDATE_ID.get()
+        record.chat_id = LOG_CHAT_ID.get()
+        record.user_id = LOG_USER_ID.get()
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    At most `limit` records per (logger, message template) per `window`
+    seconds; the first record of the next window reports how many were
+    suppressed. Keeps a join burst of identical "skip" lines to a trickle.
+    """
+
+    def __init__(self, limit: int, window: float):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self._windows: Dict[Tuple[str, Any], List[float]] = {}  # key → [window start, passed, suppressed]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.limit <= 0:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        entry = self._windows.get(key)
+        if entry is None or now - entry[0] >= self.window:
+            if entry and entry[2]:
+                record.suppressed = int(entry[2])
+            self._windows[key] = [now, 1, 0]
+            return True
+        if entry[1] < self.limit:
+            entry[1] += 1
+            return True
+        entry[2] += 1
+        return False
+
+
+class DroppingQueueHandler(QueueHandler):
+    # never block or raise on the event loop: a full queue drops the record
+    def __init__(self, q: queue.Queue):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the stock prepare() renders the message and traceback here, on the event loop;
+        # hand the record (args and exc_info intact) to the listener thread to format instead
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    FIELDS = ("update_id", "chat_id", "user_id", "suppressed")
+
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key in self.FIELDS:
+            value = getattr(record, key, None)
+            if value is not None:
+                out[key] = value
+        data = getattr(record, "data", None)
+        if data:
+            out.update(data)
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            out["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT) -> QueueListener:
+    # handlers only enqueue; formatting and the stdout write happen on the listener's thread
+    stream = logging.StreamHandler(sys.stdout)
+    if fmt == "json":
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    handler.addFilter(RateLimitFilter(LOG_RATE_LIMIT, LOG_RATE_WINDOW))
+    handler.addFilter(LogContextFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+
+    listener = QueueListener(handler.queue, stream)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,294 @@
+"""
+Prometheus-style metrics and per-update tracing.
+
+Metrics live in one registry rendered by /metrics. Counters and gauges are
+either updated inline or bound to a function that reads the live object at
+scrape time. The aiogram middlewares here time handlers and Bot API calls
+and collect each update's trace spans.
+"""
+
+import asyncio
+import bisect
+import functools
+import logging
+import time
+from collections import OrderedDict, defaultdict
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from config import TRACE_SLOW_MS
+from logs import bind_log_context
+
+log = logging.getLogger(__name__)
+
+
+def _render_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = ['%s="%s"' % (n, str(v).replace("\\", "\\\\").replace('"', '\\"')) for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = defaultdict(float)
+        self._fn = None
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def set_function(self, fn) -> None:
+        # fn() -> number, or {label-values tuple: number}; evaluated at scrape time
+        self._fn = fn
+
+    def samples(self):
+        if self._fn is None:
+            return list(self._values.items())
+        value = self._fn()
+        return list(value.items()) if isinstance(value, dict) else [((), value)]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in self.samples():
+            lines.append(f"{self.name}{_render_labels(self.labelnames, key)} {float(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        self._values[self._key(labels)] += amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (), buckets=BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+        # per label set: [bucket counts..., +Inf count, sum]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, series in self._series.items():
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = _render_labels(self.labelnames, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            le = _render_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_render_labels(self.labelnames, key)} {series[-1]}")
+            lines.append(f"{self.name}_count{_render_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: "OrderedDict[str, Metric]" = OrderedDict()
+
+    def _add(self, metric: Metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._add(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self._add(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Histogram:
+        return self._add(Histogram(name, help_text, labelnames))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception as ex:
+                log.error("metrics render error (%s): %s", metric.name, ex)
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+
+HANDLER_SECONDS = METRICS.histogram("bot_handler_seconds", "aiogram handler latency", ("handler",))
+HANDLER_ERRORS = METRICS.counter("bot_handler_errors_total", "aiogram handler exceptions", ("handler",))
+STORAGE_SECONDS = METRICS.histogram("storage_call_seconds", "Supabase/storage call latency", ("op",))
+STORAGE_ERRORS = METRICS.counter("storage_errors_total", "Supabase/storage call failures", ("op",))
+RAZORPAY_SECONDS = METRICS.histogram("razorpay_call_seconds", "Razorpay API call latency (incl. retries)", ("op",))
+RAZORPAY_ERRORS = METRICS.counter("razorpay_errors_total", "Razorpay API call failures", ("op",))
+TG_API_SECONDS = METRICS.histogram("telegram_api_seconds", "Outbound Bot API call latency", ("method",))
+TG_API_ERRORS = METRICS.counter("telegram_api_errors_total", "Outbound Bot API call failures", ("method",))
+TG_RETRY_AFTER = METRICS.counter("telegram_retry_after_total", "RetryAfter (429) answers from Telegram", ("method",))
+LOOP_LAG_SECONDS = METRICS.histogram("event_loop_lag_seconds", "Event-loop scheduling delay")
+BREAKER_REJECTED = METRICS.counter("circuit_breaker_rejected_total", "Calls fast-failed by an open circuit", ("dependency",))
+BREAKER_OPENED = METRICS.counter("circuit_breaker_opened_total", "Circuit transitions to open", ("dependency",))
+REALTIME_EVENTS = METRICS.counter("realtime_events_total", "Supabase Realtime change events", ("table", "type"))
+
+# function-backed: values are read from the live objects at scrape time (see bind_service_metrics)
+SUB_CACHE_LOOKUPS = METRICS.counter("sub_cache_lookups_total", "Subscription cache lookups", ("result",))
+SUB_CACHE_HIT_RATIO = METRICS.gauge("sub_cache_hit_ratio", "Subscription cache hit ratio")
+SUB_CACHE_ENTRIES = METRICS.gauge("sub_cache_entries", "Subscription cache size")
+JOIN_QUEUE_DEPTH = METRICS.gauge("join_queue_depth", "Join pipeline queue depth", ("stage",))
+OUTBOUND_QUEUE_DEPTH = METRICS.gauge("outbound_queue_depth", "Outbound scheduler queue depth", ("lane",))
+OUTBOUND_JOBS = METRICS.counter("outbound_jobs_total", "Outbound scheduler jobs by outcome", ("lane", "result"))
+BREAKER_STATE = METRICS.gauge("circuit_breaker_state", "Circuit state (0 closed, 1 half-open, 2 open)", ("dependency",))
+BREAKER_TIMEOUT = METRICS.gauge("circuit_breaker_timeout_seconds", "Adaptive call timeout", ("dependency",))
+REALTIME_CONNECTED = METRICS.gauge("realtime_connected", "Supabase Realtime channel joined (1/0)")
+SHARD_ROUTED = METRICS.counter("shard_updates_total", "Updates routed by the sharded intake", ("result",))
+SHARD_LIVE_WORKERS = METRICS.gauge("shard_live_workers", "Shard workers connected to the intake")
+SUBSCRIBERS_ACTIVE = METRICS.gauge("subscribers_active", "Plans in the expiry index that haven't expired")
+RENEWAL_REMINDERS = METRICS.counter("renewal_reminders_total", "Renewal reminder outcomes", ("result",))
+JOIN_EVENTS = METRICS.counter("join_events_total", "Join event log rows", ("result",))
+JOIN_EVENTS_PENDING = METRICS.gauge("join_events_pending", "Join event rows buffered for the next flush")
+PAYMENT_SWEEP_LINKS = METRICS.counter("payment_sweep_links_total", "Pending payment links checked by the sweeper", ("result",))
+PAYMENT_SWEEP_RUNS = METRICS.counter("payment_sweep_runs_total", "Completed payment sweeps")
+PAYMENT_SWEEP_SECONDS = METRICS.gauge("payment_sweep_last_duration_seconds", "Duration of the last payment sweep")
+
+# per-update trace: list of (span, seconds) collected while an update is handled
+_TRACE: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("trace", default=None)
+
+
+def trace_span(name: str, seconds: float) -> None:
+    spans = _TRACE.get()
+    if spans is not None:
+        spans.append((name, seconds))
+
+
+def instrumented(histogram: Histogram, errors: Counter, label: str, value: str):
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            except Exception:
+                errors.inc(**{label: value})
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                histogram.observe(elapsed, **{label: value})
+                trace_span(f"{label}:{value}", elapsed)
+
+        return wrapper
+
+    return decorator
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    # inner middleware: runs only once a handler matched, so `handler` is known
+    async def __call__(self, handler, event, data):
+        name = data["handler"].callback.__name__ if data.get("handler") else "unknown"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            HANDLER_SECONDS.observe(elapsed, handler=name)
+            trace_span(f"handler:{name}", elapsed)
+
+
+class LogContextMiddleware(BaseMiddleware):
+    # outer update middleware, after aiogram's UserContextMiddleware filled event_chat / event_from_user
+    async def __call__(self, handler, event, data):
+        chat, user = data.get("event_chat"), data.get("event_from_user")
+        bind_log_context(event.update_id, chat.id if chat else None, user.id if user else None)
+        return await handler(event, data)
+
+
+class UpdateTraceMiddleware(BaseMiddleware):
+    # outer update middleware: collects spans for one update and logs slow ones
+    async def __call__(self, handler, event, data):
+        spans: List[Tuple[str, float]] = []
+        token = _TRACE.set(spans)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            _TRACE.reset(token)
+            total_ms = (time.perf_counter() - started) * 1000
+            if total_ms >= TRACE_SLOW_MS:
+                log.info(
+                    "slow update",
+                    extra={
+                        "data": {
+                            "type": getattr(event, "event_type", None),
+                            "total_ms": round(total_ms, 2),
+                            "spans": [[n, round(s * 1000, 2)] for n, s in spans],
+                        }
+                    },
+                )
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter:
+            TG_RETRY_AFTER.inc(method=name)
+            raise
+        except Exception:
+            TG_API_ERRORS.inc(method=name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            TG_API_SECONDS.observe(elapsed, method=name)
+            trace_span(f"telegram:{name}", elapsed)
+
+
+class LoopLagMonitor:
+    def __init__(self, interval: float = 0.25):
+        self.interval = interval
+        self.last_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.last_lag = max(0.0, loop.time() - started - self.interval)
+            LOOP_LAG_SECONDS.observe(self.last_lag)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
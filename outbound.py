@@ -0,0 +1,390 @@
+"""
+Outbound Bot API traffic: approvals and DMs go through one rate-limited,
+prioritised scheduler instead of calling Telegram directly from handlers.
+"""
+
+import asyncio
+import hashlib
+import itertools
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+
+from config import (
+    DM_DEDUP_CAPACITY,
+    DM_DEDUP_WINDOW,
+    DM_UNREACHABLE_TTL,
+    TG_APPROVE_CHAT_RATE,
+    TG_DM_CHAT_RATE,
+    TG_DM_MAX_AGE,
+    TG_DM_QUEUE_SIZE,
+    TG_GLOBAL_RATE,
+    TG_MAX_INFLIGHT,
+    TG_MAX_RETRIES,
+)
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        # seconds until one token is available (0 = go now)
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+
+class RotatingBloomFilter:
+    """
+    Two-generation Bloom filter for "seen recently" checks. A key added in the
+    current generation is remembered for `window` to 2× `window` seconds; a
+    generation also rotates early once it holds `capacity` keys, so the
+    false-positive rate stays near `error_rate` (≈1.8 bytes per key per
+    generation at 0.1 %).
+    """
+
+    def __init__(self, window: float, capacity: int, error_rate: float = 0.001):
+        self.window = window
+        self.capacity = max(1, capacity)
+        self.bits = max(64, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / self.capacity * math.log(2)))
+        self._current = bytearray((self.bits + 7) // 8)
+        self._previous = bytearray(len(self._current))
+        self._count = 0
+        self._rotated = time.monotonic()
+
+    def _positions(self, key: str) -> List[int]:
+        # double hashing over one 128-bit digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    @staticmethod
+    def _contains(bits: bytearray, positions: List[int]) -> bool:
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in positions)
+
+    def _rotate(self) -> None:
+        now = time.monotonic()
+        if now - self._rotated >= self.window or self._count >= self.capacity:
+            self._previous, self._current = self._current, bytearray(len(self._current))
+            self._count = 0
+            self._rotated = now
+
+    def seen(self, key: str) -> bool:
+        """True if `key` was (probably) added within the window; does not remember it."""
+        self._rotate()
+        positions = self._positions(key)
+        return self._contains(self._current, positions) or self._contains(self._previous, positions)
+
+    def add(self, key: str) -> bool:
+        """Remember `key`; False if it was (probably) already seen within the window."""
+        self._rotate()
+        positions = self._positions(key)
+        if self._contains(self._current, positions) or self._contains(self._previous, positions):
+            return False
+        for p in positions:
+            self._current[p >> 3] |= 1 << (p & 7)
+        self._count += 1
+        return True
+
+
+class OutboundJob:
+    __slots__ = ("lane", "key", "call", "future", "enqueued", "attempts")
+
+    def __init__(self, lane: str, key: int, call, future: Optional[asyncio.Future], enqueued: float):
+        self.lane = lane
+        self.key = key
+        self.call = call
+        self.future = future
+        self.enqueued = enqueued
+        self.attempts = 0
+
+
+class OutboundScheduler:
+    """
+    Single funnel for Bot API writes.
+
+    Lanes are served strictly in priority order (approvals before DMs). Every
+    call needs a token from the global bucket and from its chat's bucket;
+    jobs whose chat is throttled are skipped so other chats keep flowing.
+    A TelegramRetryAfter pauses all sends for the advertised time and the
+    job is retried at the head of its lane. The DM lane is bounded and
+    age-limited – courtesy DMs are the first thing dropped under pressure.
+
+    DMs are suppressed before they cost a token: users Telegram refused a DM
+    for are skipped for `unreachable_ttl`, and a DM with a `dedup_key` goes
+    out at most once per `dedup_window`.
+
+    In sharded mode a worker's `global_bucket` is a LeasedBucket, the
+    intake hands out its own budget through borrow(), and the `on_*` hooks
+    relay pauses, (un)reachable users and claimed dedup keys to the other
+    processes.
+    """
+
+    LANES = ("approve", "dm")
+    SCAN_DEPTH = 64
+    MAX_BUCKETS = 20000
+    MAX_UNREACHABLE = 200000
+
+    def __init__(
+        self,
+        bot: Bot,
+        global_rate: float = TG_GLOBAL_RATE,
+        approve_chat_rate: float = TG_APPROVE_CHAT_RATE,
+        dm_chat_rate: float = TG_DM_CHAT_RATE,
+        dm_queue_size: int = TG_DM_QUEUE_SIZE,
+        dm_max_age: float = TG_DM_MAX_AGE,
+        max_inflight: int = TG_MAX_INFLIGHT,
+        max_retries: int = TG_MAX_RETRIES,
+        dedup_window: float = DM_DEDUP_WINDOW,
+        dedup_capacity: int = DM_DEDUP_CAPACITY,
+        unreachable_ttl: float = DM_UNREACHABLE_TTL,
+        global_bucket=None,
+    ):
+        self.bot = bot
+        self.global_rate = global_rate
+        self.chat_rates = {"approve": approve_chat_rate, "dm": dm_chat_rate}
+        self.max_sizes = {"approve": 0, "dm": dm_queue_size}
+        self.max_ages = {"approve": 0.0, "dm": dm_max_age}
+        self.max_retries = max_retries
+        self.lanes: Dict[str, deque] = {lane: deque() for lane in self.LANES}
+        self.stats: Dict[str, Dict[str, int]] = {
+            lane: {"sent": 0, "failed": 0, "dropped": 0, "retry_after": 0, "suppressed": 0} for lane in self.LANES
+        }
+        self.dm_dedup = RotatingBloomFilter(dedup_window, dedup_capacity) if dedup_window > 0 else None
+        self.unreachable_ttl = unreachable_ttl
+        self._unreachable: "OrderedDict[int, float]" = OrderedDict()  # user_id → retry DMs after (monotonic)
+        self.paused_until = 0.0
+        self.on_retry_after = None  # fn(seconds)
+        self.on_reachable = None  # fn(user_id)
+        self.on_unreachable = None  # fn(user_id)
+        self.on_dedup = None  # fn(dedup_key)
+        self._global_bucket = global_bucket  # TokenBucket (created in _run) or LeasedBucket
+        self._buckets: "OrderedDict[Tuple[str, int], TokenBucket]" = OrderedDict()
+        self._inflight = asyncio.Semaphore(max_inflight)
+        self._wakeup = asyncio.Event()
+        self._runner: Optional[asyncio.Task] = None
+        self._tasks: set = set()
+
+    # ---- public API ----
+
+    async def approve_join(self, chat_id: int, user_id: int):
+        return await self.submit(
+            "approve",
+            chat_id,
+            lambda: self.bot.approve_chat_join_request(chat_id=chat_id, user_id=user_id),
+        )
+
+    def send_dm(self, user_id: int, text: str, dedup_key: Optional[str] = None, **kwargs) -> bool:
+        # fire-and-forget; False when the DM was suppressed or dropped
+        dedup = self.dm_dedup if dedup_key else None
+        if self.is_unreachable(user_id) or (dedup and dedup.seen(dedup_key)):
+            self.stats["dm"]["suppressed"] += 1
+            return False
+        if not self.enqueue("dm", user_id, lambda: self.bot.send_message(user_id, text, **kwargs)):
+            return False
+        # only a queued DM claims its key – one dropped by a full lane may be sent on the next try
+        if dedup:
+            self.claim_dedup(dedup_key)
+        return True
+
+    def claim_dedup(self, dedup_key: str, notify: bool = True) -> None:
+        if self.dm_dedup is None:
+            return
+        self.dm_dedup.add(dedup_key)
+        if notify and self.on_dedup:
+            self.on_dedup(dedup_key)
+
+    def is_unreachable(self, user_id: int) -> bool:
+        until = self._unreachable.get(user_id)
+        if until is None:
+            return False
+        if time.monotonic() < until:
+            return True
+        del self._unreachable[user_id]
+        return False
+
+    def mark_unreachable(self, user_id: int, notify: bool = True) -> None:
+        if self.unreachable_ttl <= 0:
+            return
+        self._unreachable[user_id] = time.monotonic() + self.unreachable_ttl
+        self._unreachable.move_to_end(user_id)
+        while len(self._unreachable) > self.MAX_UNREACHABLE:
+            self._unreachable.popitem(last=False)
+        if notify and self.on_unreachable:
+            self.on_unreachable(user_id)
+
+    def mark_reachable(self, user_id: int, notify: bool = True) -> None:
+        self._unreachable.pop(user_id, None)
+        if notify and self.on_reachable:
+            self.on_reachable(user_id)
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, asyncio.get_running_loop().time() + seconds)
+
+    def borrow(self, n: int) -> Tuple[int, float]:
+        """Take up to `n` global tokens for another process: (granted, seconds until more)."""
+        now = asyncio.get_running_loop().time()
+        if now < self.paused_until:
+            return 0, self.paused_until - now
+        if self._global_bucket is None:
+            return 0, 1.0 / self.global_rate
+        delay = self._global_bucket.delay(now)
+        if delay > 0:
+            return 0, delay
+        granted = min(n, int(self._global_bucket.tokens))
+        self._global_bucket.tokens -= granted
+        return granted, 0.0
+
+    async def submit(self, lane: str, key: int, call):
+        future = asyncio.get_running_loop().create_future()
+        if not self.enqueue(lane, key, call, future):
+            raise RuntimeError(f"outbound lane '{lane}' is full")
+        return await future
+
+    def enqueue(self, lane: str, key: int, call, future: Optional[asyncio.Future] = None) -> bool:
+        queue = self.lanes[lane]
+        limit = self.max_sizes[lane]
+        if limit and len(queue) >= limit:
+            self.stats[lane]["dropped"] += 1
+            return False
+        queue.append(OutboundJob(lane, key, call, future, asyncio.get_running_loop().time()))
+        self._wakeup.set()
+        return True
+
+    def queue_depths(self) -> Dict[str, int]:
+        return {lane: len(queue) for lane, queue in self.lanes.items()}
+
+    def start(self) -> None:
+        self._runner = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._runner:
+            self._runner.cancel()
+            await asyncio.gather(self._runner, return_exceptions=True)
+            self._runner = None
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    # ---- internals ----
+
+    def _bucket(self, lane: str, key: int, now: float) -> TokenBucket:
+        bucket = self._buckets.get((lane, key))
+        if bucket is None:
+            rate = self.chat_rates[lane]
+            bucket = TokenBucket(rate, max(1.0, rate), now)
+            self._buckets[(lane, key)] = bucket
+            if len(self._buckets) > self.MAX_BUCKETS:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end((lane, key))
+        return bucket
+
+    def _drop(self, job: OutboundJob, exc: Optional[BaseException] = None) -> None:
+        self.stats[job.lane]["dropped"] += 1
+        if job.future and not job.future.done():
+            job.future.set_exception(exc or RuntimeError("outbound job dropped"))
+
+    def _pick(self, now: float) -> Tuple[Optional[OutboundJob], Optional[float]]:
+        wait: Optional[float] = None
+        for lane in self.LANES:
+            queue = self.lanes[lane]
+            max_age = self.max_ages[lane]
+            while max_age and queue and now - queue[0].enqueued > max_age:
+                self._drop(queue.popleft())
+
+            for i, job in enumerate(itertools.islice(queue, self.SCAN_DEPTH)):
+                bucket = self._bucket(lane, job.key, now)
+                delay = bucket.delay(now)
+                if delay <= 0:
+                    del queue[i]
+                    bucket.take()
+                    return job, None
+                wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._global_bucket is None:
+            self._global_bucket = TokenBucket(self.global_rate, max(1.0, self.global_rate), loop.time())
+
+        while True:
+            now = loop.time()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+
+            delay = self._global_bucket.delay(now)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            job, wait = self._pick(now)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._global_bucket.take()
+            await self._inflight.acquire()
+            task = asyncio.create_task(self._execute(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, job: OutboundJob) -> None:
+        stats = self.stats[job.lane]
+        try:
+            result = await job.call()
+        except TelegramRetryAfter as ex:
+            stats["retry_after"] += 1
+            self.pause(ex.retry_after)
+            if self.on_retry_after:
+                self.on_retry_after(ex.retry_after)
+            job.attempts += 1
+            if job.attempts > self.max_retries:
+                self._drop(job, ex)
+            else:
+                self.lanes[job.lane].appendleft(job)
+                self._wakeup.set()
+        except Exception as ex:
+            stats["failed"] += 1
+            if job.lane == "dm" and isinstance(ex, TelegramForbiddenError):
+                # "bot can't initiate conversation" / "bot was blocked by the user"
+                self.mark_unreachable(job.key)
+            if job.future and not job.future.done():
+                job.future.set_exception(ex)
+        else:
+            stats["sent"] += 1
+            if job.future and not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._inflight.release()
+
+
+class DmReachabilityMiddleware(BaseMiddleware):
+    # anything the user sends in their private chat with the bot means DMs work again
+    async def __call__(self, handler, event, data):
+        chat, user = data.get("event_chat"), data.get("event_from_user")
+        if user and chat and chat.type == "private":
+            data["outbound"].mark_reachable(user.id)
+        return await handler(event, data)
@@ -0,0 +1,282 @@
+"""
+Razorpay payment links: creating them, reading their status, applying a paid
+link to the user's subscription exactly once, and the periodic sweep that
+reconciles links whose webhook never arrived.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from config import (
+    PAYMENT_FETCH_MEMO_SECONDS,
+    PAYMENT_LINK_TTL_HOURS,
+    PLAN_DURATION_DAYS,
+    RAZORPAY_KEY_ID,
+    RAZORPAY_KEY_SECRET,
+    RAZORPAY_WEBHOOK_SECRET,
+    SWEEP_CONCURRENCY,
+    SWEEP_INTERVAL,
+    SWEEP_PAGE_SIZE,
+)
+from persistence import (
+    sp_fetch_latest_payment_link,
+    sp_get_payment_link_by_plink_id,
+    sp_insert_payment_link,
+    sp_list_pending_payment_links,
+    sp_rpc_apply_successful_payment,
+    sp_set_payment_link_status,
+)
+from razorpay_client import PaymentLink, RazorpayAsyncClient
+from subscriptions import EXPIRY_INDEX, SUB_CACHE, SubState, parse_iso_utc
+from singleflight import SingleFlight
+from outbound import OutboundScheduler
+
+log = logging.getLogger(__name__)
+
+
+RAZORPAY_CLIENT: Optional[RazorpayAsyncClient] = None
+if RAZORPAY_KEY_ID and RAZORPAY_KEY_SECRET:
+    RAZORPAY_CLIENT = RazorpayAsyncClient(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET)
+
+
+async def sp_get_latest_payment_link(user_id: int, plan_id: str) -> Optional[dict]:
+    try:
+        return await sp_fetch_latest_payment_link(user_id, plan_id)
+    except Exception as ex:
+        log.warning("sp_get_latest_payment_link error: %s", ex)
+        return None
+
+
+async def sp_apply_successful_payment(user_id: int, payment_row: dict) -> datetime:
+    result = await sp_rpc_apply_successful_payment(payment_row["id"])
+    SUB_CACHE.invalidate(user_id)
+
+    # a logical failure (e.g. not_found) is raised here, outside the breaker: the backend answered fine
+    new_exp = parse_iso_utc(result.get("expires_at"))
+    if new_exp is None:
+        raise RuntimeError(f"apply_successful_payment failed: {result.get('reason')}")
+    EXPIRY_INDEX.track(SubState(user_id, payment_row.get("plan_id"), payment_row.get("plan_label"), new_exp.timestamp()))
+    return new_exp
+
+
+async def create_payment_link(
+    user_id: int, amount_paise: int, plan_id: str, plan_label: str, duration_days: int = PLAN_DURATION_DAYS
+) -> Optional[str]:
+    if not RAZORPAY_CLIENT:
+        log.error("create_payment_link: Razorpay client not configured")
+        return None
+
+    # Razorpay ko emoji pasand nahi – ASCII clean label
+    try:
+        ascii_label = plan_label.encode("ascii", "ignore").decode().strip()
+        if not ascii_label:
+            ascii_label = plan_id.upper()
+    except Exception:
+        ascii_label = plan_id.upper()
+
+    try:
+        link = await RAZORPAY_CLIENT.create_payment_link(
+            {
+                "amount": amount_paise,
+                "currency": "INR",
+                "description": f"GetAIPilot Subscription - {ascii_label}",
+                "customer": {"name": str(user_id)},
+                "notify": {"sms": True, "email": False},
+                "callback_url": "https://razorpay.com/",
+                "callback_method": "get",
+            }
+        )
+        p_url = link.short_url
+        p_id = link.id
+
+        await sp_insert_payment_link(
+            {
+                "user_id": user_id,
+                "plan_id": plan_id,
+                "plan_label": plan_label,
+                "price_paise": amount_paise,
+                "duration_days": duration_days,
+                "paymentlink_id": p_id,
+                "paymentlink_url": p_url,
+                "status": "created",
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "raw": link.raw,
+            }
+        )
+
+        return p_url
+    except Exception as ex:
+        log.error("create_payment_link error: %s", ex)
+        return None
+
+
+PLINK_FETCHES = SingleFlight(memo_ttl=PAYMENT_FETCH_MEMO_SECONDS)  # paymentlink_id → PaymentLink
+
+
+async def fetch_payment_link_info(plink_id: str) -> PaymentLink:
+    return await PLINK_FETCHES.do(plink_id, lambda: RAZORPAY_CLIENT.fetch_payment_link(plink_id))
+
+
+def payment_success_text(new_exp: datetime) -> str:
+    new_exp_str = new_exp.strftime("%Y-%m-%d %H:%M UTC")
+    return (
+        "✅ **Payment verified successfully!**\n\n"
+        f"Your plan is now active until: `{new_exp_str}`\n\n"
+        "Ab aap **Auto Forward bot + Join Counter + Auto Approve bot** sab use kar sakte ho. 🎉"
+    )
+
+
+# paymentlink_ids already applied by this process (first-line idempotency; the
+# row status in Supabase is the durable check)
+_PAID_PLINKS: "OrderedDict[str, None]" = OrderedDict()
+_PAID_PLINKS_MAX = 10000
+_PLINKS_IN_FLIGHT: set = set()
+
+
+def verify_razorpay_signature(body: bytes, signature: str) -> bool:
+    expected = hmac.new(RAZORPAY_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature or "")
+
+
+def remember_paid(plink_id: str) -> None:
+    PLINK_FETCHES.forget(plink_id)  # a memoized pre-payment status must not outlive the payment
+    _PAID_PLINKS[plink_id] = None
+    while len(_PAID_PLINKS) > _PAID_PLINKS_MAX:
+        _PAID_PLINKS.popitem(last=False)
+
+
+async def apply_paid_payment_link(plink_id: str, outbound: OutboundScheduler, row: Optional[dict] = None) -> str:
+    if plink_id in _PAID_PLINKS or plink_id in _PLINKS_IN_FLIGHT:
+        return "duplicate"
+
+    _PLINKS_IN_FLIGHT.add(plink_id)
+    try:
+        if row is None:
+            row = await sp_get_payment_link_by_plink_id(plink_id)
+        if not row:
+            return "unknown"
+        if (row.get("status") or "").lower() == "paid":
+            remember_paid(plink_id)
+            return "duplicate"
+
+        user_id = int(row["user_id"])
+        new_exp = await sp_apply_successful_payment(user_id, row)
+        remember_paid(plink_id)
+    finally:
+        _PLINKS_IN_FLIGHT.discard(plink_id)
+
+    outbound.send_dm(user_id, payment_success_text(new_exp), parse_mode="Markdown")
+    return "applied"
+
+
+class PaymentSweeper:
+    """
+    Periodically pages through `status='created'` payment links and asks
+    Razorpay for their real status: paid links are applied (same idempotent
+    path as the webhook) and links Razorpay reports expired/cancelled are
+    closed out locally. A link still open at Razorpay after
+    PAYMENT_LINK_TTL_HOURS is cancelled there first, so a row is never
+    closed while the user can still pay it.
+    """
+
+    CLOSED_STATUSES = {"expired", "cancelled"}
+
+    def __init__(
+        self,
+        outbound: OutboundScheduler,
+        interval: float = SWEEP_INTERVAL,
+        concurrency: int = SWEEP_CONCURRENCY,
+        page_size: int = SWEEP_PAGE_SIZE,
+        link_ttl: timedelta = timedelta(hours=PAYMENT_LINK_TTL_HOURS),
+    ):
+        self.outbound = outbound
+        self.interval = interval
+        self.page_size = page_size
+        self.link_ttl = link_ttl
+        self._sem = asyncio.Semaphore(max(1, concurrency))
+        self._task: Optional[asyncio.Task] = None
+        self.stats: Dict[str, Any] = {
+            "runs": 0,
+            "scanned": 0,
+            "paid": 0,
+            "expired": 0,
+            "cancelled": 0,
+            "errors": 0,
+            "in_progress": False,
+            "last_run_at": None,
+            "last_duration_s": None,
+        }
+
+    def start(self) -> None:
+        if self.interval > 0 and RAZORPAY_CLIENT:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await self.sweep()
+            except Exception as ex:
+                log.error("Payment sweep error: %s", ex)
+            await asyncio.sleep(self.interval)
+
+    async def sweep(self) -> None:
+        started = time.monotonic()
+        self.stats["in_progress"] = True
+        after_id = 0
+        try:
+            while True:
+                page = await sp_list_pending_payment_links(after_id, self.page_size)
+                if not page:
+                    break
+                after_id = max(int(r["id"]) for r in page)
+                await asyncio.gather(*(self._check(row) for row in page))
+                if len(page) < self.page_size:
+                    break
+        finally:
+            self.stats["in_progress"] = False
+            self.stats["runs"] += 1
+            self.stats["last_run_at"] = datetime.now(timezone.utc).isoformat()
+            self.stats["last_duration_s"] = round(time.monotonic() - started, 3)
+
+    async def _check(self, row: dict) -> None:
+        self.stats["scanned"] += 1
+        plink_id = row.get("paymentlink_id")
+        try:
+            if not plink_id:
+                # Razorpay never issued this link, there is nothing to wait for
+                await sp_set_payment_link_status(row["id"], "expired")
+                self.stats["expired"] += 1
+                return
+
+            cancelled = False
+            async with self._sem:
+                status = (await fetch_payment_link_info(plink_id)).status
+                created = parse_iso_utc(row.get("created_at"))
+                if status == "created" and created is not None and datetime.now(timezone.utc) - created > self.link_ttl:
+                    status = (await RAZORPAY_CLIENT.cancel_payment_link(plink_id)).status
+                    cancelled = True
+                    self.stats["cancelled"] += 1
+
+            if status == "paid":
+                if await apply_paid_payment_link(plink_id, self.outbound, row) == "applied":
+                    self.stats["paid"] += 1
+            elif status in self.CLOSED_STATUSES:
+                await sp_set_payment_link_status(row["id"], status)
+                # a link this sweep cancelled is already counted as cancelled
+                if not cancelled:
+                    self.stats["expired"] += 1
+        except Exception as ex:
+            self.stats["errors"] += 1
+            log.error("Payment sweep error for link %s: %s", row.get("id"), ex)
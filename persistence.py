@@ -0,0 +1,121 @@
+"""
+The bot's storage backend (STORE) and the `sp_*` calls into it.
+
+Every call goes through the storage circuit breaker and is timed into the
+storage metrics; callers decide what a failure means for them.
+"""
+
+import functools
+from typing import Any, Dict, List, Optional
+
+from storage import Storage, make_storage
+from config import (
+    PLAN_DURATION_DAYS,
+    STORAGE_BACKEND,
+    STORAGE_SQLITE_PATH,
+    SUPABASE_IN_CHUNK,
+    SUPABASE_KEY,
+    SUPABASE_TIMEOUT,
+    SUPABASE_URL,
+)
+from metrics import STORAGE_ERRORS, STORAGE_SECONDS, instrumented
+from breakers import STORAGE_BREAKER
+
+
+# all persistence goes through STORE (storage.py) – async, so a slow round trip
+# never blocks the event loop
+STORE: Storage = make_storage(
+    STORAGE_BACKEND,
+    url=SUPABASE_URL,
+    key=SUPABASE_KEY,
+    timeout=SUPABASE_TIMEOUT,
+    in_chunk=SUPABASE_IN_CHUNK,
+    sqlite_path=STORAGE_SQLITE_PATH,
+)
+
+
+def storage_op(fn):
+    @functools.wraps(fn)
+    async def guarded(*args, **kwargs):
+        return await STORAGE_BREAKER.call(fn, *args, **kwargs)
+
+    return instrumented(STORAGE_SECONDS, STORAGE_ERRORS, "op", fn.__name__.removeprefix("sp_"))(guarded)
+
+
+@storage_op
+async def sp_fetch_subscription(user_id: int) -> Optional[dict]:
+    # raises on storage errors – callers decide whether a failure may be cached
+    return await STORE.get_subscription(user_id)
+
+
+@storage_op
+async def sp_fetch_subscriptions_bulk(user_ids: List[int]) -> Dict[int, dict]:
+    # one `user_id IN (...)` round trip per chunk; raises on storage errors
+    return await STORE.get_subscriptions(user_ids)
+
+
+@storage_op
+async def sp_fetch_chat_owners(chat_ids: List[int]) -> Dict[int, int]:
+    return await STORE.get_chat_owners(chat_ids)
+
+
+@storage_op
+async def sp_set_chat_owner(chat_id: int, owner_id: int) -> None:
+    await STORE.set_chat_owner(chat_id, owner_id)
+
+
+@storage_op
+async def sp_delete_chat_owner(chat_id: int) -> None:
+    await STORE.delete_chat_owner(chat_id)
+
+
+@storage_op
+async def sp_list_subscriptions(
+    after_user_id: int, limit: int, active_at: Optional[str] = None, updated_since: Optional[str] = None
+) -> List[dict]:
+    return await STORE.list_subscriptions(after_user_id, limit, active_at=active_at, updated_since=updated_since)
+
+
+@storage_op
+async def sp_fetch_latest_payment_link(user_id: int, plan_id: str) -> Optional[dict]:
+    return await STORE.get_latest_payment_link(user_id, plan_id)
+
+
+@storage_op
+async def sp_get_payment_link_by_plink_id(plink_id: str) -> Optional[dict]:
+    # raises on storage errors so the webhook can ask Razorpay to retry
+    return await STORE.get_payment_link_by_plink_id(plink_id)
+
+
+@storage_op
+async def sp_list_pending_payment_links(after_id: int, limit: int) -> List[dict]:
+    # keyset pagination over status='created' rows; raises on storage errors
+    return await STORE.list_pending_payment_links(after_id, limit)
+
+
+@storage_op
+async def sp_set_payment_link_status(row_id: int, status: str) -> None:
+    await STORE.update_payment_link_status(row_id, status)
+
+
+@storage_op
+async def sp_rpc_apply_successful_payment(link_id: int) -> Dict[str, Any]:
+    # one round trip: the RPC locks the link, extends from max(now, expiry) and marks
+    # it paid in a single transaction (sql/apply_successful_payment.sql) – replaying
+    # an already-paid link is a no-op that returns the current expiry
+    return await STORE.apply_successful_payment(link_id, PLAN_DURATION_DAYS)
+
+
+@storage_op
+async def sp_insert_payment_link(row: dict) -> None:
+    await STORE.insert_payment_link(row)
+
+
+@storage_op
+async def sp_insert_join_events(rows: List[dict]) -> None:
+    await STORE.insert_join_events(rows)
+
+
+@storage_op
+async def sp_fetch_owned_chats(owner_id: int) -> List[int]:
+    return await STORE.get_owned_chats(owner_id)
@@ -0,0 +1,158 @@
+"""
+Async Razorpay API client for payment links, on one pooled httpx client.
+"""
+
+import asyncio
+import random
+import time
+from typing import TYPE_CHECKING, NamedTuple, Optional
+
+from config import (
+    RAZORPAY_API_BASE,
+    RAZORPAY_CREATE_TIMEOUT,
+    RAZORPAY_FETCH_TIMEOUT,
+    RAZORPAY_MAX_CONNECTIONS,
+    RAZORPAY_MAX_RETRIES,
+)
+from metrics import RAZORPAY_ERRORS, RAZORPAY_SECONDS, instrumented
+from breakers import RAZORPAY_BREAKER, CircuitBreaker
+
+if TYPE_CHECKING:
+    import httpx  # imported lazily by RazorpayAsyncClient
+
+
+class RazorpayError(Exception):
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"Razorpay {status_code}: {message}")
+        self.status_code = status_code
+
+
+class PaymentLink(NamedTuple):
+    id: str
+    status: str
+    short_url: Optional[str]
+    amount: int
+    raw: dict
+
+    @classmethod
+    def from_json(cls, data: dict) -> "PaymentLink":
+        return cls(
+            id=data.get("id") or "",
+            status=(data.get("status") or "").lower(),
+            short_url=data.get("short_url") or data.get("url"),
+            amount=int(data.get("amount") or 0),
+            raw=data,
+        )
+
+
+class RazorpayAsyncClient:
+    """
+    Minimal async Razorpay API client (payment links only) on one pooled
+    httpx.AsyncClient. 429 / 5xx / connect errors are retried with jittered
+    exponential backoff; read timeouts are only retried for GETs so a slow
+    create can't silently produce a second link.
+
+    Every attempt goes through `breaker`: it fails fast while Razorpay is
+    down and gives GETs its adaptive timeout (creates keep their full timeout,
+    for the same reason they aren't retried).
+
+    httpx is imported and the pool opened on the first request.
+    """
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(
+        self,
+        key_id: str,
+        key_secret: str,
+        base_url: str = RAZORPAY_API_BASE,
+        max_retries: int = RAZORPAY_MAX_RETRIES,
+        breaker: CircuitBreaker = RAZORPAY_BREAKER,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.auth = (key_id, key_secret)
+        self.max_retries = max_retries
+        self.breaker = breaker
+        self._client = None
+
+    @property
+    def _http(self):
+        if self._client is None:
+            import httpx
+
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                auth=self.auth,
+                timeout=httpx.Timeout(10.0, connect=3.0),
+                limits=httpx.Limits(max_connections=RAZORPAY_MAX_CONNECTIONS, max_keepalive_connections=RAZORPAY_MAX_CONNECTIONS),
+            )
+        return self._client
+
+    @instrumented(RAZORPAY_SECONDS, RAZORPAY_ERRORS, "op", "payment_link.create")
+    async def create_payment_link(self, payload: dict) -> PaymentLink:
+        data = await self._request("POST", "/payment_links", RAZORPAY_CREATE_TIMEOUT, body=payload)
+        return PaymentLink.from_json(data)
+
+    @instrumented(RAZORPAY_SECONDS, RAZORPAY_ERRORS, "op", "payment_link.fetch")
+    async def fetch_payment_link(self, plink_id: str) -> PaymentLink:
+        data = await self._request("GET", f"/payment_links/{plink_id}", RAZORPAY_FETCH_TIMEOUT)
+        return PaymentLink.from_json(data)
+
+    @instrumented(RAZORPAY_SECONDS, RAZORPAY_ERRORS, "op", "payment_link.cancel")
+    async def cancel_payment_link(self, plink_id: str) -> PaymentLink:
+        data = await self._request("POST", f"/payment_links/{plink_id}/cancel", RAZORPAY_CREATE_TIMEOUT)
+        return PaymentLink.from_json(data)
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _request(self, method: str, path: str, timeout: float, body: Optional[dict] = None) -> dict:
+        import httpx
+
+        attempt = 0
+        while True:
+            retry_after: Optional[float] = None
+            self.breaker.allow()
+            started = time.monotonic()
+            try:
+                resp = await self._http.request(
+                    method, path, json=body, timeout=min(timeout, self.breaker.timeout) if method == "GET" else timeout
+                )
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout):
+                self.breaker.record_failure()
+                if attempt >= self.max_retries:
+                    raise
+            except httpx.ReadTimeout:
+                self.breaker.record_failure(timed_out=True)
+                if method != "GET" or attempt >= self.max_retries:
+                    raise
+            except Exception:
+                self.breaker.record_failure()
+                raise
+            else:
+                if resp.status_code in self.RETRY_STATUSES:
+                    self.breaker.record_failure()
+                else:
+                    # a 4xx is our request's fault, not Razorpay's health
+                    self.breaker.record_success(time.monotonic() - started)
+                if resp.status_code < 400:
+                    return resp.json()
+                if resp.status_code not in self.RETRY_STATUSES or attempt >= self.max_retries:
+                    raise RazorpayError(resp.status_code, self._error_message(resp))
+                try:
+                    retry_after = float(resp.headers.get("Retry-After", ""))
+                except ValueError:
+                    retry_after = None
+
+            delay = retry_after if retry_after is not None else min(8.0, 0.25 * 2**attempt)
+            await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+            attempt += 1
+
+    @staticmethod
+    def _error_message(resp: "httpx.Response") -> str:
+        try:
+            return resp.json().get("error", {}).get("description") or resp.text
+        except ValueError:
+            return resp.text
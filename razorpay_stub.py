@@ -0,0 +1,148 @@
+"""
+Local stand-in for the Razorpay payment-links API.
+
+Run it and point the bot at it:
+
+    python razorpay_stub.py --port 9100 --latency-ms 80 --error-rate 0.05
+    RAZORPAY_API_BASE=http://127.0.0.1:9100/v1 python login.py
+
+POST /stub/pay/<plink_id> marks a link paid and, when --webhook-url is
+given, delivers a signed `payment_link.paid` event like Razorpay does.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import random
+import time
+import uuid
+from typing import Dict, Optional
+
+from aiohttp import ClientSession, web
+
+LINKS = web.AppKey("links", dict)  # plink_id → link, for tests and the bench to inspect
+
+
+def build_app(
+    latency_ms: float = 0.0,
+    error_rate: float = 0.0,
+    webhook_url: Optional[str] = None,
+    webhook_secret: str = "",
+) -> web.Application:
+    links: Dict[str, dict] = {}
+    stats = {"create": 0, "fetch": 0, "cancel": 0, "injected_errors": 0}
+
+    async def simulate() -> Optional[web.Response]:
+        if latency_ms:
+            await asyncio.sleep(random.expovariate(1000.0 / latency_ms))
+        if error_rate and random.random() < error_rate:
+            stats["injected_errors"] += 1
+            status = random.choice((429, 502, 503))
+            return web.json_response(
+                {"error": {"code": "SERVER_ERROR", "description": "stub injected error"}},
+                status=status,
+                headers={"Retry-After": "0"} if status == 429 else None,
+            )
+        return None
+
+    async def create_link(request: web.Request) -> web.Response:
+        failure = await simulate()
+        if failure:
+            return failure
+        body = await request.json()
+        plink_id = "plink_" + uuid.uuid4().hex[:14]
+        link = {
+            "id": plink_id,
+            "amount": int(body.get("amount") or 0),
+            "currency": body.get("currency", "INR"),
+            "description": body.get("description", ""),
+            "status": "created",
+            "short_url": f"{request.scheme}://{request.host}/pay/{plink_id}",
+            "created_at": int(time.time()),
+        }
+        links[plink_id] = link
+        stats["create"] += 1
+        return web.json_response(link)
+
+    async def fetch_link(request: web.Request) -> web.Response:
+        failure = await simulate()
+        if failure:
+            return failure
+        link = links.get(request.match_info["plink_id"])
+        if not link:
+            return web.json_response(
+                {"error": {"code": "BAD_REQUEST_ERROR", "description": "The id provided does not exist"}},
+                status=400,
+            )
+        stats["fetch"] += 1
+        return web.json_response(link)
+
+    async def cancel_link(request: web.Request) -> web.Response:
+        failure = await simulate()
+        if failure:
+            return failure
+        link = links.get(request.match_info["plink_id"])
+        if not link or link["status"] != "created":
+            return web.json_response(
+                {"error": {"code": "BAD_REQUEST_ERROR", "description": "Payment link cannot be cancelled"}},
+                status=400,
+            )
+        link["status"] = "cancelled"
+        stats["cancel"] += 1
+        return web.json_response(link)
+
+    async def pay_link(request: web.Request) -> web.Response:
+        link = links.get(request.match_info["plink_id"])
+        if not link:
+            return web.json_response({"error": "unknown link"}, status=404)
+        link["status"] = "paid"
+
+        delivered = None
+        if webhook_url:
+            event = json.dumps(
+                {
+                    "event": "payment_link.paid",
+                    "payload": {"payment_link": {"entity": link}},
+                    "created_at": int(time.time()),
+                }
+            ).encode()
+            signature = hmac.new(webhook_secret.encode(), event, hashlib.sha256).hexdigest()
+            async with ClientSession() as session:
+                async with session.post(
+                    webhook_url,
+                    data=event,
+                    headers={"Content-Type": "application/json", "X-Razorpay-Signature": signature},
+                ) as resp:
+                    delivered = resp.status
+        return web.json_response({"id": link["id"], "status": "paid", "webhook_status": delivered})
+
+    async def get_stats(request: web.Request) -> web.Response:
+        return web.json_response({**stats, "links": len(links)})
+
+    app = web.Application()
+    app[LINKS] = links
+    app.router.add_post("/v1/payment_links", create_link)
+    app.router.add_get("/v1/payment_links/{plink_id}", fetch_link)
+    app.router.add_post("/v1/payment_links/{plink_id}/cancel", cancel_link)
+    app.router.add_post("/stub/pay/{plink_id}", pay_link)
+    app.router.add_get("/stub/stats", get_stats)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Razorpay payment-links stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="mean simulated latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered 429/5xx")
+    parser.add_argument("--webhook-url", default=None, help="bot's Razorpay webhook URL")
+    parser.add_argument("--webhook-secret", default="")
+    args = parser.parse_args()
+
+    web.run_app(
+        build_app(args.latency_ms, args.error_rate, args.webhook_url, args.webhook_secret),
+        host=args.host,
+        port=args.port,
+    )
@@ -0,0 +1,183 @@
+"""
+Supabase Realtime listener: keeps SUB_CACHE and EXPIRY_INDEX in step with
+subscription and payment-link changes made by other writers.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import random
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from config import REALTIME_ENABLED, REALTIME_HEARTBEAT, SUPABASE_KEY, SUPABASE_URL, WARMUP_PAGE_SIZE
+from metrics import REALTIME_EVENTS
+from persistence import sp_list_subscriptions
+from subscriptions import EXPIRY_INDEX, SUB_CACHE, SubState
+from warmup import SNAPSHOT_SKEW
+from payments import remember_paid
+
+log = logging.getLogger(__name__)
+
+
+class RealtimeListener:
+    """
+    Subscribes to postgres_changes on the tables shared with the other bots
+    (Phoenix channel protocol over one websocket). A subscription write
+    refreshes the cached SubState if we hold one, a paid payment link drops
+    the owner's entry, and after a reconnect the rows updated while we were
+    away are re-read.
+    """
+
+    TABLES = ("user_subscriptions", "user_payment_links")
+
+    def __init__(
+        self,
+        url: str = SUPABASE_URL,
+        key: str = SUPABASE_KEY,
+        enabled: bool = REALTIME_ENABLED,
+        heartbeat: float = REALTIME_HEARTBEAT,
+        topic: str = "realtime:login-bot",
+    ):
+        base = url.rstrip("/").replace("https://", "wss://", 1).replace("http://", "ws://", 1)
+        self.url = f"{base}/realtime/v1/websocket?apikey={key}&vsn=1.0.0"
+        self.key = key
+        self.enabled = enabled and bool(url and key)
+        self.heartbeat = heartbeat
+        self.topic = topic
+        self.connected = False
+        self.stats: Dict[str, int] = {"events": 0, "refreshed": 0, "invalidated": 0, "reconnects": 0, "resynced": 0}
+        self._refs = itertools.count(1)
+        self._disconnected_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self.enabled:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.connected = False
+
+    async def _send(self, ws, topic: str, event: str, payload: dict) -> str:
+        ref = str(next(self._refs))
+        await ws.send(json.dumps({"topic": topic, "event": event, "payload": payload, "ref": ref, "join_ref": ref}))
+        return ref
+
+    async def _join(self, ws) -> None:
+        changes = [{"event": "*", "schema": "public", "table": t} for t in self.TABLES]
+        ref = await self._send(
+            ws,
+            self.topic,
+            "phx_join",
+            {
+                "config": {"broadcast": {"self": False}, "presence": {"key": ""}, "postgres_changes": changes},
+                "access_token": self.key,
+            },
+        )
+        while True:
+            msg = json.loads(await asyncio.wait_for(ws.recv(), 10))
+            if msg.get("event") == "phx_reply" and msg.get("ref") == ref:
+                if (msg.get("payload") or {}).get("status") != "ok":
+                    raise ConnectionError(f"realtime join rejected: {msg.get('payload')}")
+                return
+
+    async def _heartbeats(self, ws) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            await self._send(ws, "phoenix", "heartbeat", {})
+
+    async def _loop(self) -> None:
+        import websockets
+
+        backoff = 1.0
+        while True:
+            try:
+                async with websockets.connect(self.url, ping_interval=None, close_timeout=5) as ws:
+                    await self._join(ws)
+                    self.connected = True
+                    backoff = 1.0
+                    if self._disconnected_at is not None:
+                        await self.resync(self._disconnected_at)
+                        self._disconnected_at = None
+
+                    heartbeats = asyncio.create_task(self._heartbeats(ws))
+                    try:
+                        async for raw in ws:
+                            self.dispatch(json.loads(raw))
+                    finally:
+                        heartbeats.cancel()
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                log.warning("Realtime listener error: %r", ex)
+
+            if self.connected:
+                self.stats["reconnects"] += 1
+            if self._disconnected_at is None:
+                self._disconnected_at = time.time()
+            self.connected = False
+            await asyncio.sleep(backoff * random.uniform(0.5, 1.5))
+            backoff = min(backoff * 2, 60.0)
+
+    def dispatch(self, msg: dict) -> None:
+        event = msg.get("event")
+        payload = msg.get("payload") or {}
+        if event == "postgres_changes":
+            data = payload.get("data") or {}
+            self.apply_change(data.get("table"), data.get("type"), data.get("record") or {}, data.get("old_record") or {})
+        elif event in ("phx_error", "phx_close"):
+            raise ConnectionError(f"realtime channel {event}: {payload}")
+        elif event == "system" and payload.get("status") == "error":
+            log.warning("Realtime system error: %s", payload.get("message"))
+
+    def apply_change(self, table: str, kind: str, record: dict, old: dict) -> None:
+        self.stats["events"] += 1
+        REALTIME_EVENTS.inc(table=table, type=kind)
+
+        if table == "user_subscriptions":
+            user_id = record.get("user_id") or old.get("user_id")
+            if user_id is None:
+                return
+            user_id = int(user_id)
+            if kind == "DELETE":
+                SUB_CACHE.invalidate(user_id)
+                EXPIRY_INDEX.untrack(user_id)
+                self.stats["invalidated"] += 1
+                return
+            state = SubState.from_row(record)
+            EXPIRY_INDEX.track(state)
+            if user_id in SUB_CACHE:
+                SUB_CACHE.put(user_id, state)
+                self.stats["refreshed"] += 1
+
+        elif table == "user_payment_links" and (record.get("status") or "").lower() == "paid":
+            if record.get("paymentlink_id"):
+                remember_paid(record["paymentlink_id"])
+            if record.get("user_id") is not None:
+                SUB_CACHE.invalidate(int(record["user_id"]))
+                self.stats["invalidated"] += 1
+
+    async def resync(self, since: float) -> None:
+        # events missed while disconnected: re-read rows updated since, refresh the cached ones
+        updated_since = datetime.fromtimestamp(since - SNAPSHOT_SKEW, timezone.utc).isoformat()
+        after = 0
+        try:
+            while True:
+                rows = await sp_list_subscriptions(after, WARMUP_PAGE_SIZE, updated_since=updated_since)
+                for row in rows:
+                    state = SubState.from_row(row)
+                    EXPIRY_INDEX.track(state)
+                    if state.user_id in SUB_CACHE:
+                        SUB_CACHE.put(state.user_id, state)
+                        self.stats["resynced"] += 1
+                if len(rows) < WARMUP_PAGE_SIZE:
+                    break
+                after = int(rows[-1]["user_id"])
+        except Exception as ex:
+            log.warning("Realtime resync error: %s", ex)
@@ -0,0 +1,145 @@
+"""
+Renewal reminders: DMs sent ahead of each plan's expiry, driven by EXPIRY_INDEX.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Dict, List
+
+from config import RENEWAL_BATCH_SIZE, RENEWAL_DM_RATE, WARMUP_PAGE_SIZE
+from persistence import sp_fetch_subscriptions_bulk, sp_list_subscriptions
+from subscriptions import EXPIRY_INDEX, SUB_CACHE, SubState
+from outbound import OutboundScheduler
+
+log = logging.getLogger(__name__)
+
+
+def renewal_text(state: SubState, now: float) -> str:
+    label = state.plan_label or "Plan"
+    days = round((state.expires_ts - now) / 86400)
+    when = f"{days} din me" if days >= 1 else "aaj"
+    return (
+        f"⏰ **Aapka {label} plan {when} expire ho raha hai.**\n"
+        f"📅 **Expires at:** `{state.expires_str}`\n\n"
+        "👉 Auto-approve chalu rakhne ke liye `/upgrade` karke renew karein."
+    )
+
+
+class RenewalScheduler:
+    """
+    Drives EXPIRY_INDEX: loads every active plan on start, then sleeps until
+    the next event. Plans are evicted from SUB_CACHE the moment they lapse.
+    Due reminders are collected into batches, re-checked against storage in
+    one bulk read (a renewal made in another process moves expires_at) and
+    handed to the outbound DM lane at `dm_rate` per second, pausing while the
+    lane is half full so join-request DMs keep their room.
+    """
+
+    def __init__(
+        self,
+        outbound: OutboundScheduler,
+        dm_rate: float = RENEWAL_DM_RATE,
+        batch_size: int = RENEWAL_BATCH_SIZE,
+        page_size: int = WARMUP_PAGE_SIZE,
+    ):
+        self.outbound = outbound
+        self.dm_rate = dm_rate
+        self.batch_size = max(1, batch_size)
+        self.page_size = max(1, page_size)
+        self.loaded = False
+        self._due: deque = deque()
+        self._has_due = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self.stats: Dict[str, int] = {"loaded": 0, "expired": 0, "reminded": 0, "renewed": 0, "suppressed": 0}
+
+    def start(self) -> None:
+        self._tasks.append(asyncio.create_task(self._timer()))
+        if self.dm_rate > 0 and EXPIRY_INDEX.offsets:
+            self._tasks.append(asyncio.create_task(self._sender()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def _load(self) -> None:
+        while True:
+            try:
+                after = 0
+                active_at = datetime.now(timezone.utc).isoformat()
+                while True:
+                    rows = await sp_list_subscriptions(after, self.page_size, active_at=active_at)
+                    for row in rows:
+                        EXPIRY_INDEX.track(SubState.from_row(row))
+                    self.stats["loaded"] += len(rows)
+                    if len(rows) < self.page_size:
+                        break
+                    after = int(rows[-1]["user_id"])
+                self.loaded = True
+                log.info("Expiry index loaded: %d active plans", len(EXPIRY_INDEX))
+                return
+            except Exception as ex:
+                log.warning("Expiry index load error: %s", ex)
+                await asyncio.sleep(30)
+
+    async def _timer(self) -> None:
+        await self._load()
+        while True:
+            now = time.time()
+            expired, reminders = EXPIRY_INDEX.pop_due(now)
+            for state in expired:
+                SUB_CACHE.expire(state.user_id, state.expires_ts)
+            self.stats["expired"] += len(expired)
+            if reminders and self.dm_rate > 0:
+                self._due.extend(reminders)
+                self._has_due.set()
+
+            EXPIRY_INDEX.changed.clear()
+            next_due = EXPIRY_INDEX.next_due()
+            try:
+                await asyncio.wait_for(
+                    EXPIRY_INDEX.changed.wait(), None if next_due is None else max(0.0, next_due - time.time())
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    async def _sender(self) -> None:
+        dm_lane_limit = self.outbound.max_sizes["dm"] // 2
+        while True:
+            await self._has_due.wait()
+            batch = [self._due.popleft() for _ in range(min(self.batch_size, len(self._due)))]
+            if not self._due:
+                self._has_due.clear()
+
+            try:
+                rows = await sp_fetch_subscriptions_bulk([state.user_id for state, _ in batch])
+            except Exception as ex:
+                log.warning("Renewal re-check error: %s", ex)
+                rows = None
+
+            for state, stage in batch:
+                row = rows.get(state.user_id) if rows is not None else None
+                if row is not None:
+                    current = SubState.from_row(row)
+                    if current.expires_ts != state.expires_ts:
+                        EXPIRY_INDEX.track(current)
+                        self.stats["renewed"] += 1
+                        continue
+                elif rows is not None:
+                    EXPIRY_INDEX.untrack(state.user_id)
+                    continue
+
+                while dm_lane_limit and self.outbound.queue_depths()["dm"] >= dm_lane_limit:
+                    await asyncio.sleep(1)
+                sent = self.outbound.send_dm(
+                    state.user_id,
+                    renewal_text(state, time.time()),
+                    dedup_key=f"renew:{state.user_id}:{int(state.expires_ts)}:{stage}",
+                    parse_mode="Markdown",
+                )
+                self.stats["reminded" if sent else "suppressed"] += 1
+                await asyncio.sleep(1.0 / self.dm_rate)
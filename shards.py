@@ -0,0 +1,417 @@
+"""
+Sharded workers: the intake process routes each update to one of N worker
+processes over a unix socket, and hands them leases on the global Bot API
+rate so all of them together stay under Telegram's limit.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+
+from config import SHARD_LEASE_SECONDS, SHARD_RESPAWN_MAX, SHARD_SOCKET, SHARD_WORKERS, TG_GLOBAL_RATE
+from metrics import SHARD_LIVE_WORKERS, SHARD_ROUTED
+from outbound import OutboundScheduler
+
+log = logging.getLogger(__name__)
+
+
+SHARD_LINE_LIMIT = 1 << 22  # max bytes per frame on the intake ↔ worker socket
+SHARD_WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "login.py")  # `login.py worker`
+
+
+def _shard_frame(msg: dict) -> bytes:
+    # one JSON object per line
+    return json.dumps(msg, separators=(",", ":"), ensure_ascii=False).encode() + b"\n"
+
+
+def _relay_outbound(outbound: OutboundScheduler, send) -> None:
+    # the outbound state every process must agree on goes out over the intake socket
+    outbound.on_retry_after = lambda seconds: send({"op": "pause", "seconds": seconds})
+    outbound.on_reachable = lambda user_id: send({"op": "reachable", "user_id": user_id})
+    outbound.on_unreachable = lambda user_id: send({"op": "unreachable", "user_id": user_id})
+    outbound.on_dedup = lambda key: send({"op": "dedup", "key": key})
+
+
+def _apply_outbound(outbound: OutboundScheduler, msg: dict) -> bool:
+    # a relayed change from another process; applied without relaying it again
+    op = msg.get("op")
+    if op == "pause":
+        outbound.pause(float(msg["seconds"]))
+    elif op == "reachable":
+        outbound.mark_reachable(int(msg["user_id"]), notify=False)
+    elif op == "unreachable":
+        outbound.mark_unreachable(int(msg["user_id"]), notify=False)
+    elif op == "dedup":
+        outbound.claim_dedup(str(msg["key"]), notify=False)
+    else:
+        return False
+    return True
+
+
+class LeasedBucket:
+    """
+    Global Bot API budget of a shard worker, borrowed from the intake in
+    leases of `batch` tokens. Same delay()/take() interface as TokenBucket.
+
+    A lease request that could not be written (socket not open yet, or
+    closed) or that went unanswered for `RESEND_AFTER` seconds is sent
+    again on the next delay() call.
+    """
+
+    __slots__ = ("link", "batch", "tokens", "wait", "requested")
+
+    RESEND_AFTER = 1.0
+
+    def __init__(self, link: "ShardLink", batch: int):
+        self.link = link
+        self.batch = max(1, batch)
+        self.tokens = 0
+        self.wait = 0.01  # re-check interval while a lease request is outstanding
+        self.requested: Optional[float] = None  # loop time of the outstanding lease request
+
+    def delay(self, now: float) -> float:
+        if self.tokens >= 1:
+            return 0.0
+        if self.requested is None or now - self.requested >= self.RESEND_AFTER:
+            self.requested = now if self.link.send({"op": "lease", "n": self.batch}) else None
+        return self.wait
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def grant(self, n: int, wait: float) -> None:
+        self.tokens += n
+        self.requested = None
+        self.wait = max(0.01, wait)
+
+
+class ShardLink:
+    """
+    Worker end of the intake socket: feeds forwarded updates into this
+    process's Dispatcher and acks each one once handled, and relays the shared
+    outbound state (global-rate leases, RetryAfter pauses, (un)reachable
+    users, claimed DM dedup keys).
+    """
+
+    def __init__(self, shard: int, socket_path: str = SHARD_SOCKET, lease_seconds: float = SHARD_LEASE_SECONDS):
+        self.shard = shard
+        self.socket_path = socket_path
+        self.bucket = LeasedBucket(self, math.ceil(TG_GLOBAL_RATE * lease_seconds))
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._tasks: set = set()
+
+    def send(self, msg: dict) -> bool:
+        # False when the socket isn't open, so callers can retry instead of waiting on a lost frame
+        if self._writer is None or self._writer.is_closing():
+            return False
+        self._writer.write(_shard_frame(msg))
+        return True
+
+    async def relay_join_events(self, rows: List[dict]) -> None:
+        # JoinEventLog sink: the intake writes the rows and keeps the counters /stats reads
+        if not self.send({"op": "join_events", "rows": rows}):
+            raise ConnectionError("intake socket closed")
+
+    async def connect(self, dp: Dispatcher) -> None:
+        """Open the intake socket; done before the services start, so their first lease request goes out."""
+        _relay_outbound(dp["outbound"], self.send)
+
+        self._reader, self._writer = await asyncio.open_unix_connection(self.socket_path, limit=SHARD_LINE_LIMIT)
+        self.send({"op": "hello", "shard": self.shard, "pid": os.getpid()})
+
+    async def run(self, dp: Dispatcher, bot: Bot) -> None:
+        """Serve until the intake closes the socket."""
+        if self._reader is None:
+            await self.connect(dp)
+        outbound: OutboundScheduler = dp["outbound"]
+        reader = self._reader
+        try:
+            async for line in reader:
+                msg = json.loads(line)
+                op = msg.get("op")
+                if op == "update":
+                    task = asyncio.create_task(self._handle(dp, bot, msg["update"]))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+                elif op == "grant":
+                    self.bucket.grant(int(msg["n"]), float(msg["wait"]))
+                else:
+                    _apply_outbound(outbound, msg)
+        finally:
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+            self._writer.close()
+
+    async def _handle(self, dp: Dispatcher, bot: Bot, update: dict) -> None:
+        try:
+            await dp.feed_raw_update(bot, update)
+        except Exception as ex:
+            log.error("Shard update error: %r", ex)
+        finally:
+            # acked even when a handler failed – redelivering it would only fail again
+            self.send({"op": "ack", "id": update["update_id"]})
+
+
+class ShardWorker:
+    __slots__ = ("shard", "process", "writer", "inflight")
+
+    def __init__(self, shard: int):
+        self.shard = shard
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.inflight: Dict[int, Tuple[int, bytes]] = {}  # update_id → (routing key, frame), until acked
+
+
+class ShardSupervisor:
+    """
+    Intake side of sharded mode: spawns `workers` worker processes and routes
+    each update to one of them by chat.
+
+    Routing is rendezvous hashing over the connected workers, so a chat always
+    lands on the same process (its requests stay in order) and losing a worker
+    only moves that worker's chats. Forwarded updates are kept until the
+    worker acks them; when its socket closes they are re-routed oldest first,
+    ahead of anything newer. Dead workers are respawned with capped
+    exponential backoff, and while no worker is connected the intake handles
+    updates itself.
+
+    The socket doubles as the coordinator for state the workers must share:
+    they borrow global-rate tokens from this process's OutboundScheduler;
+    RetryAfter pauses, users marked (un)reachable and claimed DM dedup keys
+    are fanned out to every process; and join events are relayed here, so
+    /stats is always answered locally. Each process still keeps its own copy
+    of the DM suppression state, so two processes claiming the same key
+    within one socket round trip can both send.
+    """
+
+    def __init__(
+        self,
+        dp: Dispatcher,
+        bot: Bot,
+        workers: int = SHARD_WORKERS,
+        socket_path: str = SHARD_SOCKET,
+        respawn_max: float = SHARD_RESPAWN_MAX,
+    ):
+        self.dp = dp
+        self.bot = bot
+        self.outbound: OutboundScheduler = dp["outbound"]
+        self.workers = {i: ShardWorker(i) for i in range(workers)}
+        self.socket_path = os.path.abspath(socket_path)
+        self.respawn_max = respawn_max
+        self.live: List[int] = []
+        self.stats: Dict[str, int] = {"forwarded": 0, "local": 0, "redelivered": 0, "restarts": 0, "leased": 0}
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._tasks: List[asyncio.Task] = []
+        self._local: set = set()
+
+    # ---- routing ----
+
+    def owner(self, key: int) -> Optional[ShardWorker]:
+        best, best_score = None, -1
+        for shard in self.live:
+            digest = hashlib.blake2b(b"%d:%d" % (shard, key), digest_size=8).digest()
+            score = int.from_bytes(digest, "little")
+            if score > best_score:
+                best, best_score = shard, score
+        return None if best is None else self.workers[best]
+
+    async def forward(self, key: int, update) -> bool:
+        """Send `update` to the worker owning `key`; False when no worker is connected."""
+        worker = self.owner(key)
+        if worker is None:
+            return False
+        frame = _shard_frame({"op": "update", "update": update.model_dump(mode="json", exclude_none=True, by_alias=True)})
+        writer = worker.writer
+        self._send_update(worker, key, update.update_id, frame)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass  # still in `inflight`; re-routed when the worker is detached
+        return True
+
+    def _send_update(self, worker: ShardWorker, key: int, update_id: int, frame: bytes) -> None:
+        worker.inflight[update_id] = (key, frame)
+        worker.writer.write(frame)
+        self.stats["forwarded"] += 1
+
+    def _feed_local(self, frame: bytes) -> None:
+        self.stats["local"] += 1
+        update = json.loads(frame)["update"]
+        task = asyncio.create_task(self.dp.feed_raw_update(self.bot, update, shard_local=True))
+        self._local.add(task)
+        task.add_done_callback(self._local.discard)
+
+    def _broadcast(self, msg: dict, skip: Optional[ShardWorker] = None) -> None:
+        frame = _shard_frame(msg)
+        for worker in self.workers.values():
+            if worker is not skip and worker.writer is not None:
+                worker.writer.write(frame)
+
+    # ---- worker connections ----
+
+    def _attach(self, worker: ShardWorker, writer: asyncio.StreamWriter) -> None:
+        self._detach(worker)  # a previous incarnation's socket may not have closed yet
+        worker.writer = writer
+        self.live.append(worker.shard)
+
+    def _detach(self, worker: ShardWorker) -> None:
+        if worker.writer is None:
+            return
+        worker.writer.close()
+        worker.writer = None
+        self.live.remove(worker.shard)
+
+        pending, worker.inflight = worker.inflight, {}
+        for update_id in sorted(pending):
+            key, frame = pending[update_id]
+            self.stats["redelivered"] += 1
+            target = self.owner(key)
+            if target is None:
+                self._feed_local(frame)
+            else:
+                self._send_update(target, key, update_id, frame)
+        if pending:
+            log.warning("Shard %s detached, re-routed %d unacked updates", worker.shard, len(pending))
+
+    def _on_message(self, worker: ShardWorker, msg: dict) -> None:
+        op = msg.get("op")
+        if op == "ack":
+            worker.inflight.pop(msg["id"], None)
+        elif op == "lease":
+            granted, wait = self.outbound.borrow(int(msg["n"]))
+            self.stats["leased"] += granted
+            worker.writer.write(_shard_frame({"op": "grant", "n": granted, "wait": wait}))
+        elif op == "join_events":
+            self.dp["join_events"].ingest(msg["rows"])
+        elif _apply_outbound(self.outbound, msg):
+            self._broadcast(msg, skip=worker)
+
+    async def _on_connect(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        worker: Optional[ShardWorker] = None
+        try:
+            hello = json.loads(await reader.readline() or b"{}")
+            worker = self.workers.get(hello.get("shard")) if hello.get("op") == "hello" else None
+            if worker is None:
+                return
+            self._attach(worker, writer)
+            log.info("Shard %s connected (pid %s)", worker.shard, hello.get("pid"))
+            async for line in reader:
+                if worker.writer is not writer:
+                    break
+                self._on_message(worker, json.loads(line))
+        except (ConnectionError, ValueError) as ex:
+            log.error("Shard connection error: %r", ex)
+        finally:
+            if worker is not None and worker.writer is writer:
+                self._detach(worker)
+            writer.close()
+
+    # ---- process supervision ----
+
+    async def _supervise(self, worker: ShardWorker) -> None:
+        backoff = 0.5
+        while True:
+            started = time.monotonic()
+            worker.process = await asyncio.create_subprocess_exec(
+                sys.executable, SHARD_WORKER_SCRIPT, "worker",
+                "--shard", str(worker.shard), "--socket", self.socket_path,
+            )
+            try:
+                code = await worker.process.wait()
+            except asyncio.CancelledError:
+                await self._terminate(worker.process)
+                raise
+            self._detach(worker)
+            backoff = 1.0 if time.monotonic() - started > 60 else min(self.respawn_max, backoff * 2)
+            self.stats["restarts"] += 1
+            log.error("Shard %s exited with code %s, restarting in %.0fs", worker.shard, code, backoff)
+            await asyncio.sleep(backoff)
+
+    @staticmethod
+    async def _terminate(process: asyncio.subprocess.Process) -> None:
+        if process.returncode is not None:
+            return
+        process.terminate()
+        try:
+            await asyncio.wait_for(process.wait(), 10)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+
+    async def _serve(self) -> None:
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._server = await asyncio.start_unix_server(self._on_connect, self.socket_path, limit=SHARD_LINE_LIMIT)
+        for worker in self.workers.values():
+            self._tasks.append(asyncio.create_task(self._supervise(worker)))
+
+    def start(self) -> None:
+        _relay_outbound(self.outbound, self._broadcast)
+        SHARD_ROUTED.set_function(
+            lambda: {(k,): self.stats[k] for k in ("forwarded", "local", "redelivered")}
+        )
+        SHARD_LIVE_WORKERS.set_function(lambda: len(self.live))
+        self._tasks.append(asyncio.create_task(self._serve()))
+
+    async def stop(self) -> None:
+        # workers get SIGTERM and finish what they were handed before exiting
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        # what the workers didn't ack by now is lost with them, as with an in-process restart
+        self.live.clear()
+        for worker in self.workers.values():
+            if worker.writer is not None:
+                worker.writer.close()
+                worker.writer = None
+            worker.inflight.clear()
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._local:
+            await asyncio.gather(*self._local, return_exceptions=True)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "workers": len(self.workers),
+            "live": sorted(self.live),
+            "inflight": {w.shard: len(w.inflight) for w in self.workers.values()},
+            **self.stats,
+        }
+
+
+class ShardRouterMiddleware(BaseMiddleware):
+    # outer update middleware on the intake: hands the update to its chat's worker instead of handling it here
+    def __init__(self, supervisor: ShardSupervisor):
+        self.supervisor = supervisor
+
+    async def __call__(self, handler, event, data):
+        if data.get("shard_local"):
+            return await handler(event, data)
+        if event.message and (event.message.text or "").startswith("/stats"):
+            # the per-chat counters live in this process
+            self.supervisor.stats["local"] += 1
+            return await handler(event, data)
+        chat, user = data.get("event_chat"), data.get("event_from_user")
+        # button taps go by user so Buy/Verify single-flight stays in one process
+        if event.callback_query and user:
+            key = user.id
+        else:
+            key = chat.id if chat else (user.id if user else None)
+        if key is not None and await self.supervisor.forward(key, event):
+            return None
+        self.supervisor.stats["local"] += 1
+        return await handler(event, data)
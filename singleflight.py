@@ -0,0 +1,52 @@
+"""
+Per-key request coalescing for the bot's slow, idempotent calls.
+"""
+
+import asyncio
+import functools
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key onto one in-flight task.
+    Successful results can be memoized for `memo_ttl` seconds; errors never are.
+    """
+
+    def __init__(self, memo_ttl: float = 0.0, maxsize: int = 10000):
+        self.memo_ttl = memo_ttl
+        self.maxsize = maxsize
+        self._inflight: Dict[Any, asyncio.Future] = {}
+        self._memo: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self.stats: Dict[str, int] = {"calls": 0, "coalesced": 0, "memo_hits": 0}
+
+    async def do(self, key, fn):
+        entry = self._memo.get(key)
+        if entry is not None:
+            if time.monotonic() < entry[0]:
+                self.stats["memo_hits"] += 1
+                return entry[1]
+            del self._memo[key]
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.stats["calls"] += 1
+            task = self._inflight[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(functools.partial(self._done, key))
+        else:
+            self.stats["coalesced"] += 1
+        # one impatient caller must not cancel the shared work
+        return await asyncio.shield(task)
+
+    def _done(self, key, task: asyncio.Future) -> None:
+        self._inflight.pop(key, None)
+        if task.cancelled() or task.exception() is not None or self.memo_ttl <= 0:
+            return
+        self._memo[key] = (time.monotonic() + self.memo_ttl, task.result())
+        while len(self._memo) > self.maxsize:
+            self._memo.popitem(last=False)
+
+    def forget(self, key) -> None:
+        self._memo.pop(key, None)
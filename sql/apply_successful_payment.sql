@@ -0,0 +1,67 @@
+-- Atomically apply a paid payment link (called via PostgREST RPC from login.py).
+--
+-- In one transaction:
+--   * locks the user_payment_links row and checks its status (idempotent: an
+--     already-paid link returns the current expiry and changes nothing)
+--   * takes a per-user advisory lock, so two different links of the same user
+--     are applied one after the other even before a subscription row exists
+--     (`for update` alone locks nothing then, and the second upsert would
+--     overwrite the first extension)
+--   * extends user_subscriptions.expires_at from greatest(now(), current expiry)
+--   * marks the link paid
+-- and returns {"applied": bool, "reason": text, "expires_at": timestamptz}.
+--
+-- storage.SQLiteStorage.apply_successful_payment implements the same semantics.
+
+create or replace function public.apply_successful_payment(
+    p_link_id bigint,
+    p_default_days integer default 30
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_link  public.user_payment_links%rowtype;
+    v_now   timestamptz := now();
+    v_cur   timestamptz;
+    v_exp   timestamptz;
+    v_plan  text;
+begin
+    select * into v_link
+    from public.user_payment_links
+    where id = p_link_id
+    for update;
+
+    if not found then
+        return jsonb_build_object('applied', false, 'reason', 'not_found', 'expires_at', null);
+    end if;
+
+    -- released at commit; the next statement's snapshot sees the other payment's write
+    perform pg_advisory_xact_lock(v_link.user_id);
+
+    select expires_at into v_cur
+    from public.user_subscriptions
+    where user_id = v_link.user_id
+    for update;
+
+    if lower(coalesce(v_link.status, '')) = 'paid' then
+        return jsonb_build_object('applied', false, 'reason', 'already_paid', 'expires_at', v_cur);
+    end if;
+
+    v_plan := coalesce(v_link.plan_id, 'unknown');
+    v_exp := greatest(coalesce(v_cur, v_now), v_now)
+             + make_interval(days => coalesce(v_link.duration_days, p_default_days));
+
+    insert into public.user_subscriptions (user_id, plan_id, plan_label, expires_at, updated_at)
+    values (v_link.user_id, v_plan, coalesce(v_link.plan_label, upper(v_plan)), v_exp, v_now)
+    on conflict (user_id) do update
+        set plan_id    = excluded.plan_id,
+            plan_label = excluded.plan_label,
+            expires_at = excluded.expires_at,
+            updated_at = excluded.updated_at;
+
+    update public.user_payment_links set status = 'paid' where id = p_link_id;
+
+    return jsonb_build_object('applied', true, 'reason', null, 'expires_at', v_exp);
+end;
+$$;
@@ -0,0 +1,17 @@
+-- chat_id → owner index used to gate join approvals (login.py, CHAT OWNER INDEX).
+--
+-- A row is written when a user with an active plan adds/promotes the bot to
+-- admin in a chat (my_chat_member update) and removed when the bot is demoted,
+-- leaves or is kicked. Join requests in that chat are approved while the
+-- owner's plan is active; otherwise each joiner is gated on their own plan.
+--
+-- storage.SQLiteStorage keeps the same table in its local schema.
+
+create table if not exists public.chat_owners (
+    chat_id     bigint primary key,
+    owner_id    bigint not null,
+    updated_at  timestamptz not null default now()
+);
+
+create index if not exists chat_owners_owner_id
+    on public.chat_owners (owner_id);
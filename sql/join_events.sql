@@ -0,0 +1,21 @@
+-- Join-request outcomes written behind by login.py (JOIN EVENT LOG).
+--
+-- The bot buffers one row per processed join request and inserts them in
+-- bulk every JOIN_EVENTS_FLUSH_SECONDS / JOIN_EVENTS_BATCH rows. outcome is
+-- one of approved, no_plan, unknown, failed; latency_ms runs
+-- from intake to the final decision.
+--
+-- storage.SQLiteStorage keeps the same table in its local schema.
+
+create table if not exists public.join_events (
+    id          bigint generated always as identity primary key,
+    chat_id     bigint not null,
+    chat_title  text,
+    user_id     bigint not null,
+    outcome     text not null,
+    latency_ms  real,
+    created_at  timestamptz not null default now()
+);
+
+create index if not exists join_events_chat_created
+    on public.join_events (chat_id, created_at);
@@ -0,0 +1,11 @@
+-- Publish the shared tables to Supabase Realtime (login.py, SUPABASE REALTIME).
+--
+-- Every bot writing user_subscriptions / user_payment_links then pushes its
+-- changes to the others, which refresh or drop their cached plans at once.
+-- Writers must keep user_subscriptions.updated_at current: a listener that
+-- reconnects re-reads the rows updated while it was away.
+
+alter publication supabase_realtime add table public.user_subscriptions, public.user_payment_links;
+
+-- DELETE events carry only the primary key unless the full old row is logged
+alter table public.user_subscriptions replica identity full;
@@ -0,0 +1,590 @@
+"""
+Storage backends for the bot's Supabase tables.
+
+Every persistence call in login.py goes through a `Storage` object, picked
+by STORAGE_BACKEND:
+
+* `supabase` – SupabaseStorage, PostgREST over one pooled async client
+* `sqlite`   – SQLiteStorage on a local file (STORAGE_SQLITE_PATH)
+* `memory`   – SQLiteStorage on `:memory:`
+
+The SQLite backend mirrors the table layout and the semantics of the
+Postgres `apply_successful_payment` RPC (sql/apply_successful_payment.sql)
+and the `chat_owners` / `join_events` tables (sql/chat_owners.sql,
+sql/join_events.sql), so the bot can run at full speed without a live Supabase project and the
+two backends can be benchmarked against each other.
+
+Nothing connects at construction: the PostgREST client (and the postgrest
+import) and the SQLite connection are created on first use, so importing
+login.py stays cheap for tooling and restarts.
+
+sqlite3 is blocking, so SQLiteStorage runs every statement on one dedicated
+thread; the event loop only awaits the result, as it does for PostgREST.
+"""
+
+import abc
+import asyncio
+import functools
+import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+SCHEMA = """
+create table if not exists user_subscriptions (
+    user_id     integer primary key,
+    plan_id     text,
+    plan_label  text,
+    expires_at  text,
+    updated_at  text
+);
+
+create table if not exists user_payment_links (
+    id              integer primary key autoincrement,
+    user_id         integer not null,
+    plan_id         text,
+    plan_label      text,
+    price_paise     integer,
+    duration_days   integer,
+    paymentlink_id  text,
+    paymentlink_url text,
+    status          text,
+    created_at      text,
+    raw             text
+);
+
+create index if not exists user_payment_links_user_plan
+    on user_payment_links (user_id, plan_id, created_at);
+create unique index if not exists user_payment_links_plink
+    on user_payment_links (paymentlink_id);
+create index if not exists user_payment_links_status
+    on user_payment_links (status, id);
+
+create table if not exists chat_owners (
+    chat_id     integer primary key,
+    owner_id    integer not null,
+    updated_at  text
+);
+
+create index if not exists chat_owners_owner_id
+    on chat_owners (owner_id);
+
+create table if not exists join_events (
+    id          integer primary key autoincrement,
+    chat_id     integer not null,
+    chat_title  text,
+    user_id     integer not null,
+    outcome     text not null,
+    latency_ms  real,
+    created_at  text not null
+);
+
+create index if not exists join_events_chat_created
+    on join_events (chat_id, created_at);
+"""
+
+JOIN_EVENT_COLUMNS = ("chat_id", "chat_title", "user_id", "outcome", "latency_ms", "created_at")
+
+
+def _parse_ts(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+def _utc_iso(value) -> Optional[str]:
+    # SQLite compares timestamps as text: store one fixed-width UTC form so that
+    # string order is time order whatever offset the caller wrote
+    if value is None or value == "":
+        return None
+    dt = value if isinstance(value, datetime) else _parse_ts(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+
+class Storage(abc.ABC):
+    """
+    Operations the bot needs from its database. All methods raise on backend
+    errors; callers decide what to cache, retry or swallow.
+    """
+
+    @abc.abstractmethod
+    async def get_subscription(self, user_id: int) -> Optional[dict]:
+        ...
+
+    @abc.abstractmethod
+    async def get_subscriptions(self, user_ids: List[int]) -> Dict[int, dict]:
+        ...
+
+    @abc.abstractmethod
+    async def upsert_subscription(self, row: dict) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def list_subscriptions(
+        self,
+        after_user_id: int,
+        limit: int,
+        active_at: Optional[str] = None,
+        updated_since: Optional[str] = None,
+    ) -> List[dict]:
+        # keyset page ordered by user_id; optionally only rows expiring after
+        # `active_at` and/or updated at or after `updated_since` (ISO timestamps)
+        ...
+
+    @abc.abstractmethod
+    async def get_latest_payment_link(self, user_id: int, plan_id: str) -> Optional[dict]:
+        ...
+
+    @abc.abstractmethod
+    async def get_payment_link_by_plink_id(self, plink_id: str) -> Optional[dict]:
+        ...
+
+    @abc.abstractmethod
+    async def insert_payment_link(self, row: dict) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def update_payment_link_status(self, row_id: int, status: str) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def list_pending_payment_links(self, after_id: int, limit: int) -> List[dict]:
+        ...
+
+    @abc.abstractmethod
+    async def apply_successful_payment(self, link_id: int, default_days: int) -> Dict[str, Any]:
+        # sql/apply_successful_payment.sql; `default_days` covers links stored without a duration
+        ...
+
+    @abc.abstractmethod
+    async def get_chat_owners(self, chat_ids: List[int]) -> Dict[int, int]:
+        ...
+
+    @abc.abstractmethod
+    async def set_chat_owner(self, chat_id: int, owner_id: int) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def delete_chat_owner(self, chat_id: int) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def get_owned_chats(self, owner_id: int) -> List[int]:
+        ...
+
+    @abc.abstractmethod
+    async def insert_join_events(self, rows: List[dict]) -> None:
+        # bulk append; rows carry JOIN_EVENT_COLUMNS
+        ...
+
+    async def close(self) -> None:
+        pass
+
+
+# ---------------- SUPABASE ----------------
+
+
+class SupabaseStorage(Storage):
+    def __init__(self, url: str, key: str, timeout: float = 5.0, in_chunk: int = 200, insert_chunk: int = 1000):
+        self.url = url
+        self.key = key
+        self.timeout = timeout
+        self.in_chunk = in_chunk
+        self.insert_chunk = insert_chunk
+        self._db = None
+
+    @property
+    def db(self):
+        # one shared httpx pool (keep-alive) for every query, built on first use
+        if self._db is None:
+            from postgrest import AsyncPostgrestClient
+            from postgrest.constants import DEFAULT_POSTGREST_CLIENT_HEADERS
+
+            self._db = AsyncPostgrestClient(
+                f"{self.url.rstrip('/')}/rest/v1",
+                headers={
+                    **DEFAULT_POSTGREST_CLIENT_HEADERS,
+                    "apikey": self.key,
+                    "Authorization": f"Bearer {self.key}",
+                },
+                timeout=self.timeout,
+            )
+        return self._db
+
+    async def _execute(self, query):
+        # hard cap per call – a hung PostgREST request must not hold a handler forever
+        return await asyncio.wait_for(query.execute(), self.timeout)
+
+    async def get_subscription(self, user_id: int) -> Optional[dict]:
+        res = await self._execute(
+            self.db.table("user_subscriptions")
+            .select("*")
+            .eq("user_id", user_id)
+            .limit(1)
+        )
+        return res.data[0] if res.data else None
+
+    async def get_subscriptions(self, user_ids: List[int]) -> Dict[int, dict]:
+        # one `user_id IN (...)` round trip per chunk (keeps the URL short)
+        rows: Dict[int, dict] = {}
+        for i in range(0, len(user_ids), self.in_chunk):
+            chunk = user_ids[i : i + self.in_chunk]
+            res = await self._execute(self.db.table("user_subscriptions").select("*").in_("user_id", chunk))
+            for row in res.data or []:
+                rows[int(row["user_id"])] = row
+        return rows
+
+    async def upsert_subscription(self, row: dict) -> None:
+        await self._execute(self.db.table("user_subscriptions").upsert(row, on_conflict="user_id"))
+
+    async def list_subscriptions(
+        self,
+        after_user_id: int,
+        limit: int,
+        active_at: Optional[str] = None,
+        updated_since: Optional[str] = None,
+    ) -> List[dict]:
+        query = self.db.table("user_subscriptions").select("*").gt("user_id", after_user_id)
+        if active_at:
+            query = query.gt("expires_at", active_at)
+        if updated_since:
+            query = query.gte("updated_at", updated_since)
+        res = await self._execute(query.order("user_id").limit(limit))
+        return res.data or []
+
+    async def get_latest_payment_link(self, user_id: int, plan_id: str) -> Optional[dict]:
+        res = await self._execute(
+            self.db.table("user_payment_links")
+            .select("*")
+            .eq("user_id", user_id)
+            .eq("plan_id", plan_id)
+            .order("created_at", desc=True)
+            .limit(1)
+        )
+        return res.data[0] if res.data else None
+
+    async def get_payment_link_by_plink_id(self, plink_id: str) -> Optional[dict]:
+        res = await self._execute(
+            self.db.table("user_payment_links")
+            .select("*")
+            .eq("paymentlink_id", plink_id)
+            .limit(1)
+        )
+        return res.data[0] if res.data else None
+
+    async def insert_payment_link(self, row: dict) -> None:
+        await self._execute(self.db.table("user_payment_links").insert(row))
+
+    async def update_payment_link_status(self, row_id: int, status: str) -> None:
+        await self._execute(self.db.table("user_payment_links").update({"status": status}).eq("id", row_id))
+
+    async def list_pending_payment_links(self, after_id: int, limit: int) -> List[dict]:
+        res = await self._execute(
+            self.db.table("user_payment_links")
+            .select("*")
+            .eq("status", "created")
+            .gt("id", after_id)
+            .order("id")
+            .limit(limit)
+        )
+        return res.data or []
+
+    async def apply_successful_payment(self, link_id: int, default_days: int) -> Dict[str, Any]:
+        res = await self._execute(
+            self.db.rpc("apply_successful_payment", {"p_link_id": link_id, "p_default_days": default_days})
+        )
+        result = res.data[0] if isinstance(res.data, list) else res.data
+        return result or {}
+
+    async def get_chat_owners(self, chat_ids: List[int]) -> Dict[int, int]:
+        owners: Dict[int, int] = {}
+        for i in range(0, len(chat_ids), self.in_chunk):
+            chunk = chat_ids[i : i + self.in_chunk]
+            res = await self._execute(self.db.table("chat_owners").select("chat_id,owner_id").in_("chat_id", chunk))
+            for row in res.data or []:
+                owners[int(row["chat_id"])] = int(row["owner_id"])
+        return owners
+
+    async def set_chat_owner(self, chat_id: int, owner_id: int) -> None:
+        row = {"chat_id": chat_id, "owner_id": owner_id, "updated_at": datetime.now(timezone.utc).isoformat()}
+        await self._execute(self.db.table("chat_owners").upsert(row, on_conflict="chat_id"))
+
+    async def delete_chat_owner(self, chat_id: int) -> None:
+        await self._execute(self.db.table("chat_owners").delete().eq("chat_id", chat_id))
+
+    async def get_owned_chats(self, owner_id: int) -> List[int]:
+        res = await self._execute(self.db.table("chat_owners").select("chat_id").eq("owner_id", owner_id))
+        return [int(row["chat_id"]) for row in res.data or []]
+
+    async def insert_join_events(self, rows: List[dict]) -> None:
+        from postgrest.types import ReturnMethod
+
+        # one POST per chunk; nothing is echoed back
+        for i in range(0, len(rows), self.insert_chunk):
+            chunk = [{c: row.get(c) for c in JOIN_EVENT_COLUMNS} for row in rows[i : i + self.insert_chunk]]
+            await self._execute(self.db.table("join_events").insert(chunk, returning=ReturnMethod.minimal))
+
+    async def close(self) -> None:
+        if self._db is not None:
+            await self._db.aclose()
+            self._db = None
+
+
+# ---------------- SQLITE / MEMORY ----------------
+
+
+class SQLiteStorage(Storage):
+    def __init__(self, path: str = ":memory:"):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def _run(self, fn, *args):
+        # one worker thread owns the connection, so statements (and the
+        # multi-statement transactions below) never interleave
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-storage")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(fn, *args))
+
+    def _connection(self) -> sqlite3.Connection:
+        # opened and migrated on first use, on the storage thread
+        if self._conn is None:
+            # autocommit mode; multi-statement operations open their own transaction
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _row(row: Optional[sqlite3.Row]) -> Optional[dict]:
+        if row is None:
+            return None
+        data = dict(row)
+        if data.get("raw"):
+            data["raw"] = json.loads(data["raw"])
+        return data
+
+    def _execute(self, sql: str, params=()) -> List[sqlite3.Row]:
+        return self._connection().execute(sql, params).fetchall()
+
+    async def _query(self, sql: str, params=()) -> List[sqlite3.Row]:
+        return await self._run(self._execute, sql, params)
+
+    async def get_subscription(self, user_id: int) -> Optional[dict]:
+        rows = await self._query("select * from user_subscriptions where user_id = ?", (user_id,))
+        return self._row(rows[0]) if rows else None
+
+    async def get_subscriptions(self, user_ids: List[int]) -> Dict[int, dict]:
+        rows: Dict[int, dict] = {}
+        ids = list(user_ids)
+        # stay below SQLite's host-parameter limit
+        for i in range(0, len(ids), 500):
+            chunk = ids[i : i + 500]
+            marks = ",".join("?" * len(chunk))
+            for row in await self._query(f"select * from user_subscriptions where user_id in ({marks})", chunk):
+                rows[int(row["user_id"])] = self._row(row)
+        return rows
+
+    async def upsert_subscription(self, row: dict) -> None:
+        await self._query(
+            """
+            insert into user_subscriptions (user_id, plan_id, plan_label, expires_at, updated_at)
+            values (:user_id, :plan_id, :plan_label, :expires_at, :updated_at)
+            on conflict (user_id) do update set
+                plan_id = excluded.plan_id,
+                plan_label = excluded.plan_label,
+                expires_at = excluded.expires_at,
+                updated_at = excluded.updated_at
+            """,
+            {
+                "user_id": row["user_id"],
+                "plan_id": row.get("plan_id"),
+                "plan_label": row.get("plan_label"),
+                "expires_at": _utc_iso(row.get("expires_at")),
+                "updated_at": _utc_iso(row.get("updated_at")),
+            },
+        )
+
+    async def list_subscriptions(
+        self,
+        after_user_id: int,
+        limit: int,
+        active_at: Optional[str] = None,
+        updated_since: Optional[str] = None,
+    ) -> List[dict]:
+        sql = "select * from user_subscriptions where user_id > ?"
+        params: List[Any] = [after_user_id]
+        if active_at:
+            sql += " and expires_at > ?"
+            params.append(_utc_iso(active_at))
+        if updated_since:
+            sql += " and updated_at >= ?"
+            params.append(_utc_iso(updated_since))
+        rows = await self._query(sql + " order by user_id limit ?", params + [limit])
+        return [self._row(r) for r in rows]
+
+    async def get_latest_payment_link(self, user_id: int, plan_id: str) -> Optional[dict]:
+        rows = await self._query(
+            "select * from user_payment_links where user_id = ? and plan_id = ? "
+            "order by created_at desc, id desc limit 1",
+            (user_id, plan_id),
+        )
+        return self._row(rows[0]) if rows else None
+
+    async def get_payment_link_by_plink_id(self, plink_id: str) -> Optional[dict]:
+        rows = await self._query("select * from user_payment_links where paymentlink_id = ? limit 1", (plink_id,))
+        return self._row(rows[0]) if rows else None
+
+    async def insert_payment_link(self, row: dict) -> None:
+        cols = (
+            "user_id",
+            "plan_id",
+            "plan_label",
+            "price_paise",
+            "duration_days",
+            "paymentlink_id",
+            "paymentlink_url",
+            "status",
+            "created_at",
+            "raw",
+        )
+        values = [row.get(c) for c in cols]
+        values[-2] = _utc_iso(values[-2])
+        values[-1] = json.dumps(values[-1]) if values[-1] is not None else None
+        await self._query(
+            f"insert into user_payment_links ({','.join(cols)}) values ({','.join('?' * len(cols))})",
+            values,
+        )
+
+    async def update_payment_link_status(self, row_id: int, status: str) -> None:
+        await self._query("update user_payment_links set status = ? where id = ?", (status, row_id))
+
+    async def list_pending_payment_links(self, after_id: int, limit: int) -> List[dict]:
+        rows = await self._query(
+            "select * from user_payment_links where status = 'created' and id > ? order by id limit ?",
+            (after_id, limit),
+        )
+        return [self._row(r) for r in rows]
+
+    async def apply_successful_payment(self, link_id: int, default_days: int) -> Dict[str, Any]:
+        return await self._run(self._apply_successful_payment, link_id, default_days)
+
+    def _apply_successful_payment(self, link_id: int, default_days: int) -> Dict[str, Any]:
+        conn = self._connection()
+        conn.execute("begin immediate")
+        try:
+            link = conn.execute("select * from user_payment_links where id = ?", (link_id,)).fetchone()
+            if link is None:
+                conn.execute("commit")
+                return {"applied": False, "reason": "not_found", "expires_at": None}
+
+            sub = conn.execute(
+                "select expires_at from user_subscriptions where user_id = ?", (link["user_id"],)
+            ).fetchone()
+            cur = _parse_ts(sub["expires_at"]) if sub else None
+
+            if (link["status"] or "").lower() == "paid":
+                conn.execute("commit")
+                return {"applied": False, "reason": "already_paid", "expires_at": _utc_iso(cur)}
+
+            now = datetime.now(timezone.utc)
+            plan_id = link["plan_id"] or "unknown"
+            new_exp = max(cur or now, now) + timedelta(days=link["duration_days"] or default_days)
+
+            conn.execute(
+                """
+                insert into user_subscriptions (user_id, plan_id, plan_label, expires_at, updated_at)
+                values (?, ?, ?, ?, ?)
+                on conflict (user_id) do update set
+                    plan_id = excluded.plan_id,
+                    plan_label = excluded.plan_label,
+                    expires_at = excluded.expires_at,
+                    updated_at = excluded.updated_at
+                """,
+                (link["user_id"], plan_id, link["plan_label"] or plan_id.upper(), _utc_iso(new_exp), _utc_iso(now)),
+            )
+            conn.execute("update user_payment_links set status = 'paid' where id = ?", (link_id,))
+            conn.execute("commit")
+            return {"applied": True, "reason": None, "expires_at": _utc_iso(new_exp)}
+        except BaseException:
+            conn.execute("rollback")
+            raise
+
+    async def get_chat_owners(self, chat_ids: List[int]) -> Dict[int, int]:
+        owners: Dict[int, int] = {}
+        ids = list(chat_ids)
+        for i in range(0, len(ids), 500):
+            chunk = ids[i : i + 500]
+            marks = ",".join("?" * len(chunk))
+            for row in await self._query(f"select chat_id, owner_id from chat_owners where chat_id in ({marks})", chunk):
+                owners[int(row["chat_id"])] = int(row["owner_id"])
+        return owners
+
+    async def set_chat_owner(self, chat_id: int, owner_id: int) -> None:
+        await self._query(
+            """
+            insert into chat_owners (chat_id, owner_id, updated_at) values (?, ?, ?)
+            on conflict (chat_id) do update set
+                owner_id = excluded.owner_id,
+                updated_at = excluded.updated_at
+            """,
+            (chat_id, owner_id, _utc_iso(datetime.now(timezone.utc))),
+        )
+
+    async def delete_chat_owner(self, chat_id: int) -> None:
+        await self._query("delete from chat_owners where chat_id = ?", (chat_id,))
+
+    async def get_owned_chats(self, owner_id: int) -> List[int]:
+        rows = await self._query("select chat_id from chat_owners where owner_id = ?", (owner_id,))
+        return [int(row["chat_id"]) for row in rows]
+
+    async def insert_join_events(self, rows: List[dict]) -> None:
+        values = [
+            tuple(_utc_iso(row.get(c)) if c == "created_at" else row.get(c) for c in JOIN_EVENT_COLUMNS) for row in rows
+        ]
+        await self._run(self._insert_join_events, values)
+
+    def _insert_join_events(self, values: List[tuple]) -> None:
+        conn = self._connection()
+        conn.execute("begin")
+        try:
+            conn.executemany(
+                f"insert into join_events ({','.join(JOIN_EVENT_COLUMNS)}) "
+                f"values ({','.join('?' * len(JOIN_EVENT_COLUMNS))})",
+                values,
+            )
+            conn.execute("commit")
+        except BaseException:
+            conn.execute("rollback")
+            raise
+
+    def _close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def close(self) -> None:
+        if self._executor is not None:
+            await self._run(self._close)
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+def make_storage(backend: str, **options) -> Storage:
+    if backend == "supabase":
+        return SupabaseStorage(
+            options["url"],
+            options["key"],
+            timeout=options.get("timeout", 5.0),
+            in_chunk=options.get("in_chunk", 200),
+        )
+    if backend == "sqlite":
+        return SQLiteStorage(options.get("sqlite_path") or "bot.sqlite3")
+    if backend == "memory":
+        return SQLiteStorage(":memory:")
+    raise ValueError(f"unknown STORAGE_BACKEND: {backend!r}")
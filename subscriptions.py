@@ -0,0 +1,331 @@
+"""
+Subscription state: the per-user plan cache in front of `user_subscriptions`,
+the plan-status lookups built on it, and the index of active plans by expiry.
+"""
+
+import asyncio
+import heapq
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import (
+    RENEWAL_REMINDER_HOURS,
+    SUB_CACHE_NEGATIVE_TTL,
+    SUB_CACHE_SIZE,
+    SUB_CACHE_TTL,
+    SUB_STALE_SECONDS,
+)
+from persistence import sp_fetch_subscription, sp_fetch_subscriptions_bulk
+
+log = logging.getLogger(__name__)
+
+
+async def sp_get_subscription(user_id: int) -> Optional[dict]:
+    try:
+        return await sp_fetch_subscription(user_id)
+    except Exception as ex:
+        log.warning("sp_get_subscription error: %s", ex)
+        return None
+
+
+def parse_iso_utc(exp) -> Optional[datetime]:
+    if not exp:
+        return None
+    try:
+        return datetime.fromisoformat(str(exp).replace("Z", "")).astimezone(timezone.utc)
+    except Exception:
+        return None
+
+
+def is_plan_active(sub: dict) -> bool:
+    exp_dt = parse_iso_utc(sub.get("expires_at"))
+    return bool(exp_dt and datetime.now(timezone.utc) < exp_dt)
+
+
+class SubState:
+    """Parsed `user_subscriptions` row; expiry kept as a UTC epoch."""
+
+    __slots__ = ("user_id", "plan_id", "plan_label", "expires_ts")
+
+    def __init__(self, user_id: int, plan_id: Optional[str], plan_label: Optional[str], expires_ts: float):
+        self.user_id = user_id
+        self.plan_id = plan_id
+        self.plan_label = plan_label
+        self.expires_ts = expires_ts
+
+    @classmethod
+    def from_row(cls, row: dict) -> "SubState":
+        exp_dt = parse_iso_utc(row.get("expires_at"))
+        return cls(
+            int(row["user_id"]),
+            row.get("plan_id"),
+            row.get("plan_label"),
+            exp_dt.timestamp() if exp_dt else 0.0,
+        )
+
+    def is_active(self, now: Optional[float] = None) -> bool:
+        return (now or time.time()) < self.expires_ts
+
+    @property
+    def expires_str(self) -> str:
+        return datetime.fromtimestamp(self.expires_ts, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+class SubscriptionCache:
+    """
+    Bounded LRU of SubState by user_id.
+
+    Positive entries live for `ttl` but never past the plan's own expiry, so a
+    lapsed plan is re-read exactly when it lapses. Users without a row (or with
+    an expired one) are cached as negative entries for `negative_ttl`.
+
+    Expired entries are kept for another `stale_ttl` so `get_stale()` can
+    answer from the last known state while storage is unreachable.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, negative_ttl: float, stale_ttl: float = SUB_STALE_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stale_ttl = stale_ttl
+        self._entries: "OrderedDict[int, Tuple[float, Optional[SubState]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+
+    def get(self, user_id: int) -> Tuple[bool, Optional[SubState]]:
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            valid_until, state = entry
+            now = time.time()
+            if now < valid_until:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return True, state
+            if now >= valid_until + self.stale_ttl:
+                del self._entries[user_id]
+        self.misses += 1
+        return False, None
+
+    def get_stale(self, user_id: int) -> Tuple[bool, Optional[SubState]]:
+        # last known state (the plan's own expiry still applies via is_active)
+        entry = self._entries.get(user_id)
+        if entry is not None and time.time() < entry[0] + self.stale_ttl:
+            self.stale_hits += 1
+            return True, entry[1]
+        return False, None
+
+    def put(self, user_id: int, state: Optional[SubState]) -> None:
+        now = time.time()
+        if state is not None and state.is_active(now):
+            valid_until = min(now + self.ttl, state.expires_ts)
+        else:
+            valid_until = now + self.negative_ttl
+        self._entries[user_id] = (valid_until, state)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.hits = self.misses = self.stale_hits = 0
+
+    def expire(self, user_id: int, expires_ts: float) -> None:
+        # the plan lapsed: turn its entry negative now, unless it was renewed since
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[1] is not None and entry[1].expires_ts <= expires_ts:
+            self._entries[user_id] = (time.time() + self.negative_ttl, entry[1])
+
+    def active_states(self, now: Optional[float] = None):
+        now = now or time.time()
+        for _, state in self._entries.values():
+            if state is not None and state.is_active(now):
+                yield state
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._entries
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale_hits": self.stale_hits,
+            "hit_ratio": (self.hits / total) if total else 0.0,
+        }
+
+
+SUB_CACHE = SubscriptionCache(SUB_CACHE_SIZE, SUB_CACHE_TTL, SUB_CACHE_NEGATIVE_TTL)
+
+
+async def get_subscription_state(user_id: int) -> Tuple[bool, Optional[SubState]]:
+    # (known, state): known is False while storage is down and nothing stale is cached
+    found, state = SUB_CACHE.get(user_id)
+    if found:
+        return True, state
+
+    try:
+        row = await sp_fetch_subscription(user_id)
+    except Exception as ex:
+        # don't negative-cache an outage; the last known state beats "no plan"
+        log.warning("sp_get_subscription error: %s", ex)
+        return SUB_CACHE.get_stale(user_id)
+
+    state = SubState.from_row(row) if row else None
+    SUB_CACHE.put(user_id, state)
+    if state:
+        EXPIRY_INDEX.track(state)
+    return True, state
+
+
+async def get_subscription_states(user_ids) -> Dict[int, Optional[SubState]]:
+    # ids whose state is unknown (storage down, nothing stale cached) are left out
+    states: Dict[int, Optional[SubState]] = {}
+    missing: List[int] = []
+    for uid in set(user_ids):
+        found, state = SUB_CACHE.get(uid)
+        if found:
+            states[uid] = state
+        else:
+            missing.append(uid)
+
+    if not missing:
+        return states
+
+    try:
+        rows = await sp_fetch_subscriptions_bulk(missing)
+    except Exception as ex:
+        log.warning("sp_fetch_subscriptions_bulk error: %s", ex)
+        for uid in missing:
+            found, state = SUB_CACHE.get_stale(uid)
+            if found:
+                states[uid] = state
+        return states
+
+    for uid in missing:
+        row = rows.get(uid)
+        state = SubState.from_row(row) if row else None
+        SUB_CACHE.put(uid, state)
+        if state:
+            EXPIRY_INDEX.track(state)
+        states[uid] = state
+    return states
+
+
+PLAN_STATUS_UNAVAILABLE_TEXT = (
+    "⚠️ **Plan status abhi check nahi ho paaya.**\n"
+    "Ye temporary issue hai – thodi der baad fir se try karein."
+)
+
+
+async def format_plan_status(user_id: int) -> str:
+    known, state = await get_subscription_state(user_id)
+    if not known:
+        return PLAN_STATUS_UNAVAILABLE_TEXT
+
+    if not state:
+        return "🔴 **No active plan found.**\nUse `/upgrade` to purchase any plan."
+
+    if not state.is_active():
+        return "🟠 **Your plan has expired.**\nUse `/upgrade` to renew."
+
+    label = state.plan_label or "Unknown Plan"
+
+    return (
+        f"🟢 **Active Plan: {label}**\n"
+        f"📅 **Expires at:** `{state.expires_str}`\n\n"
+        "Thank you for being a premium user! 🎉"
+    )
+
+
+async def has_active_plan(user_id: int) -> Optional[bool]:
+    # None = unknown (storage outage), so callers never tell a paying user they have no plan
+    known, state = await get_subscription_state(user_id)
+    if not known:
+        return None
+    return bool(state and state.is_active())
+
+
+class ExpiryIndex:
+    """
+    Every known active plan, ordered by expiry.
+
+    `_plans` maps user_id → SubState; `_heap` holds (fire_ts, user_id,
+    expires_ts, stage) events – one per reminder offset plus the expiry itself
+    (stage EXPIRED). A renewal just pushes new events: the old ones no longer
+    match the user's expires_ts and are skipped when popped. len() is the
+    number of plans that haven't expired yet.
+    """
+
+    EXPIRED = -1
+
+    def __init__(self, reminder_hours: List[float]):
+        self.offsets = tuple(sorted((h * 3600 for h in reminder_hours), reverse=True))  # seconds before expiry
+        self._plans: Dict[int, SubState] = {}
+        self._heap: List[Tuple[float, int, float, int]] = []
+        self.changed = asyncio.Event()  # set when the earliest event moved up
+
+    def track(self, state: SubState, now: Optional[float] = None) -> None:
+        now = now or time.time()
+        if not state.is_active(now):
+            self._plans.pop(state.user_id, None)
+            return
+        current = self._plans.get(state.user_id)
+        self._plans[state.user_id] = state
+        if current is not None and current.expires_ts == state.expires_ts:
+            return
+
+        head = self._heap[0][0] if self._heap else None
+        # reminders already overdue are skipped, so a restart never repeats one
+        for stage, offset in enumerate(self.offsets):
+            if state.expires_ts - offset > now:
+                heapq.heappush(self._heap, (state.expires_ts - offset, state.user_id, state.expires_ts, stage))
+        heapq.heappush(self._heap, (state.expires_ts, state.user_id, state.expires_ts, self.EXPIRED))
+        if head is None or self._heap[0][0] < head:
+            self.changed.set()
+        if len(self._heap) > 2 * (len(self.offsets) + 1) * len(self._plans) + 1024:
+            self._compact()
+
+    def untrack(self, user_id: int) -> None:
+        self._plans.pop(user_id, None)
+
+    def pop_due(self, now: float) -> Tuple[List[SubState], List[Tuple[SubState, int]]]:
+        """Plans expired by `now`, and (plan, stage) reminders due by `now`."""
+        expired: List[SubState] = []
+        reminders: List[Tuple[SubState, int]] = []
+        while self._heap and self._heap[0][0] <= now:
+            _, user_id, expires_ts, stage = heapq.heappop(self._heap)
+            state = self._plans.get(user_id)
+            if state is None or state.expires_ts != expires_ts:
+                continue
+            if stage == self.EXPIRED:
+                del self._plans[user_id]
+                expired.append(state)
+            else:
+                reminders.append((state, stage))
+        return expired, reminders
+
+    def next_due(self) -> Optional[float]:
+        return self._heap[0][0] if self._heap else None
+
+    def _compact(self) -> None:
+        # drop events left behind by renewals
+        plans = self._plans
+        self._heap = [e for e in self._heap if e[1] in plans and plans[e[1]].expires_ts == e[2]]
+        heapq.heapify(self._heap)
+
+    def __len__(self) -> int:
+        return len(self._plans)
+
+
+EXPIRY_INDEX = ExpiryIndex(RENEWAL_REMINDER_HOURS)
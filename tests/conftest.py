@@ -0,0 +1,78 @@
+import asyncio
+import inspect
+import itertools
+import os
+import sys
+import time
+
+import pytest
+
+# config.py reads the environment at import time: give it a local backend and no live services
+os.environ.setdefault("BOT_TOKEN", "123456:TEST-TOKEN")
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("REALTIME_ENABLED", "0")
+os.environ.setdefault("WARMUP_ENABLED", "0")
+os.environ.setdefault("SWEEP_INTERVAL", "0")
+os.environ.setdefault("WEBHOOK_SECRET", "test-secret")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem):
+    # `async def` tests each run on a fresh event loop
+    if not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+    args = {name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames}
+    asyncio.run(pyfuncitem.obj(**args))
+    return True
+
+
+# the storage backend and plan caches are process-wide, so every test draws its ids from one counter
+_IDS = itertools.count(1_000_000)
+
+
+@pytest.fixture
+def ids():
+    return _IDS
+
+
+@pytest.fixture
+def eventually():
+    async def wait(check, timeout: float = 5.0) -> None:
+        # polls check() (plain or async) until it is true
+        deadline = time.monotonic() + timeout
+        while True:
+            result = check()
+            if inspect.isawaitable(result):
+                result = await result
+            if result:
+                return
+            assert time.monotonic() < deadline, "condition not reached"
+            await asyncio.sleep(0.01)
+
+    return wait
+
+
+class FakeOutbound:
+    """Records what the join/payment code hands to OutboundScheduler instead of calling Telegram."""
+
+    def __init__(self):
+        self.approved: list = []
+        self.dms: list = []
+        self.max_sizes = {"approve": 0, "dm": 0}
+
+    async def approve_join(self, chat_id: int, user_id: int) -> None:
+        self.approved.append((chat_id, user_id))
+
+    def send_dm(self, user_id: int, text: str, dedup_key=None, **kwargs) -> bool:
+        self.dms.append((user_id, dedup_key))
+        return True
+
+    def queue_depths(self) -> dict:
+        return {"approve": 0, "dm": 0}
+
+
+@pytest.fixture
+def outbound():
+    return FakeOutbound()
@@ -0,0 +1,121 @@
+"""BacklogApprover against a fake Telethon client that keeps the pending join requests in memory."""
+
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import chat_owners
+import persistence
+from backlog import BacklogApprover
+
+pytest.importorskip("telethon")
+
+from telethon import types, utils  # noqa: E402
+from telethon.errors import FloodWaitError  # noqa: E402
+from telethon.tl.functions.messages import (  # noqa: E402
+    GetChatInviteImportersRequest,
+    HideAllChatJoinRequestsRequest,
+    HideChatJoinRequestRequest,
+)
+
+
+class FakeClient:
+    """Answers the three join-request calls BacklogApprover makes, in (date, user id) order."""
+
+    def __init__(self, channel_id: int, user_ids):
+        self.peer = types.InputPeerChannel(channel_id=channel_id, access_hash=0)
+        start = datetime(2030, 1, 1, tzinfo=timezone.utc)
+        self.pending = {uid: start + timedelta(seconds=i) for i, uid in enumerate(user_ids)}
+        self.approved: list = []
+        self.pages: list = []
+        self.flood_waits: list = []  # seconds to raise on the next HideChatJoinRequest calls
+
+    async def get_input_entity(self, chat):
+        return self.peer
+
+    async def __call__(self, request):
+        if isinstance(request, GetChatInviteImportersRequest):
+            return self._importers(request)
+        if isinstance(request, HideAllChatJoinRequestsRequest):
+            self.approved.extend(self.pending)
+            self.pending.clear()
+            return types.Updates(updates=[], users=[], chats=[], date=None, seq=0)
+        if isinstance(request, HideChatJoinRequestRequest):
+            if self.flood_waits:
+                raise FloodWaitError(request, capture=self.flood_waits.pop(0))
+            self.pending.pop(request.user_id.user_id)
+            self.approved.append(request.user_id.user_id)
+            return types.Updates(updates=[], users=[], chats=[], date=None, seq=0)
+        raise AssertionError(f"unexpected request {request!r}")
+
+    def _importers(self, request):
+        rows = sorted((date, uid) for uid, date in self.pending.items())
+        if not isinstance(request.offset_user, types.InputUserEmpty):
+            cursor = (request.offset_date, request.offset_user.user_id)
+            rows = [row for row in rows if row > cursor]
+        page = rows[: request.limit]
+        self.pages.append(len(page))
+        return types.messages.ChatInviteImporters(
+            count=len(self.pending),
+            importers=[types.ChatInviteImporter(user_id=uid, date=date, requested=True) for date, uid in page],
+            users=[types.User(id=uid, access_hash=uid) for _, uid in page],
+        )
+
+
+async def subscribe(user_id: int, days: float) -> None:
+    expires = datetime.now(timezone.utc) + timedelta(days=days)
+    await persistence.STORE.upsert_subscription({"user_id": user_id, "plan_id": "basic", "expires_at": expires.isoformat()})
+
+
+async def test_pages_through_importers_and_approves_only_subscribers(ids):
+    joiners = [next(ids) for _ in range(5)]
+    for uid in joiners[::2]:
+        await subscribe(uid, 10)
+    client = FakeClient(next(ids), joiners)
+
+    stats = await BacklogApprover(client, page_size=2).drain("chat")
+    assert sorted(client.approved) == joiners[::2]
+    assert sorted(client.pending) == joiners[1::2]
+    assert client.pages == [2, 2, 1]
+    assert stats == {"scanned": 5, "approved": 3, "skipped": 2, "failed": 0, "flood_waits": 0}
+
+
+async def test_active_owner_approves_the_whole_backlog_in_one_call(ids):
+    owner, joiners = next(ids), [next(ids) for _ in range(3)]
+    await subscribe(owner, 10)
+    client = FakeClient(next(ids), joiners)
+    await chat_owners.CHAT_OWNERS.set_owner(utils.get_peer_id(client.peer), owner)
+
+    stats = await BacklogApprover(client, page_size=2).drain("chat")
+    assert sorted(client.approved) == joiners
+    assert client.pages == [1]  # the count probe only
+    assert stats["approved"] == 3 and stats["skipped"] == 0
+
+
+async def test_lapsed_owner_falls_back_to_each_joiners_plan(ids):
+    owner, subscriber, free = next(ids), next(ids), next(ids)
+    await subscribe(owner, -1)
+    await subscribe(subscriber, 10)
+    client = FakeClient(next(ids), [subscriber, free])
+    await chat_owners.CHAT_OWNERS.set_owner(utils.get_peer_id(client.peer), owner)
+
+    stats = await BacklogApprover(client, page_size=10).drain("chat")
+    assert client.approved == [subscriber]
+    assert list(client.pending) == [free]
+    assert stats["approved"] == 1 and stats["skipped"] == 1
+
+
+async def test_flood_wait_pauses_and_retries(ids):
+    joiners = [next(ids) for _ in range(2)]
+    for uid in joiners:
+        await subscribe(uid, 10)
+    client = FakeClient(next(ids), joiners)
+    client.flood_waits = [0]
+
+    started = time.monotonic()
+    stats = await BacklogApprover(client, page_size=10, concurrency=1).drain("chat")
+    # FloodWait of 0s still sleeps the 1s safety margin before retrying
+    assert time.monotonic() - started >= 1.0
+    assert sorted(client.approved) == joiners
+    assert stats["flood_waits"] == 1 and stats["approved"] == 2 and stats["failed"] == 0
@@ -0,0 +1,116 @@
+"""CircuitBreaker state transitions, probing and the adaptive call timeout."""
+
+import asyncio
+import time
+
+import pytest
+
+from breakers import CircuitBreaker, CircuitOpenError
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    return now
+
+
+def make(**kwargs) -> CircuitBreaker:
+    kwargs.setdefault("failure_threshold", 3)
+    kwargs.setdefault("reset_timeout", 10.0)
+    return CircuitBreaker("test", max_timeout=5.0, min_timeout=0.2, **kwargs)
+
+
+def test_opens_after_consecutive_failures_and_fails_fast(clock):
+    breaker = make()
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success(0.1)  # a success resets the streak
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.retry_after() == 10.0
+    with pytest.raises(CircuitOpenError, match="test circuit open"):
+        breaker.allow()
+    clock[0] += 4
+    assert breaker.retry_after() == 6.0
+
+
+def test_half_open_lets_one_probe_through(clock):
+    breaker = make(failure_threshold=1)
+    breaker.record_failure()
+    clock[0] += 10
+
+    breaker.allow()  # the probe
+    assert breaker.state == CircuitBreaker.HALF_OPEN and breaker.retry_after() == 0.0
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    # a probe that never reported back is replaced
+    clock[0] += 2 * breaker.max_timeout + 1
+    breaker.allow()
+
+    breaker.record_success(0.1)
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.failures == 0
+    breaker.allow()
+    breaker.allow()
+
+
+def test_a_failed_probe_reopens_for_twice_as_long_up_to_eight_times(clock):
+    breaker = make(failure_threshold=1)
+    breaker.record_failure()
+    for open_for in (20.0, 40.0, 80.0, 80.0):
+        clock[0] += breaker.retry_after()
+        breaker.allow()
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+        assert breaker.retry_after() == open_for
+
+    # closing resets the back-off
+    clock[0] += breaker.retry_after()
+    breaker.allow()
+    breaker.record_success(0.1)
+    breaker.record_failure()
+    assert breaker.retry_after() == 10.0
+
+
+def test_timeout_follows_observed_latency():
+    breaker = make()
+    assert breaker.timeout == 5.0  # nothing observed yet
+    breaker.record_success(0.1)
+    # srtt 0.1, rttvar 0.05
+    assert breaker.timeout == pytest.approx(0.3)
+    for _ in range(50):
+        breaker.record_success(0.01)
+    assert breaker.timeout == 0.2  # clamped to min_timeout
+
+    breaker.record_failure(timed_out=True)
+    for _ in range(10):
+        breaker.record_failure(timed_out=True)
+    assert breaker.timeout == 5.0  # backed off, clamped to max_timeout
+    assert breaker.snapshot() == {"state": "open", "failures": 11, "timeout_s": 5.0}
+
+
+async def test_call_records_outcomes_and_times_out_slow_calls():
+    breaker = CircuitBreaker("test", max_timeout=0.05, min_timeout=0.01, failure_threshold=2, reset_timeout=60.0)
+
+    async def ok():
+        return "row"
+
+    async def boom():
+        raise ConnectionError("down")
+
+    async def hang():
+        await asyncio.sleep(1)
+
+    assert await breaker.call(ok) == "row"
+    with pytest.raises(ConnectionError):
+        await breaker.call(boom)
+    with pytest.raises(asyncio.TimeoutError):
+        await breaker.call(hang)
+    assert breaker.snapshot()["state"] == "open"
+    with pytest.raises(CircuitOpenError):
+        await breaker.call(ok)
@@ -0,0 +1,125 @@
+"""JoinEventLog write-behind buffering into the SQLite sink, and the /stats hourly ring."""
+
+import asyncio
+import time
+
+import pytest
+
+from join_events import JoinEventLog
+from storage import SQLiteStorage
+
+
+@pytest.fixture
+def sqlite(tmp_path):
+    store = SQLiteStorage(str(tmp_path / "bot.sqlite3"))
+    yield store
+    asyncio.run(store.close())
+
+
+async def stored(store: SQLiteStorage, chat_id: int) -> int:
+    rows = await store._query("select count(*) from join_events where chat_id = ?", (chat_id,))
+    return rows[0][0]
+
+
+async def written(store: SQLiteStorage, chat_id: int, n: int) -> bool:
+    return await stored(store, chat_id) == n
+
+
+def make_log(store: SQLiteStorage, **kwargs) -> JoinEventLog:
+    events = JoinEventLog(enabled=True, **kwargs)
+    events.sink = store.insert_join_events
+    return events
+
+
+def record(events: JoinEventLog, chat_id: int, user_ids, n: int, outcome: str = "approved") -> None:
+    for _ in range(n):
+        events.record(chat_id, "Test", next(user_ids), outcome, 12.5)
+
+
+async def test_full_batch_flushes_before_the_interval(sqlite, ids, eventually):
+    chat = next(ids)
+    events = make_log(sqlite, batch_size=3, flush_interval=60.0, capacity=100)
+    events.start()
+    try:
+        record(events, chat, ids, 3)
+        await eventually(lambda: written(sqlite, chat, 3))
+        assert events.stats["written"] == 3
+        # below batch_size: waits for the interval
+        record(events, chat, ids, 2)
+        await asyncio.sleep(0.1)
+        assert events.pending() == 2
+        assert await stored(sqlite, chat) == 3
+    finally:
+        await events.stop()
+
+
+async def test_partial_batch_flushes_on_the_interval(sqlite, ids, eventually):
+    chat = next(ids)
+    events = make_log(sqlite, batch_size=100, flush_interval=0.05, capacity=100)
+    events.start()
+    try:
+        record(events, chat, ids, 2)
+        await eventually(lambda: written(sqlite, chat, 2))
+        assert events.pending() == 0
+    finally:
+        await events.stop()
+
+
+async def test_overflow_is_dropped_and_counted(sqlite, ids):
+    chat = next(ids)
+    events = make_log(sqlite, batch_size=4, flush_interval=60.0, capacity=4)
+
+    async def down(rows):
+        raise ConnectionError("storage down")
+
+    events.sink = down
+    record(events, chat, ids, 6)
+    assert events.pending() == 4
+    assert events.stats["dropped"] == 2
+    # counters still see every event
+    assert events.stats["recorded"] == 6
+
+    # a failed insert keeps its rows for the next try
+    await events.flush()
+    assert events.stats["flush_errors"] == 1
+    assert events.pending() == 4
+
+    events.sink = sqlite.insert_join_events
+    await events.flush()
+    assert await stored(sqlite, chat) == 4
+    assert events.stats["dropped"] == 2
+
+
+async def test_stop_flushes_what_is_buffered(sqlite, ids):
+    chat = next(ids)
+    events = make_log(sqlite, batch_size=100, flush_interval=60.0, capacity=100)
+    events.start()
+    record(events, chat, ids, 5)
+    await events.stop()
+    assert events.pending() == 0
+    assert await stored(sqlite, chat) == 5
+
+
+def test_stats_render_the_hourly_ring(monkeypatch, ids):
+    now = 1_900_000_000.0
+    chat, quiet = next(ids), next(ids)
+    events = JoinEventLog(enabled=False)
+
+    def at(hours_ago: float, outcome: str, latency_ms: float) -> None:
+        monkeypatch.setattr(time, "time", lambda: now - hours_ago * 3600)
+        events.ingest([{"chat_id": chat, "chat_title": "Test", "user_id": next(ids), "outcome": outcome, "latency_ms": latency_ms}])
+
+    # same ring slot as 1h ago, but a day older: overwritten, never counted
+    at(25, "approved", 1000.0)
+    at(1, "approved", 40.0)
+    at(5, "no_plan", 60.0)
+    at(30, "approved", 1000.0)  # outside the 24h window
+    at(0, "approved", 10.0)
+    at(0, "failed", 30.0)
+
+    monkeypatch.setattr(time, "time", lambda: now)
+    text = events.render_stats([chat, quiet])
+    assert "📊 **Test**" in text
+    assert "`1h`: ✅ 1 approved · ⏸ 1 skipped · ⏱ 20 ms avg" in text
+    assert "`24h`: ✅ 2 approved · ⏸ 2 skipped · ⏱ 35 ms avg" in text
+    assert f"📊 **{quiet}**\nPichhle 24 ghante me koi join request nahi." in text
@@ -0,0 +1,111 @@
+"""Join gating on the chat owner's plan, against the in-memory storage backend."""
+
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+from aiogram.enums import ChatMemberStatus
+
+import chat_owners
+import login
+import persistence
+from join_pipeline import JoinRequestPipeline
+
+
+class FakeEvents:
+    def __init__(self):
+        self.outcomes: dict = {}
+
+    def record(self, chat_id, chat_title, user_id, outcome, latency_ms) -> None:
+        self.outcomes[user_id] = outcome
+
+
+def join_request(chat_id: int, user_id: int):
+    return SimpleNamespace(chat=SimpleNamespace(id=chat_id, title="Test"), from_user=SimpleNamespace(id=user_id))
+
+
+def member_update(chat_id: int, by: int, old: str, new: str):
+    return SimpleNamespace(
+        chat=SimpleNamespace(id=chat_id, title="Test"),
+        from_user=SimpleNamespace(id=by),
+        old_chat_member=SimpleNamespace(status=old),
+        new_chat_member=SimpleNamespace(status=new),
+    )
+
+
+async def subscribe(user_id: int, days: float) -> None:
+    expires = datetime.now(timezone.utc) + timedelta(days=days)
+    await persistence.STORE.upsert_subscription({"user_id": user_id, "plan_id": "basic", "expires_at": expires.isoformat()})
+
+
+@pytest.fixture
+def run_pipeline(outbound, eventually):
+    async def run(requests) -> FakeEvents:
+        events = FakeEvents()
+        pipeline = JoinRequestPipeline(outbound, events, flush_interval=0.001, workers=2)
+        pipeline.start()
+        try:
+            for request in requests:
+                await pipeline.submit(request)
+            await eventually(lambda: len(events.outcomes) == len(requests))
+        finally:
+            await pipeline.stop()
+        return events
+
+    return run
+
+
+async def test_promoter_without_plan_is_not_recorded_as_owner(ids, outbound, run_pipeline):
+    chat, promoter, subscriber, free = next(ids), next(ids), next(ids), next(ids)
+    await subscribe(subscriber, 10)
+    await login.handle_my_chat_member(
+        member_update(chat, promoter, ChatMemberStatus.MEMBER, ChatMemberStatus.ADMINISTRATOR), outbound
+    )
+    assert await persistence.STORE.get_chat_owners([chat]) == {}
+    assert outbound.dms == [(promoter, f"owner_no_plan:{promoter}")]
+
+    events = await run_pipeline([join_request(chat, subscriber), join_request(chat, free)])
+    assert events.outcomes == {subscriber: "approved", free: "no_plan"}
+
+
+async def test_lapsed_owner_falls_back_to_joiner_plans(ids, outbound, run_pipeline):
+    chat, owner, subscriber, free = next(ids), next(ids), next(ids), next(ids)
+    await subscribe(owner, -1)
+    await subscribe(subscriber, 10)
+    await chat_owners.CHAT_OWNERS.set_owner(chat, owner)
+
+    events = await run_pipeline([join_request(chat, subscriber), join_request(chat, free)])
+    assert events.outcomes == {subscriber: "approved", free: "no_plan"}
+    assert (chat, subscriber) in outbound.approved
+
+
+async def test_active_owner_gates_every_joiner(ids, outbound, run_pipeline):
+    chat, owner, free = next(ids), next(ids), next(ids)
+    await subscribe(owner, 10)
+    await login.handle_my_chat_member(
+        member_update(chat, owner, ChatMemberStatus.LEFT, ChatMemberStatus.ADMINISTRATOR), outbound
+    )
+    assert await persistence.STORE.get_chat_owners([chat]) == {chat: owner}
+
+    events = await run_pipeline([join_request(chat, free)])
+    assert events.outcomes == {free: "approved"}
+
+
+@pytest.mark.parametrize("new", [ChatMemberStatus.MEMBER, ChatMemberStatus.RESTRICTED, ChatMemberStatus.KICKED])
+async def test_any_demotion_clears_the_owner(new, ids, outbound):
+    chat, owner = next(ids), next(ids)
+    await subscribe(owner, 10)
+    await chat_owners.CHAT_OWNERS.set_owner(chat, owner)
+    await login.handle_my_chat_member(member_update(chat, owner, ChatMemberStatus.ADMINISTRATOR, new), outbound)
+    assert await persistence.STORE.get_chat_owners([chat]) == {}
+    assert (await chat_owners.CHAT_OWNERS.get_owners([chat]))[chat] is None
+
+
+async def test_admin_rights_edit_keeps_the_owner(ids, outbound):
+    chat, owner, other = next(ids), next(ids), next(ids)
+    await subscribe(owner, 10)
+    await chat_owners.CHAT_OWNERS.set_owner(chat, owner)
+    await login.handle_my_chat_member(
+        member_update(chat, other, ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.ADMINISTRATOR), outbound
+    )
+    assert await persistence.STORE.get_chat_owners([chat]) == {chat: owner}
@@ -0,0 +1,48 @@
+"""Queue-backed logging: the event-loop side only enqueues, the listener thread formats."""
+
+import atexit
+import json
+import logging
+import threading
+
+import pytest
+
+import logs
+
+
+@pytest.fixture
+def root_logger():
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    yield root
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+
+def test_records_are_formatted_on_the_listener_thread(monkeypatch, capsys, root_logger):
+    threads = []
+    format_json = logs.JsonFormatter.format
+
+    def spy(self, record):
+        threads.append(threading.get_ident())
+        return format_json(self, record)
+
+    monkeypatch.setattr(logs.JsonFormatter, "format", spy)
+    listener = logs.setup_logging("INFO", "json")
+    try:
+        (handler,) = root_logger.handlers
+        prepared = handler.prepare(logging.makeLogRecord({"msg": "x %s", "args": (1,)}))
+        assert prepared.args == (1,) and prepared.msg == "x %s"
+
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logging.getLogger("login").exception("failed for %s", "user")
+    finally:
+        listener.stop()
+        atexit.unregister(listener.stop)
+
+    assert threads and threading.get_ident() not in threads
+    line = json.loads(capsys.readouterr().out.strip().splitlines()[-1])
+    assert line["msg"] == "failed for user"
+    assert "ValueError: boom" in line["exc"]
@@ -0,0 +1,97 @@
+"""Prometheus text rendering, the instrumented() wrapper, and the /metrics endpoint."""
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram import Bot
+
+import login
+from metrics import MetricsRegistry, instrumented
+from subscriptions import get_subscription_state
+
+
+def test_counters_and_gauges_render_with_escaped_labels():
+    registry = MetricsRegistry()
+    calls = registry.counter("calls_total", "Calls", ("op", "result"))
+    calls.inc(op='say "hi"', result="ok")
+    calls.inc(2, op='say "hi"', result="ok")
+    depth = registry.gauge("depth", "Queue depth", ("lane",))
+    depth.set_function(lambda: {("approve",): 3, ("dm",): 0})
+    ratio = registry.gauge("ratio", "Unlabelled, read at scrape time")
+    ratio.set_function(lambda: 0.25)
+
+    assert registry.render().splitlines() == [
+        "# HELP calls_total Calls",
+        "# TYPE calls_total counter",
+        'calls_total{op="say \\"hi\\"",result="ok"} 3.0',
+        "# HELP depth Queue depth",
+        "# TYPE depth gauge",
+        'depth{lane="approve"} 3.0',
+        'depth{lane="dm"} 0.0',
+        "# HELP ratio Unlabelled, read at scrape time",
+        "# TYPE ratio gauge",
+        "ratio 0.25",
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    latency = registry.histogram("latency_seconds", "Latency", ("op",))
+    latency.buckets = (0.1, 1.0)
+    for seconds in (0.05, 0.1, 0.5, 3.0):
+        latency.observe(seconds, op="get")
+
+    assert registry.render().splitlines()[2:] == [
+        'latency_seconds_bucket{op="get",le="0.1"} 2.0',
+        'latency_seconds_bucket{op="get",le="1.0"} 3.0',
+        'latency_seconds_bucket{op="get",le="+Inf"} 4.0',
+        'latency_seconds_sum{op="get"} 3.65',
+        'latency_seconds_count{op="get"} 4.0',
+    ]
+
+
+def test_a_failing_metric_does_not_break_the_scrape():
+    registry = MetricsRegistry()
+    registry.gauge("broken", "Raises").set_function(lambda: 1 / 0)
+    registry.counter("fine_total", "Still rendered").inc()
+    assert registry.render().splitlines() == ["# HELP fine_total Still rendered", "# TYPE fine_total counter", "fine_total 1.0"]
+
+
+async def test_instrumented_times_calls_and_counts_errors():
+    registry = MetricsRegistry()
+    seconds = registry.histogram("op_seconds", "Op latency", ("op",))
+    errors = registry.counter("op_errors_total", "Op failures", ("op",))
+
+    @instrumented(seconds, errors, "op", "lookup")
+    async def lookup(fail: bool):
+        if fail:
+            raise ConnectionError("down")
+        return "row"
+
+    assert await lookup(False) == "row"
+    with pytest.raises(ConnectionError):
+        await lookup(True)
+    text = registry.render()
+    assert 'op_seconds_count{op="lookup"} 2.0' in text
+    assert 'op_errors_total{op="lookup"} 1.0' in text
+
+
+async def test_metrics_endpoint_serves_the_live_registry(ids):
+    bot = Bot(login.BOT_TOKEN)
+    dp = login.setup_dispatcher(bot)
+    client = TestClient(TestServer(login.build_web_app(dp, bot, "polling")))
+    await client.start_server()
+    try:
+        await get_subscription_state(next(ids))
+        resp = await client.get("/metrics")
+        assert resp.status == 200
+        assert resp.content_type == "text/plain"
+        text = await resp.text()
+    finally:
+        await client.close()
+        await bot.session.close()
+
+    assert "# TYPE storage_call_seconds histogram" in text
+    assert 'storage_call_seconds_count{op="fetch_subscription"}' in text
+    # function-backed gauges read the dispatcher's live services
+    assert 'outbound_queue_depth{lane="approve"} 0.0' in text
+    assert 'circuit_breaker_state{dependency="storage"} 0.0' in text
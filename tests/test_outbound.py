@@ -0,0 +1,151 @@
+"""OutboundScheduler lanes, rate limits, RetryAfter handling and DM suppression."""
+
+import asyncio
+import time
+
+import pytest
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from outbound import OutboundScheduler, TokenBucket
+
+
+class FakeBot:
+    """Records Bot API writes in the order the scheduler issues them; `errors` are raised first."""
+
+    def __init__(self):
+        self.calls: list = []
+        self.errors: list = []
+
+    async def _call(self, call):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.calls.append(call)
+        return True
+
+    async def approve_chat_join_request(self, chat_id: int, user_id: int):
+        return await self._call(("approve", chat_id, user_id))
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        return await self._call(("dm", chat_id, text))
+
+
+def method() -> SendMessage:
+    return SendMessage(chat_id=1, text="x")
+
+
+def make(bot: FakeBot, **kwargs) -> OutboundScheduler:
+    # limits are lifted unless a test pins them
+    for name in ("global_rate", "approve_chat_rate", "dm_chat_rate"):
+        kwargs.setdefault(name, 1000.0)
+    return OutboundScheduler(bot, **kwargs)
+
+
+def test_token_bucket_refills_at_its_rate():
+    bucket = TokenBucket(rate=2.0, capacity=2.0, now=0.0)
+    for _ in range(2):
+        assert bucket.delay(0.0) == 0.0
+        bucket.take()
+    assert bucket.delay(0.0) == pytest.approx(0.5)
+    assert bucket.delay(0.25) == pytest.approx(0.25)
+    assert bucket.delay(0.5) == 0.0
+    # never refills past capacity
+    assert bucket.delay(100.0) == 0.0 and bucket.tokens == 2.0
+
+
+async def test_approvals_go_before_queued_dms(eventually):
+    bot = FakeBot()
+    outbound = make(bot, max_inflight=1)
+    for user in (1, 2):
+        outbound.send_dm(user, "hi")
+    approvals = [asyncio.ensure_future(outbound.approve_join(-100, user)) for user in (3, 4)]
+    await asyncio.sleep(0)  # let both approvals enqueue
+    outbound.start()
+    await asyncio.gather(*approvals)
+    await eventually(lambda: len(bot.calls) == 4)
+    await outbound.stop()
+    assert [call[0] for call in bot.calls] == ["approve", "approve", "dm", "dm"]
+    assert outbound.stats["approve"]["sent"] == 2 and outbound.stats["dm"]["sent"] == 2
+
+
+async def test_a_throttled_chat_does_not_hold_up_other_chats():
+    bot = FakeBot()
+    outbound = make(bot, approve_chat_rate=1.0, max_inflight=1)
+    approvals = [asyncio.ensure_future(outbound.approve_join(chat, user)) for chat, user in ((-1, 1), (-1, 2), (-2, 3))]
+    await asyncio.sleep(0)
+    outbound.start()
+    started = time.monotonic()
+    await asyncio.gather(*approvals)
+    await outbound.stop()
+    assert [call[2] for call in bot.calls] == [1, 3, 2]
+    # the second approval in chat -1 waited for that chat's bucket to refill
+    assert time.monotonic() - started >= 0.9
+
+
+async def test_retry_after_pauses_sends_and_retries_the_job():
+    bot = FakeBot()
+    bot.errors = [TelegramRetryAfter(method(), "Too Many Requests", retry_after=1)]
+    outbound = make(bot)
+    outbound.start()
+    started = time.monotonic()
+    assert await outbound.approve_join(-1, 1) is True
+    await outbound.stop()
+    assert time.monotonic() - started >= 1.0
+    assert bot.calls == [("approve", -1, 1)]
+    assert outbound.stats["approve"]["retry_after"] == 1 and outbound.stats["approve"]["sent"] == 1
+
+
+async def test_a_job_past_max_retries_is_dropped():
+    bot = FakeBot()
+    bot.errors = [TelegramRetryAfter(method(), "Too Many Requests", retry_after=0)] * 2
+    outbound = make(bot, max_retries=1)
+    outbound.start()
+    with pytest.raises(TelegramRetryAfter):
+        await outbound.approve_join(-1, 1)
+    await outbound.stop()
+    assert bot.calls == []
+    assert outbound.stats["approve"]["dropped"] == 1
+
+
+async def test_stale_dms_are_dropped_instead_of_sent():
+    bot = FakeBot()
+    outbound = make(bot, dm_max_age=0.05)
+    outbound.send_dm(1, "late")
+    await asyncio.sleep(0.1)
+    outbound.start()
+    assert await outbound.approve_join(-1, 2)
+    await outbound.stop()
+    assert bot.calls == [("approve", -1, 2)]
+    assert outbound.stats["dm"]["dropped"] == 1
+
+
+async def test_forbidden_dm_marks_the_user_unreachable(eventually):
+    bot = FakeBot()
+    bot.errors = [TelegramForbiddenError(method(), "Forbidden: bot was blocked by the user")]
+    outbound = make(bot, unreachable_ttl=60.0)
+    outbound.start()
+    assert outbound.send_dm(7, "first")
+    await eventually(lambda: outbound.is_unreachable(7))
+    assert not outbound.send_dm(7, "second")
+    # a message from the user in the bot's private chat lifts it
+    outbound.mark_reachable(7)
+    assert outbound.send_dm(7, "third")
+    await eventually(lambda: bot.calls == [("dm", 7, "third")])
+    await outbound.stop()
+    assert outbound.stats["dm"]["failed"] == 1 and outbound.stats["dm"]["suppressed"] == 1
+
+
+async def test_dm_dropped_by_a_full_lane_does_not_claim_its_dedup_key():
+    outbound = OutboundScheduler(bot=None, dm_queue_size=1, dedup_window=60.0, dedup_capacity=100)
+    assert outbound.send_dm(1, "filler")
+    # lane full: dropped, and the key stays free for a retry
+    assert not outbound.send_dm(2, "reminder", dedup_key="renewal:2")
+    assert outbound.stats["dm"]["dropped"] == 1
+    assert outbound.stats["dm"]["suppressed"] == 0
+
+    outbound.lanes["dm"].clear()
+    assert outbound.send_dm(2, "reminder", dedup_key="renewal:2")
+    # queued now, so the duplicate is suppressed
+    assert not outbound.send_dm(2, "reminder", dedup_key="renewal:2")
+    assert outbound.stats["dm"]["suppressed"] == 1
+    assert len(outbound.lanes["dm"]) == 1
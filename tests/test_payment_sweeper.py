@@ -0,0 +1,74 @@
+"""Payment sweeper against razorpay_stub.py and the in-memory storage backend."""
+
+from datetime import datetime, timedelta, timezone
+
+from aiohttp.test_utils import TestServer
+from aiogram import Bot
+
+import login
+import payments
+import persistence
+import razorpay_stub
+from metrics import METRICS
+from razorpay_client import RazorpayAsyncClient
+
+
+async def make_link(client, user_id: int, age: timedelta) -> dict:
+    link = await client.create_payment_link({"amount": 69900, "currency": "INR"})
+    row = {
+        "user_id": user_id,
+        "plan_id": "basic",
+        "plan_label": "BASIC",
+        "price_paise": 69900,
+        "duration_days": 30,
+        "paymentlink_id": link.id,
+        "paymentlink_url": link.short_url,
+        "status": "created",
+        "created_at": (datetime.now(timezone.utc) - age).isoformat(),
+    }
+    await persistence.STORE.insert_payment_link(row)
+    return await persistence.STORE.get_payment_link_by_plink_id(link.id)
+
+
+async def test_sweep_applies_paid_and_only_closes_links_razorpay_closed(monkeypatch):
+    stub = razorpay_stub.build_app()
+    server = TestServer(stub)
+    await server.start_server()
+    client = RazorpayAsyncClient("key", "secret", base_url=str(server.make_url("/v1")))
+    monkeypatch.setattr(payments, "RAZORPAY_CLIENT", client)
+    bot = Bot(login.BOT_TOKEN)
+    dp = login.setup_dispatcher(bot)
+    try:
+        fresh = await make_link(client, 8001, timedelta(hours=1))
+        stale = await make_link(client, 8002, timedelta(hours=72))
+        paid = await make_link(client, 8003, timedelta(hours=72))
+        gone = await make_link(client, 8004, timedelta(hours=1))
+        stub[razorpay_stub.LINKS][paid["paymentlink_id"]]["status"] = "paid"
+        stub[razorpay_stub.LINKS][gone["paymentlink_id"]]["status"] = "expired"
+
+        sweeper: payments.PaymentSweeper = dp["payment_sweeper"]
+        await sweeper.sweep()
+
+        async def status(row):
+            return (await persistence.STORE.get_payment_link_by_plink_id(row["paymentlink_id"]))["status"]
+
+        # still payable and inside the TTL: left alone
+        assert await status(fresh) == "created"
+        # past the TTL: cancelled at Razorpay, and only then closed locally
+        assert stub[razorpay_stub.LINKS][stale["paymentlink_id"]]["status"] == "cancelled"
+        assert await status(stale) == "cancelled"
+        assert await status(paid) == "paid"
+        assert (await persistence.STORE.get_subscription(8003))["plan_id"] == "basic"
+        assert await status(gone) == "expired"
+
+        assert sweeper.stats["paid"] == 1
+        assert sweeper.stats["cancelled"] == 1
+        assert sweeper.stats["expired"] == 1
+        metrics = METRICS.render()
+        assert 'payment_sweep_links_total{result="cancelled"} 1.0' in metrics
+        assert 'payment_sweep_links_total{result="paid"} 1.0' in metrics
+        assert "payment_sweep_runs_total 1.0" in metrics
+    finally:
+        await client.aclose()
+        await bot.session.close()
+        await server.close()
@@ -0,0 +1,163 @@
+"""Plan catalog validation, prerendered screens, hot reload, and the callback router."""
+
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import EditMessageText
+
+import login
+from login import Plan, PlanCatalog, PlanCatalogWatcher, load_plan_catalog
+
+PLANS = [
+    {"id": "Lite", "emoji": "🌱", "name": "LITE", "price_paise": 19900, "summary": ["Starter"]},
+    {"id": "max", "name": "MAX", "price_paise": 99900, "duration_days": 90, "features": ["All"], "extra": "Notes"},
+]
+
+
+@pytest.fixture
+def restore_catalog(monkeypatch):
+    # restores the module-level catalog after reload tests swap it
+    monkeypatch.setattr(login, "CATALOG", login.CATALOG)
+
+
+def callback_data(kb) -> list:
+    return [button.callback_data or button.url for row in kb.inline_keyboard for button in row]
+
+
+def test_plan_from_config_normalises_and_validates():
+    lite = Plan.from_config(PLANS[0])
+    assert (lite.plan_id, lite.duration_days, lite.label, lite.extra) == ("lite", login.PLAN_DURATION_DAYS, "🌱 LITE", "")
+    assert lite.price_text == f"₹199 / {login.PLAN_DURATION_DAYS} days"
+    assert Plan.from_config({"id": "x", "price_paise": 100}).name == "X"
+
+    for bad in ({"id": " "}, {"id": "root"}, {"id": "x" * (Plan.MAX_ID_BYTES + 1)}):
+        with pytest.raises(ValueError, match="invalid plan id"):
+            Plan.from_config({"price_paise": 100, **bad})
+    with pytest.raises(ValueError, match="must be positive"):
+        Plan.from_config({"id": "x", "price_paise": 0})
+    with pytest.raises(KeyError):
+        Plan.from_config({"id": "x"})
+
+
+def test_catalog_prerenders_every_screen():
+    catalog = PlanCatalog([Plan.from_config(p) for p in PLANS], version=3)
+    assert list(catalog.plans) == ["lite", "max"]
+    assert catalog.header_text.startswith(login.PLANS_INTRO_TEXT)
+    assert "🌱 **LITE — ₹199" in catalog.header_text and "• Starter" in catalog.header_text
+    assert "by the plan's validity" in catalog.header_text  # mixed durations
+    assert callback_data(catalog.root_kb) == ["plans_lite", "plans_max"]
+
+    text, kb = catalog.details["max"]
+    assert "**Features:**\n• All" in text and "Notes" in text and "Validity: 90 days" in text
+    assert callback_data(kb) == ["plans_root", "buy_max"]
+    assert callback_data(catalog.payment_kb("max", "https://rzp.io/i/1")) == [
+        "https://rzp.io/i/1", "verify_max", "plans_root"
+    ]
+    # a plan dropped from the catalog still gets its Verify button
+    assert callback_data(catalog.verify_kb("gone")) == ["verify_gone"]
+    assert callback_data(catalog.payment_kb("gone", "https://rzp.io/i/2"))[1:] == ["verify_gone", "plans_root"]
+
+    with pytest.raises(ValueError, match="duplicate plan id"):
+        PlanCatalog([Plan.from_config(PLANS[0])] * 2, version=1)
+
+
+def test_load_plan_catalog_reads_a_list_or_a_plans_object(tmp_path):
+    path = tmp_path / "plans.json"
+    path.write_text(json.dumps(PLANS[:1]), encoding="utf-8")
+    assert list(load_plan_catalog(str(path)).plans) == ["lite"]
+    path.write_text(json.dumps({"plans": PLANS}), encoding="utf-8")
+    assert list(load_plan_catalog(str(path), version=7).plans) == ["lite", "max"]
+    # no file: the built-in plans
+    assert list(load_plan_catalog(str(tmp_path / "missing.json")).plans) == [p["id"] for p in login.DEFAULT_PLANS]
+    path.write_text(json.dumps({"plans": []}), encoding="utf-8")
+    with pytest.raises(ValueError, match="plan catalog is empty"):
+        load_plan_catalog(str(path))
+
+
+def test_reload_swaps_the_catalog_and_keeps_it_on_a_bad_file(restore_catalog, tmp_path):
+    path = tmp_path / "plans.json"
+    watcher = PlanCatalogWatcher(str(path), interval=0)
+    version = login.CATALOG.version
+
+    path.write_text(json.dumps(PLANS), encoding="utf-8")
+    assert watcher.reload()
+    assert login.CATALOG.version == version + 1 and list(login.CATALOG.plans) == ["lite", "max"]
+
+    path.write_text('[{"id": "broken"}]', encoding="utf-8")
+    assert not watcher.reload()
+    path.write_text("not json", encoding="utf-8")
+    assert not watcher.reload()
+    assert login.CATALOG.version == version + 1
+
+    # removing the file falls back to the built-in plans
+    os.remove(path)
+    assert watcher.reload()
+    assert list(login.CATALOG.plans) == [p["id"] for p in login.DEFAULT_PLANS]
+
+
+async def test_watcher_reloads_when_the_file_changes(restore_catalog, tmp_path, eventually):
+    path = tmp_path / "plans.json"
+    path.write_text(json.dumps(PLANS[:1]), encoding="utf-8")
+    watcher = PlanCatalogWatcher(str(path), interval=0.01)
+    watcher.start()
+    try:
+        path.write_text(json.dumps(PLANS), encoding="utf-8")
+        os.utime(path, ns=(1, 1))  # a distinct mtime even on coarse filesystem clocks
+        await eventually(lambda: "max" in login.CATALOG.plans)
+    finally:
+        await watcher.stop()
+
+
+class FakeMessage:
+    def __init__(self, error=None):
+        self.edits: list = []
+        self.error = error
+
+    async def edit_text(self, text, reply_markup=None, **kwargs):
+        if self.error:
+            raise self.error
+        self.edits.append((text, reply_markup))
+
+
+def tap(data: str, user_id: int, message=None):
+    return SimpleNamespace(data=data, from_user=SimpleNamespace(id=user_id), message=message or FakeMessage())
+
+
+async def test_router_renders_plan_screens_from_the_current_catalog(restore_catalog, ids):
+    login.CATALOG = PlanCatalog([Plan.from_config(p) for p in PLANS], version=2)
+    cb = tap("plans_max", next(ids))
+    await login.cb_router(cb)
+    assert cb.message.edits == [login.CATALOG.details["max"]]
+
+    # the root screen, and a plan no longer in the catalog, both show the plan list
+    for data in ("plans_root", "plans_basic", "buy_basic"):
+        cb = tap(data, next(ids))
+        await login.cb_router(cb)
+        [(text, kb)] = cb.message.edits
+        assert text.endswith(login.CATALOG.header_text) and kb is login.CATALOG.root_kb
+
+
+async def test_router_dispatches_on_the_action_prefix(monkeypatch, ids):
+    seen: list = []
+
+    async def record(cb, plan_id):
+        seen.append((cb.data, plan_id))
+
+    monkeypatch.setitem(login.CALLBACK_ACTIONS, "verify", record)
+    await login.cb_router(tap("verify_pro_yearly", next(ids)))
+    await login.cb_router(tap("bogus_pro", next(ids)))
+    await login.cb_router(tap(None, next(ids)))
+    assert seen == [("verify_pro_yearly", "pro_yearly")]
+
+
+async def test_an_identical_edit_is_not_an_error(ids):
+    method = EditMessageText(text="x")
+    cb = tap("plans_basic", next(ids), FakeMessage(TelegramBadRequest(method, "Bad Request: message is not modified")))
+    await login.cb_router(cb)
+
+    cb = tap("plans_basic", next(ids), FakeMessage(TelegramBadRequest(method, "Bad Request: message to edit not found")))
+    with pytest.raises(TelegramBadRequest):
+        await login.cb_router(cb)
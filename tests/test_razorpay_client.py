@@ -0,0 +1,84 @@
+"""RazorpayAsyncClient retries and error handling, against an httpx.MockTransport."""
+
+import httpx
+import pytest
+
+from breakers import CircuitBreaker, CircuitOpenError
+from razorpay_client import RazorpayAsyncClient, RazorpayError
+
+LINK = {"id": "plink_1", "status": "created", "short_url": "https://rzp.io/i/1", "amount": 69900}
+
+
+def make_client(responses, max_retries: int = 3, **breaker):
+    """A client whose requests are answered from `responses` in order (httpx.Response or an exception)."""
+    seen: list = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen.append((request.method, request.url.path))
+        answer = responses.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    client = RazorpayAsyncClient(
+        "key", "secret", base_url="https://rzp.test/v1", max_retries=max_retries,
+        breaker=CircuitBreaker("razorpay", max_timeout=1.0, **breaker),
+    )
+    client._client = httpx.AsyncClient(base_url=client.base_url, auth=client.auth, transport=httpx.MockTransport(handler))
+    return client, seen
+
+
+def error(status: int, description: str = "try again", **headers) -> httpx.Response:
+    return httpx.Response(status, json={"error": {"description": description}}, headers=headers)
+
+
+async def test_server_errors_are_retried_until_one_succeeds():
+    client, seen = make_client([error(503), error(429, **{"Retry-After": "0"}), httpx.Response(200, json=LINK)])
+    link = await client.fetch_payment_link("plink_1")
+    await client.aclose()
+    assert (link.id, link.status, link.amount) == ("plink_1", "created", 69900)
+    assert seen == [("GET", "/v1/payment_links/plink_1")] * 3
+    assert client.breaker.failures == 0
+
+
+async def test_gives_up_after_max_retries():
+    client, seen = make_client([error(429, **{"Retry-After": "0"}) for _ in range(3)], max_retries=2)
+    with pytest.raises(RazorpayError) as info:
+        await client.fetch_payment_link("plink_1")
+    await client.aclose()
+    assert info.value.status_code == 429
+    assert len(seen) == 3
+
+
+async def test_client_errors_are_not_retried_and_leave_the_breaker_closed():
+    client, seen = make_client([error(400, "The id provided does not exist")], failure_threshold=1)
+    with pytest.raises(RazorpayError, match="Razorpay 400: The id provided does not exist"):
+        await client.fetch_payment_link("plink_missing")
+    await client.aclose()
+    assert len(seen) == 1
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+
+async def test_read_timeouts_are_only_retried_for_gets():
+    client, seen = make_client([httpx.ReadTimeout("slow"), httpx.Response(200, json=LINK)])
+    assert (await client.fetch_payment_link("plink_1")).id == "plink_1"
+    await client.aclose()
+    assert len(seen) == 2
+
+    # a create that timed out may still have gone through: not retried, so no second link
+    client, seen = make_client([httpx.ReadTimeout("slow"), httpx.Response(200, json=LINK)])
+    with pytest.raises(httpx.ReadTimeout):
+        await client.create_payment_link({"amount": 69900})
+    await client.aclose()
+    assert seen == [("POST", "/v1/payment_links")]
+
+
+async def test_open_circuit_fails_fast_without_a_request():
+    client, seen = make_client([error(502), error(502)], max_retries=5, failure_threshold=2, reset_timeout=60.0)
+    with pytest.raises(CircuitOpenError):
+        await client.fetch_payment_link("plink_1")
+    with pytest.raises(CircuitOpenError):
+        await client.cancel_payment_link("plink_1")
+    await client.aclose()
+    # the third attempt of the first call was already refused by the breaker
+    assert len(seen) == 2
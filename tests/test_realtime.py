@@ -0,0 +1,144 @@
+"""RealtimeListener against a local fake of the Supabase Realtime (Phoenix) websocket."""
+
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import persistence
+import subscriptions
+from realtime_listener import RealtimeListener
+
+websockets = pytest.importorskip("websockets")
+
+
+class FakePhoenix:
+    """Answers phx_join, counts heartbeats, pushes postgres_changes and can drop the socket."""
+
+    def __init__(self):
+        self.joins: list = []
+        self.heartbeats = 0
+        self.ws = None
+        self.server = None
+
+    async def handler(self, ws):
+        self.ws = ws
+        async for raw in ws:
+            msg = json.loads(raw)
+            if msg["event"] == "phx_join":
+                self.joins.append(msg)
+            elif msg["event"] == "heartbeat":
+                self.heartbeats += 1
+            reply = {"status": "ok", "response": {}}
+            await ws.send(json.dumps({"topic": msg["topic"], "event": "phx_reply", "payload": reply, "ref": msg["ref"]}))
+
+    async def __aenter__(self):
+        self.server = await websockets.serve(self.handler, "127.0.0.1", 0)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.server.close()
+        await self.server.wait_closed()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    async def push(self, table: str, kind: str, record: dict, old: dict = None) -> None:
+        data = {"table": table, "type": kind, "schema": "public", "record": record, "old_record": old or {}}
+        await self.ws.send(json.dumps({"topic": "realtime:login-bot", "event": "postgres_changes", "payload": {"data": data}}))
+
+    async def drop(self) -> None:
+        await self.ws.close()
+
+
+def sub_row(user_id: int, days: float) -> dict:
+    now = datetime.now(timezone.utc)
+    return {
+        "user_id": user_id,
+        "plan_id": "pro",
+        "plan_label": "PRO",
+        "expires_at": (now + timedelta(days=days)).isoformat(),
+        "updated_at": now.isoformat(),
+    }
+
+
+def cache_put(row: dict) -> None:
+    subscriptions.SUB_CACHE.put(row["user_id"], subscriptions.SubState.from_row(row))
+
+
+@pytest.fixture
+def listening(eventually):
+    async def start(fake: FakePhoenix) -> RealtimeListener:
+        listener = RealtimeListener(url=fake.url, key="anon-key", enabled=True, heartbeat=0.05)
+        listener.start()
+        await eventually(lambda: listener.connected)
+        return listener
+
+    return start
+
+
+async def test_join_subscribes_to_shared_tables_and_heartbeats(listening, eventually):
+    async with FakePhoenix() as fake:
+        listener = await listening(fake)
+        try:
+            join = fake.joins[0]
+            assert join["topic"] == "realtime:login-bot"
+            assert join["payload"]["access_token"] == "anon-key"
+            tables = {c["table"] for c in join["payload"]["config"]["postgres_changes"]}
+            assert tables == {"user_subscriptions", "user_payment_links"}
+            await eventually(lambda: fake.heartbeats >= 2)
+        finally:
+            await listener.stop()
+        assert not listener.connected
+
+
+async def test_changes_refresh_or_invalidate_cached_plans(ids, listening, eventually):
+    renewed, payer, deleted, uncached = (next(ids) for _ in range(4))
+    for uid in (renewed, payer, deleted):
+        cache_put(sub_row(uid, 1))
+
+    async with FakePhoenix() as fake:
+        listener = await listening(fake)
+        try:
+            new_row = sub_row(renewed, 40)
+            await fake.push("user_subscriptions", "UPDATE", new_row)
+            await fake.push("user_payment_links", "UPDATE", {"user_id": payer, "paymentlink_id": "plink_rt", "status": "paid"})
+            await fake.push("user_subscriptions", "DELETE", {}, {"user_id": deleted})
+            await fake.push("user_subscriptions", "INSERT", sub_row(uncached, 10))
+            await eventually(lambda: listener.stats["events"] == 4)
+        finally:
+            await listener.stop()
+
+    found, state = subscriptions.SUB_CACHE.get(renewed)
+    assert found and state.expires_ts == subscriptions.SubState.from_row(new_row).expires_ts
+    assert payer not in subscriptions.SUB_CACHE
+    assert deleted not in subscriptions.SUB_CACHE
+    # only entries we already hold are refreshed
+    assert uncached not in subscriptions.SUB_CACHE
+    assert listener.stats["refreshed"] == 1
+    assert listener.stats["invalidated"] == 2
+
+
+async def test_reconnect_resyncs_rows_updated_while_away(ids, listening, eventually):
+    user = next(ids)
+    cache_put(sub_row(user, 1))
+
+    async with FakePhoenix() as fake:
+        listener = await listening(fake)
+        try:
+            await fake.drop()
+            await eventually(lambda: not listener.connected)
+            # written by another bot while we were disconnected; no event will arrive for it
+            await persistence.STORE.upsert_subscription(sub_row(user, 90))
+
+            await eventually(lambda: len(fake.joins) == 2)
+            await eventually(lambda: listener.stats["resynced"] >= 1)
+        finally:
+            await listener.stop()
+
+    assert listener.stats["reconnects"] == 1
+    found, state = subscriptions.SUB_CACHE.get(user)
+    assert found and state.expires_ts > time.time() + 80 * 86400
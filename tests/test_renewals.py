@@ -0,0 +1,124 @@
+"""ExpiryIndex event ordering and the RenewalScheduler reminder pipeline."""
+
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+import persistence
+import renewals
+from renewals import RenewalScheduler, renewal_text
+from storage import make_storage
+from subscriptions import ExpiryIndex, SubscriptionCache, SubState
+
+NOW = 1_900_000_000.0
+HOUR = 3600.0
+
+
+def iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+def test_events_pop_in_fire_order():
+    index = ExpiryIndex([24, 1])
+    late, soon = SubState(1, "basic", "BASIC", NOW + 48 * HOUR), SubState(2, "pro", "PRO", NOW + 30 * HOUR)
+    index.track(late, now=NOW)
+    index.track(soon, now=NOW)
+    assert len(index) == 2
+    assert index.next_due() == NOW + 6 * HOUR
+
+    assert index.pop_due(NOW + 6 * HOUR) == ([], [(soon, 0)])
+    assert index.pop_due(NOW + 30 * HOUR) == ([soon], [(late, 0), (soon, 1)])
+    assert len(index) == 1
+    assert index.pop_due(NOW + 48 * HOUR) == ([late], [(late, 1)])
+    assert len(index) == 0 and index.next_due() is None
+
+
+def test_a_renewal_supersedes_the_old_events():
+    index = ExpiryIndex([24])
+    index.track(SubState(1, "basic", "BASIC", NOW + 2 * HOUR), now=NOW)
+    index.changed.clear()
+    renewed = SubState(1, "basic", "BASIC", NOW + 30 * 24 * HOUR)
+    index.track(renewed, now=NOW)
+    # the earliest event didn't move up
+    assert not index.changed.is_set()
+
+    assert index.pop_due(NOW + 2 * HOUR) == ([], [])
+    assert len(index) == 1
+    assert index.pop_due(renewed.expires_ts) == ([renewed], [(renewed, 0)])
+
+
+def test_overdue_reminders_and_lapsed_plans_are_not_tracked():
+    index = ExpiryIndex([72, 12])
+    state = SubState(1, "basic", "BASIC", NOW + 24 * HOUR)  # 72h reminder already overdue
+    index.track(state, now=NOW)
+    assert index.pop_due(NOW + 24 * HOUR) == ([state], [(state, 1)])
+
+    index.track(SubState(2, "basic", "BASIC", NOW - 1), now=NOW)
+    assert len(index) == 0 and index.next_due() is None
+    # a tracked plan that lapses on a re-read is dropped
+    index.track(SubState(3, "basic", "BASIC", NOW + HOUR), now=NOW)
+    index.track(SubState(3, "basic", "BASIC", NOW - 1), now=NOW)
+    assert len(index) == 0
+    assert index.pop_due(NOW + HOUR) == ([], [])
+
+
+def test_renewal_text_counts_whole_days():
+    state = SubState(1, "basic", "BASIC", NOW + 71.9 * HOUR)
+    assert "BASIC plan 3 din me expire" in renewal_text(state, NOW)
+    assert "BASIC plan aaj expire" in renewal_text(state, NOW + 60 * HOUR)
+
+
+@pytest.fixture
+def index(monkeypatch):
+    index = ExpiryIndex([24])
+    monkeypatch.setattr(renewals, "EXPIRY_INDEX", index)
+    monkeypatch.setattr(renewals, "SUB_CACHE", SubscriptionCache(100, ttl=600.0, negative_ttl=60.0))
+    monkeypatch.setattr(persistence, "STORE", make_storage("memory"))
+    return index
+
+
+async def add(user_id: int, expires_ts: float) -> None:
+    await persistence.STORE.upsert_subscription(
+        {"user_id": user_id, "plan_id": "basic", "plan_label": "BASIC", "expires_at": iso(expires_ts),
+         "updated_at": iso(time.time())}
+    )
+
+
+async def test_due_reminders_are_rechecked_in_a_batch_then_sent(index, outbound, eventually):
+    # reminders fall due a moment from now; the plans expire a day later
+    due = time.time() + 24 * HOUR + 0.3
+    reminded, renewed, deleted = 1, 2, 3
+    for user in (reminded, renewed):
+        await add(user, due)
+    await add(4, time.time() + 30 * 24 * HOUR)
+
+    scheduler = RenewalScheduler(outbound, dm_rate=1000.0, batch_size=10, page_size=1)
+    scheduler.start()
+    await eventually(lambda: scheduler.loaded)
+    assert scheduler.stats["loaded"] == 3 and len(index) == 3
+    # renewed from another process after the index was loaded; a plan storage no longer has
+    await add(renewed, due + 30 * 24 * HOUR)
+    index.track(SubState(deleted, "basic", "BASIC", due))
+
+    await eventually(lambda: scheduler.stats["reminded"] + scheduler.stats["renewed"] == 2)
+    await scheduler.stop()
+    assert outbound.dms == [(reminded, f"renew:{reminded}:{int(due)}:0")]
+    assert scheduler.stats["renewed"] == 1
+    # the renewal was re-tracked at its new expiry, the missing plan dropped
+    assert len(index) == 3 and deleted not in index._plans
+    assert index._plans[renewed].expires_ts == pytest.approx(due + 30 * 24 * HOUR)
+
+
+async def test_lapsed_plans_are_expired_from_the_cache(index, outbound, eventually):
+    scheduler = RenewalScheduler(outbound, dm_rate=0)
+    scheduler.start()
+    await eventually(lambda: scheduler.loaded)
+    state = SubState(5, "basic", "BASIC", time.time() + 0.2)
+    renewals.SUB_CACHE.put(5, state)
+    index.track(state)
+
+    await eventually(lambda: scheduler.stats["expired"] == 1)
+    await scheduler.stop()
+    assert len(index) == 0
+    assert renewals.SUB_CACHE.get(5) == (True, state) and not state.is_active()
@@ -0,0 +1,141 @@
+"""A shard worker (run_worker, in this process) against a real intake socket served by ShardSupervisor."""
+
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from aiogram import Bot
+from aiogram.types import Update
+
+import login
+import persistence
+import shards
+from outbound import OutboundScheduler
+
+
+def join_request_update(update_id: int, chat_id: int, user_id: int) -> Update:
+    return Update.model_validate(
+        {
+            "update_id": update_id,
+            "chat_join_request": {
+                "chat": {"id": chat_id, "type": "channel", "title": "Test"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "T"},
+                "user_chat_id": user_id,
+                "date": int(time.time()),
+            },
+        }
+    )
+
+
+async def test_worker_leases_budget_and_approves_forwarded_join(monkeypatch, tmp_path, ids, eventually):
+    calls: list = []
+
+    async def fake_call(self, method, request_timeout=None):
+        calls.append(method)
+        return True
+
+    async def no_spawn(self, worker):
+        # the worker runs in this process instead of a child
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(Bot, "__call__", fake_call)
+    monkeypatch.setattr(shards.ShardSupervisor, "_supervise", no_spawn)
+
+    chat, user = -next(ids), next(ids)
+    expires = datetime.now(timezone.utc) + timedelta(days=10)
+    await persistence.STORE.upsert_subscription({"user_id": user, "plan_id": "basic", "expires_at": expires.isoformat()})
+
+    bot = Bot(login.BOT_TOKEN)
+    dp = login.setup_dispatcher(bot)
+    dp["outbound"].start()
+    supervisor = shards.ShardSupervisor(dp, bot, workers=1, socket_path=str(tmp_path / "intake.sock"))
+    supervisor.start()
+    await eventually(lambda: supervisor._server is not None)
+
+    worker = asyncio.create_task(login.run_worker(0, supervisor.socket_path))
+    try:
+        await eventually(lambda: supervisor.live == [0])
+        assert await supervisor.forward(chat, join_request_update(next(ids), chat, user))
+
+        await eventually(lambda: any(getattr(m, "user_id", None) == user for m in calls))
+        await eventually(lambda: not supervisor.workers[0].inflight)
+        assert supervisor.stats["leased"] >= 1
+        approval = next(m for m in calls if getattr(m, "user_id", None) == user)
+        assert type(approval).__name__ == "ApproveChatJoinRequest" and approval.chat_id == chat
+    finally:
+        await supervisor.stop()
+        # the closed socket ends the worker's serve loop
+        await asyncio.wait_for(worker, 10)
+        await dp["outbound"].stop()
+        await bot.session.close()
+
+
+def test_lease_request_is_resent_once_the_socket_opens():
+    class Link:
+        def __init__(self):
+            self.open = False
+            self.sent: list = []
+
+        def send(self, msg: dict) -> bool:
+            if self.open:
+                self.sent.append(msg)
+            return self.open
+
+    link = Link()
+    bucket = shards.LeasedBucket(link, batch=5)
+    assert bucket.delay(0.0) > 0
+    link.open = True
+    bucket.delay(0.01)
+    assert link.sent == [{"op": "lease", "n": 5}]
+    # outstanding: not repeated until it times out
+    bucket.delay(0.02)
+    assert len(link.sent) == 1
+    bucket.delay(0.01 + bucket.RESEND_AFTER)
+    assert len(link.sent) == 2
+
+    bucket.grant(5, 0.0)
+    assert bucket.delay(10.0) == 0.0
+
+
+async def test_workers_refuse_the_per_process_memory_backend(monkeypatch):
+    monkeypatch.setattr(login, "STORAGE_BACKEND", "memory")
+    with pytest.raises(RuntimeError, match="shared STORAGE_BACKEND"):
+        await login.main("polling", workers=2)
+
+
+async def test_dm_suppression_state_reaches_every_process(monkeypatch, tmp_path, ids, eventually):
+    async def no_spawn(self, worker):
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(shards.ShardSupervisor, "_supervise", no_spawn)
+    intake = {"outbound": OutboundScheduler(bot=None)}
+    supervisor = shards.ShardSupervisor(intake, None, workers=2, socket_path=str(tmp_path / "intake.sock"))
+    supervisor.start()
+    await eventually(lambda: supervisor._server is not None)
+
+    workers = [{"outbound": OutboundScheduler(bot=None)} for _ in range(2)]
+    links = [shards.ShardLink(i, supervisor.socket_path) for i in range(2)]
+    serving = []
+    for link, dp in zip(links, workers):
+        await link.connect(dp)
+        serving.append(asyncio.create_task(link.run(dp, None)))
+    first, second = (dp["outbound"] for dp in workers)
+    try:
+        await eventually(lambda: supervisor.live == [0, 1])
+        blocked, user = next(ids), next(ids)
+
+        first.mark_unreachable(blocked)
+        await eventually(lambda: second.is_unreachable(blocked) and intake["outbound"].is_unreachable(blocked))
+        assert not second.send_dm(blocked, "hi")
+
+        assert first.send_dm(user, "reminder", dedup_key=f"renewal:{user}")
+        await eventually(lambda: second.dm_dedup.seen(f"renewal:{user}"))
+        assert not second.send_dm(user, "reminder", dedup_key=f"renewal:{user}")
+        assert second.stats["dm"]["suppressed"] == 2
+
+        second.mark_reachable(blocked)
+        await eventually(lambda: not first.is_unreachable(blocked))
+    finally:
+        await supervisor.stop()
+        await asyncio.wait_for(asyncio.gather(*serving), 10)
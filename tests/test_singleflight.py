@@ -0,0 +1,94 @@
+"""SingleFlight coalescing, memoization and cancellation."""
+
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+class Slow:
+    """An awaitable call that counts invocations and finishes when `release` is set."""
+
+    def __init__(self, result="ok"):
+        self.result = result
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+async def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    fn = Slow()
+    callers = [asyncio.ensure_future(flight.do("plink_1", fn)) for _ in range(5)]
+    await asyncio.sleep(0)
+    fn.release.set()
+    assert await asyncio.gather(*callers) == ["ok"] * 5
+    assert fn.calls == 1
+    assert flight.stats == {"calls": 1, "coalesced": 4, "memo_hits": 0}
+
+    # different keys and later calls run on their own; nothing is memoized by default
+    assert await flight.do("plink_2", fn) == "ok"
+    assert await flight.do("plink_1", fn) == "ok"
+    assert fn.calls == 3
+
+
+async def test_results_are_memoized_for_memo_ttl_and_forget_drops_them():
+    flight = SingleFlight(memo_ttl=0.05)
+    fn = Slow()
+    fn.release.set()
+    assert await flight.do("k", fn) == "ok"
+    assert await flight.do("k", fn) == "ok"
+    assert (fn.calls, flight.stats["memo_hits"]) == (1, 1)
+
+    flight.forget("k")
+    assert await flight.do("k", fn) == "ok"
+    assert fn.calls == 2
+
+    await asyncio.sleep(0.06)
+    assert await flight.do("k", fn) == "ok"
+    assert fn.calls == 3
+
+
+async def test_errors_reach_every_waiter_and_are_not_memoized():
+    flight = SingleFlight(memo_ttl=60.0)
+    fn = Slow(ConnectionError("down"))
+    callers = [asyncio.ensure_future(flight.do("k", fn)) for _ in range(2)]
+    await asyncio.sleep(0)
+    fn.release.set()
+    for result in await asyncio.gather(*callers, return_exceptions=True):
+        assert isinstance(result, ConnectionError)
+
+    fn.result = "ok"
+    assert await flight.do("k", fn) == "ok"
+    assert fn.calls == 2
+
+
+async def test_memo_is_bounded():
+    flight = SingleFlight(memo_ttl=60.0, maxsize=2)
+    fn = Slow()
+    fn.release.set()
+    for key in ("a", "b", "c"):
+        await flight.do(key, fn)
+    assert list(flight._memo) == ["b", "c"]
+
+
+async def test_a_cancelled_caller_does_not_cancel_the_shared_call():
+    flight = SingleFlight()
+    fn = Slow()
+    impatient = asyncio.ensure_future(flight.do("k", fn))
+    patient = asyncio.ensure_future(flight.do("k", fn))
+    await asyncio.sleep(0)
+    impatient.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await impatient
+
+    fn.release.set()
+    assert await patient == "ok"
+    assert fn.calls == 1
@@ -0,0 +1,184 @@
+"""
+Backend parity: the same storage operations against every backend, checking
+the subscription and payment semantics of sql/apply_successful_payment.sql.
+
+`memory` and `sqlite` always run. Set STORAGE_TEST_SUPABASE_URL and
+STORAGE_TEST_SUPABASE_KEY to also run against a disposable Supabase project
+(rows are written for user ids 9_100_000_000+).
+"""
+
+import asyncio
+import inspect
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from storage import SQLiteStorage, Storage, SupabaseStorage, _parse_ts, make_storage
+
+SUPABASE_URL = os.getenv("STORAGE_TEST_SUPABASE_URL", "")
+SUPABASE_KEY = os.getenv("STORAGE_TEST_SUPABASE_KEY", "")
+BASE_USER = 9_100_000_000
+
+BACKENDS = [
+    "memory",
+    "sqlite",
+    pytest.param("supabase", marks=pytest.mark.skipif(not SUPABASE_URL, reason="STORAGE_TEST_SUPABASE_URL not set")),
+]
+
+
+@pytest.fixture(params=BACKENDS)
+def store(request, tmp_path):
+    if request.param == "supabase":
+        pytest.importorskip("postgrest")
+        backend = make_storage("supabase", url=SUPABASE_URL, key=SUPABASE_KEY)
+    else:
+        backend = make_storage(request.param, sqlite_path=str(tmp_path / "bot.sqlite3"))
+    yield backend
+    asyncio.run(backend.close())
+
+
+def user_id() -> int:
+    return BASE_USER + uuid.uuid4().int % 1_000_000
+
+
+async def add_link(store, uid: int, days: int = 30, plan_id: str = "basic", created_at=None) -> dict:
+    plink_id = "plink_" + uuid.uuid4().hex[:14]
+    await store.insert_payment_link(
+        {
+            "user_id": uid,
+            "plan_id": plan_id,
+            "plan_label": plan_id.upper(),
+            "price_paise": 69900,
+            "duration_days": days,
+            "paymentlink_id": plink_id,
+            "paymentlink_url": "https://rzp.io/i/" + plink_id,
+            "status": "created",
+            "created_at": created_at or datetime.now(timezone.utc).isoformat(),
+            "raw": {"id": plink_id},
+        }
+    )
+    return await store.get_payment_link_by_plink_id(plink_id)
+
+
+def close_to(value, expected: datetime, slack: float = 60.0) -> bool:
+    return abs((_parse_ts(value) - expected).total_seconds()) < slack
+
+
+async def test_subscription_roundtrip_and_bulk_lookup(store):
+    a, b = user_id(), user_id()
+    exp = datetime.now(timezone.utc) + timedelta(days=3)
+    for uid in (a, b):
+        await store.upsert_subscription(
+            {"user_id": uid, "plan_id": "pro", "plan_label": "PRO", "expires_at": exp.isoformat()}
+        )
+    row = await store.get_subscription(a)
+    assert row["plan_id"] == "pro"
+    assert _parse_ts(row["expires_at"]) == exp
+    assert set(await store.get_subscriptions([a, b, a + 1])) == {a, b}
+    assert await store.get_subscription(a + 1) is None
+
+
+async def test_timestamps_compare_across_offsets(store):
+    ist = timezone(timedelta(hours=5, minutes=30))
+    later, earlier = user_id(), user_id()
+    # as raw text both sort after 23:00Z; in UTC only `later` (00:00Z) does, `earlier` is 19:30Z
+    await store.upsert_subscription(
+        {"user_id": later, "plan_id": "basic", "expires_at": datetime(2030, 1, 1, 5, 30, tzinfo=ist).isoformat()}
+    )
+    await store.upsert_subscription(
+        {"user_id": earlier, "plan_id": "basic", "expires_at": datetime(2030, 1, 1, 1, 0, tzinfo=ist).isoformat()}
+    )
+    rows = await store.list_subscriptions(min(later, earlier) - 1, 1000, active_at="2029-12-31T23:00:00Z")
+    found = {int(r["user_id"]) for r in rows} & {earlier, later}
+    assert found == {later}
+
+    uid = user_id()
+    first = await add_link(store, uid, created_at=datetime(2030, 1, 1, 4, 0, tzinfo=ist).isoformat())
+    second = await add_link(store, uid, created_at="2029-12-31T23:00:00+00:00")
+    latest = await store.get_latest_payment_link(uid, "basic")
+    assert latest["paymentlink_id"] == second["paymentlink_id"] != first["paymentlink_id"]
+
+
+async def test_apply_successful_payment_semantics(store):
+    uid = user_id()
+    now = datetime.now(timezone.utc)
+
+    missing = await store.apply_successful_payment(-1, 30)
+    assert missing["applied"] is False and missing["reason"] == "not_found"
+
+    # no subscription yet: extends from now, marks the link paid
+    link = await add_link(store, uid, days=30)
+    first = await store.apply_successful_payment(link["id"], 30)
+    assert first["applied"] is True
+    assert close_to(first["expires_at"], now + timedelta(days=30))
+    assert (await store.get_payment_link_by_plink_id(link["paymentlink_id"]))["status"] == "paid"
+
+    # idempotent: same link again changes nothing
+    again = await store.apply_successful_payment(link["id"], 30)
+    assert again["applied"] is False and again["reason"] == "already_paid"
+    assert _parse_ts(again["expires_at"]) == _parse_ts(first["expires_at"])
+
+    # an active plan is extended from its current expiry, not from now
+    link = await add_link(store, uid, days=10, plan_id="pro")
+    second = await store.apply_successful_payment(link["id"], 30)
+    assert _parse_ts(second["expires_at"]) == _parse_ts(first["expires_at"]) + timedelta(days=10)
+    sub = await store.get_subscription(uid)
+    assert sub["plan_id"] == "pro"
+    assert _parse_ts(sub["expires_at"]) == _parse_ts(second["expires_at"])
+
+    # an expired plan restarts from now
+    await store.upsert_subscription(
+        {"user_id": uid, "plan_id": "pro", "expires_at": (now - timedelta(days=5)).isoformat()}
+    )
+    link = await add_link(store, uid, days=7)
+    third = await store.apply_successful_payment(link["id"], 30)
+    assert close_to(third["expires_at"], now + timedelta(days=7))
+
+
+async def test_concurrent_apply_same_link_extends_once(store):
+    uid = user_id()
+    link = await add_link(store, uid, days=30)
+    results = await asyncio.gather(*(store.apply_successful_payment(link["id"], 30) for _ in range(8)))
+    assert sum(1 for r in results if r["applied"]) == 1
+    assert close_to((await store.get_subscription(uid))["expires_at"], datetime.now(timezone.utc) + timedelta(days=30))
+
+
+async def test_concurrent_apply_different_links_adds_up(store):
+    uid = user_id()
+    links = [await add_link(store, uid, days=30) for _ in range(2)]
+    results = await asyncio.gather(*(store.apply_successful_payment(link["id"], 30) for link in links))
+    assert all(r["applied"] for r in results)
+    sub = await store.get_subscription(uid)
+    assert close_to(sub["expires_at"], datetime.now(timezone.utc) + timedelta(days=60))
+
+
+async def test_sqlite_file_keeps_rows_across_reopen(tmp_path):
+    path = str(tmp_path / "bot.sqlite3")
+    uid = user_id()
+    first = SQLiteStorage(path)
+    await first.upsert_subscription({"user_id": uid, "plan_id": "basic", "expires_at": "2030-01-01T00:00:00Z"})
+    await first.close()
+    second = SQLiteStorage(path)
+    row = await second.get_subscription(uid)
+    await second.close()
+    assert _parse_ts(row["expires_at"]) == datetime(2030, 1, 1, tzinfo=timezone.utc)
+
+
+async def test_sqlite_work_runs_off_the_event_loop_thread(tmp_path):
+    store = SQLiteStorage(str(tmp_path / "bot.sqlite3"))
+    try:
+        await store.get_subscription(1)
+        assert await store._run(threading.get_ident) != threading.get_ident()
+    finally:
+        await store.close()
+
+
+@pytest.mark.parametrize("backend", [SQLiteStorage, SupabaseStorage])
+def test_backends_implement_the_storage_signatures(backend):
+    for name in Storage.__abstractmethods__:
+        assert inspect.signature(getattr(backend, name)) == inspect.signature(getattr(Storage, name)), name
+    with pytest.raises(TypeError):
+        Storage()
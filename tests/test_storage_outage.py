@@ -0,0 +1,90 @@
+"""Plan lookups and payment application while storage misbehaves."""
+
+from types import SimpleNamespace
+
+import pytest
+from aiogram.enums import ChatMemberStatus
+
+import chat_owners
+import login
+import payments
+import persistence
+import subscriptions
+from breakers import CircuitBreaker
+from join_pipeline import JoinRequestPipeline
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    # a private breaker, so failures injected here don't open the shared one for other tests
+    fresh = CircuitBreaker("storage", max_timeout=1.0)
+    monkeypatch.setattr(persistence, "STORAGE_BREAKER", fresh)
+    return fresh
+
+
+@pytest.fixture
+def outage(monkeypatch, breaker):
+    async def down(*args, **kwargs):
+        raise ConnectionError("storage down")
+
+    monkeypatch.setattr(persistence.STORE, "get_subscription", down)
+    return breaker
+
+
+async def test_unknown_plan_state_is_not_reported_as_no_plan(outage, ids):
+    user = next(ids)
+    assert await subscriptions.get_subscription_state(user) == (False, None)
+    assert await subscriptions.has_active_plan(user) is None
+    assert await subscriptions.format_plan_status(user) == subscriptions.PLAN_STATUS_UNAVAILABLE_TEXT
+
+
+async def test_promotion_during_outage_sends_no_no_plan_dm(outage, ids, outbound):
+    chat, owner = next(ids), next(ids)
+    event = SimpleNamespace(
+        chat=SimpleNamespace(id=chat, title="Test"),
+        from_user=SimpleNamespace(id=owner),
+        old_chat_member=SimpleNamespace(status=ChatMemberStatus.MEMBER),
+        new_chat_member=SimpleNamespace(status=ChatMemberStatus.ADMINISTRATOR),
+    )
+    await login.handle_my_chat_member(event, outbound)
+    assert outbound.dms == []
+    assert await persistence.STORE.get_chat_owners([chat]) == {chat: owner}
+
+
+async def test_not_found_payment_is_not_a_backend_failure(breaker, ids):
+    for _ in range(breaker.failure_threshold + 2):
+        with pytest.raises(RuntimeError, match="not_found"):
+            await payments.sp_apply_successful_payment(next(ids), {"id": -1})
+    assert breaker.state == breaker.CLOSED
+    assert breaker.failures == 0
+
+
+async def test_unknown_owner_is_held_while_the_circuit_is_open(breaker, monkeypatch, ids, outbound, eventually):
+    chat, owner = next(ids), next(ids)
+    await chat_owners.CHAT_OWNERS.set_owner(chat, owner)
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+
+    asked: list = []
+    fetch = subscriptions.sp_fetch_subscriptions_bulk
+
+    async def counting(user_ids):
+        asked.append(sorted(user_ids))
+        return await fetch(user_ids)
+
+    monkeypatch.setattr(subscriptions, "sp_fetch_subscriptions_bulk", counting)
+    outcomes: list = []
+    events = SimpleNamespace(record=lambda chat_id, title, user_id, outcome, ms: outcomes.append(outcome))
+    pipeline = JoinRequestPipeline(outbound, events, flush_interval=0.001, workers=1, breaker=breaker)
+    pipeline.start()
+    try:
+        for n in range(1, 4):
+            request = SimpleNamespace(chat=SimpleNamespace(id=chat, title="Test"), from_user=SimpleNamespace(id=next(ids)))
+            await pipeline.submit(request)
+            await eventually(lambda: len(outcomes) == n)
+    finally:
+        await pipeline.stop()
+
+    assert outcomes == ["unknown"] * 3
+    # asked once, on the first batch; the later batches reuse the unknown result
+    assert asked == [[owner]]
@@ -0,0 +1,115 @@
+"""SubscriptionCache expiry/TTL bookkeeping, and the plan lookups cached behind it."""
+
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import payments
+import persistence
+import subscriptions
+from subscriptions import SubscriptionCache, SubState
+
+NOW = 1_900_000_000.0
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [NOW]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    return now
+
+
+def test_positive_entry_lives_until_the_plan_expires_then_serves_stale(clock):
+    cache = SubscriptionCache(10, ttl=60.0, negative_ttl=5.0, stale_ttl=30.0)
+    state = SubState(1, "basic", "BASIC", NOW + 10)
+    cache.put(1, state)
+
+    clock[0] = NOW + 9.9
+    assert cache.get(1) == (True, state)
+    # the plan lapsed before the TTL ran out: re-read now
+    clock[0] = NOW + 10
+    assert cache.get(1) == (False, None)
+    assert cache.get_stale(1) == (True, state)
+    assert not state.is_active()
+    # past the stale window the entry is gone for good
+    clock[0] = NOW + 41
+    assert cache.get_stale(1) == (False, None)
+    assert cache.get(1) == (False, None) and 1 not in cache
+
+
+def test_users_without_a_plan_are_cached_for_the_negative_ttl(clock):
+    cache = SubscriptionCache(10, ttl=60.0, negative_ttl=5.0, stale_ttl=0.0)
+    cache.put(1, None)
+    cache.put(2, SubState(2, "basic", "BASIC", NOW - 1))  # already expired: cached like no plan
+
+    clock[0] = NOW + 4.9
+    assert cache.get(1) == (True, None)
+    assert cache.get(2)[0]
+    clock[0] = NOW + 5
+    assert cache.get(1) == (False, None)
+    assert cache.get(2) == (False, None)
+
+
+def test_expire_turns_the_entry_negative_unless_it_was_renewed(clock):
+    cache = SubscriptionCache(10, ttl=600.0, negative_ttl=5.0)
+    lapsing = SubState(1, "basic", "BASIC", NOW + 100)
+    cache.put(1, lapsing)
+    cache.put(2, SubState(2, "basic", "BASIC", NOW + 500))
+
+    cache.expire(1, lapsing.expires_ts)
+    cache.expire(2, NOW + 100)  # an older expiry than the cached one
+    clock[0] = NOW + 6
+    assert cache.get(1) == (False, None)
+    assert cache.get(2)[0]
+
+
+def test_lru_bound_and_hit_counters(clock):
+    cache = SubscriptionCache(2, ttl=60.0, negative_ttl=60.0)
+    cache.put(1, None)
+    cache.put(2, None)
+    assert cache.get(1)[0]  # 1 is now the most recently used
+    cache.put(3, None)
+    assert 2 not in cache and 1 in cache and 3 in cache
+    assert cache.get(2) == (False, None)
+    assert cache.stats() == {"size": 2, "hits": 1, "misses": 1, "stale_hits": 0, "hit_ratio": 0.5}
+
+    cache.clear()
+    assert len(cache) == 0 and cache.stats()["hits"] == cache.stats()["misses"] == 0
+
+
+async def test_lookups_are_cached_and_a_payment_invalidates_them(monkeypatch, ids):
+    user = next(ids)
+    reads: list = []
+    get_subscription = persistence.STORE.get_subscription
+
+    async def counting(user_id):
+        reads.append(user_id)
+        return await get_subscription(user_id)
+
+    monkeypatch.setattr(persistence.STORE, "get_subscription", counting)
+
+    assert await subscriptions.has_active_plan(user) is False
+    assert await subscriptions.format_plan_status(user) == "🔴 **No active plan found.**\nUse `/upgrade` to purchase any plan."
+    assert reads == [user]  # the second lookup was a negative-cache hit
+
+    await persistence.STORE.insert_payment_link(
+        {
+            "user_id": user,
+            "plan_id": "basic",
+            "plan_label": "BASIC",
+            "price_paise": 69900,
+            "duration_days": 30,
+            "paymentlink_id": f"plink_{user}",
+            "paymentlink_url": "https://rzp.io/test",
+            "status": "created",
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }
+    )
+    row = await persistence.STORE.get_payment_link_by_plink_id(f"plink_{user}")
+    new_exp = await payments.sp_apply_successful_payment(user, row)
+    assert new_exp > datetime.now(timezone.utc) + timedelta(days=29)
+
+    assert await subscriptions.has_active_plan(user) is True
+    assert reads == [user, user]
+    assert subscriptions.EXPIRY_INDEX.next_due() is not None
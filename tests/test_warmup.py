@@ -0,0 +1,133 @@
+"""Subscription snapshot files and the CacheWarmer cold/warm start paths."""
+
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+import persistence
+import warmup
+from storage import make_storage
+from subscriptions import SubscriptionCache, SubState
+from warmup import CacheWarmer, read_snapshot, write_snapshot
+
+
+def iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = SubscriptionCache(100, ttl=600.0, negative_ttl=60.0)
+    monkeypatch.setattr(warmup, "SUB_CACHE", cache)
+    return cache
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = make_storage("memory")
+    monkeypatch.setattr(persistence, "STORE", store)
+    return store
+
+
+async def add(store, user_id: int, expires_ts: float, updated_ts: float, plan_id: str = "basic") -> None:
+    await store.upsert_subscription(
+        {"user_id": user_id, "plan_id": plan_id, "plan_label": plan_id.upper(),
+         "expires_at": iso(expires_ts), "updated_at": iso(updated_ts)}
+    )
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "subs.bin")
+    states = [SubState(1, "basic", "BASIC", 1_900_000_000.5), SubState(2, "pro", "PRO", 1_900_000_100.0),
+              SubState(3, "basic", "BASIC", 1_900_000_200.0)]
+    assert write_snapshot(path, states, watermark=1_800_000_000.25) == 3
+
+    watermark, loaded = read_snapshot(path)
+    assert watermark == 1_800_000_000.25
+    assert [(s.user_id, s.plan_id, s.plan_label, s.expires_ts) for s in loaded] == [
+        (s.user_id, s.plan_id, s.plan_label, s.expires_ts) for s in states
+    ]
+    # the plan table is shared, so a record is the fixed-size struct only
+    assert (tmp_path / "subs.bin").stat().st_size == (
+        warmup._SNAPSHOT_HEADER.size + len(b'[["basic", "BASIC"], ["pro", "PRO"]]') + 3 * warmup._SNAPSHOT_RECORD.size
+    )
+    assert not (tmp_path / "subs.bin.tmp").exists()
+
+
+def test_bad_snapshots_raise_value_error(tmp_path):
+    path = tmp_path / "subs.bin"
+    write_snapshot(str(path), [SubState(1, "basic", "BASIC", 1_900_000_000.0)] * 2, watermark=1.0)
+    data = path.read_bytes()
+
+    path.write_bytes(data[:-1])
+    with pytest.raises(ValueError, match="truncated snapshot"):
+        read_snapshot(str(path))
+    path.write_bytes(b"XXXX" + data[4:])
+    with pytest.raises(ValueError, match="unsupported snapshot"):
+        read_snapshot(str(path))
+
+
+async def test_cold_start_pages_through_active_rows(cache, store):
+    now = time.time()
+    for user in (1, 2, 3):
+        await add(store, user, now + 3600, now - 10)
+    await add(store, 4, now - 3600, now - 10)  # lapsed: not loaded
+
+    warmer = CacheWarmer(page_size=2, snapshot_path="")
+    stats = await warmer.warm()
+    assert (stats["snapshot"], stats["loaded"], stats["pages"]) == (0, 3, 2)
+    assert sorted(state.user_id for state in cache.active_states()) == [1, 2, 3]
+    assert 4 not in cache
+    assert warmer.watermark == pytest.approx(now - 10, abs=1e-3)
+
+
+async def test_cold_start_stops_at_the_cache_size(cache, store, monkeypatch):
+    monkeypatch.setattr(cache, "maxsize", 2)
+    now = time.time()
+    for user in range(1, 6):
+        await add(store, user, now + 3600, now)
+
+    stats = await CacheWarmer(page_size=2, snapshot_path="").warm()
+    assert (stats["loaded"], stats["pages"]) == (2, 1)
+
+
+async def test_warm_start_loads_the_snapshot_and_rereads_only_newer_rows(cache, store, tmp_path):
+    now = time.time()
+    path = str(tmp_path / "subs.bin")
+    watermark = now - 3600
+    write_snapshot(path, [SubState(1, "basic", "BASIC", now + 3600), SubState(2, "basic", "BASIC", now - 1)], watermark)
+    await add(store, 3, now + 3600, watermark - 600)  # already in the snapshot's era: skipped
+    await add(store, 1, now + 7200, now - 60, plan_id="pro")  # renewed after the snapshot
+    await add(store, 5, now + 3600, watermark - 30)  # within the clock-skew window
+
+    warmer = CacheWarmer(page_size=10, snapshot_path=path)
+    stats = await warmer.warm()
+    assert (stats["snapshot"], stats["loaded"]) == (1, 2)
+    assert cache.get(1)[1].plan_id == "pro"
+    assert 2 not in cache and 3 not in cache and 5 in cache
+    assert warmer.watermark == pytest.approx(now - 60, abs=1e-3)
+
+
+async def test_unreadable_snapshot_falls_back_to_a_cold_start(cache, store, tmp_path):
+    now = time.time()
+    path = tmp_path / "subs.bin"
+    path.write_bytes(b"garbage")
+    await add(store, 1, now + 3600, now)
+
+    stats = await CacheWarmer(page_size=10, snapshot_path=str(path)).warm()
+    assert (stats["snapshot"], stats["loaded"]) == (0, 1)
+
+
+def test_save_snapshot_writes_the_active_cache_entries(cache, tmp_path):
+    now = time.time()
+    cache.put(1, SubState(1, "basic", "BASIC", now + 3600))
+    cache.put(2, None)
+    cache.put(3, SubState(3, "basic", "BASIC", now - 1))
+    warmer = CacheWarmer(snapshot_path=str(tmp_path / "subs.bin"))
+    warmer.watermark = now - 5
+    warmer.save_snapshot()
+
+    watermark, states = read_snapshot(warmer.snapshot_path)
+    assert watermark == now - 5
+    assert [state.user_id for state in states] == [1]
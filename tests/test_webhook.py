@@ -0,0 +1,80 @@
+"""Webhook mode: a local fake posts Telegram updates at the aiohttp app."""
+
+import asyncio
+
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram import Bot
+
+import login
+
+
+def fake_update(update_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": 1,
+            "date": 1700000000,
+            "chat": {"id": 42, "type": "private"},
+            "from": {"id": 42, "is_bot": False, "first_name": "Test"},
+            "text": "hello",
+        },
+    }
+
+
+async def post_updates(check):
+    bot = Bot(login.BOT_TOKEN)
+    dp = login.setup_dispatcher(bot)
+    seen: list = []
+    release = asyncio.Event()
+
+    # stands in for the handlers: records the update, then holds it until released
+    async def gate(handler, event, data):
+        await release.wait()
+        seen.append(event.update_id)
+
+    dp.update.outer_middleware(gate)
+    client = TestClient(TestServer(login.build_web_app(dp, bot, "webhook")))
+    await client.start_server()
+    try:
+        await check(client, seen, release)
+    finally:
+        await client.close()
+        await bot.session.close()
+
+
+async def test_wrong_secret_is_rejected():
+    async def check(client, seen, release):
+        resp = await client.post(
+            login.WEBHOOK_PATH,
+            json=fake_update(1),
+            headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"},
+        )
+        assert resp.status == 401
+        resp = await client.post(login.WEBHOOK_PATH, json=fake_update(2))
+        assert resp.status == 401
+        release.set()
+        await asyncio.sleep(0.05)
+        assert seen == []
+
+    await post_updates(check)
+
+
+async def test_valid_update_is_acked_before_processing(eventually):
+    async def check(client, seen, release):
+        resp = await asyncio.wait_for(
+            client.post(
+                login.WEBHOOK_PATH,
+                json=fake_update(3),
+                headers={"X-Telegram-Bot-Api-Secret-Token": login.WEBHOOK_SECRET},
+            ),
+            timeout=2,
+        )
+        # 200 while the update is still held in the dispatcher
+        assert resp.status == 200
+        assert seen == []
+
+        release.set()
+        await eventually(lambda: seen)
+        assert seen == [3]
+
+    await post_updates(check)
@@ -0,0 +1,135 @@
+"""
+Startup cache warm-up: fills SUB_CACHE from a binary snapshot file plus a
+delta read, or from a paged bulk load on a cold start.
+"""
+
+import json
+import logging
+import os
+import struct
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import SUB_SNAPSHOT_PATH, WARMUP_PAGE_SIZE
+from persistence import sp_list_subscriptions
+from subscriptions import SUB_CACHE, SubState, parse_iso_utc
+
+log = logging.getLogger(__name__)
+
+
+# snapshot file: header, JSON plan table, then fixed-size (user_id, expires_ts, plan index) records
+SNAPSHOT_MAGIC = b"SUBS"
+SNAPSHOT_VERSION = 1
+_SNAPSHOT_HEADER = struct.Struct("<4sHdII")  # magic, version, watermark, plan table bytes, record count
+_SNAPSHOT_RECORD = struct.Struct("<qdI")
+
+# re-read rows updated this long before the watermark (clock skew between writers)
+SNAPSHOT_SKEW = 60.0
+
+
+def write_snapshot(path: str, states, watermark: float) -> int:
+    plans: Dict[Tuple[Optional[str], Optional[str]], int] = {}
+    records = bytearray()
+    count = 0
+    for state in states:
+        idx = plans.setdefault((state.plan_id, state.plan_label), len(plans))
+        records += _SNAPSHOT_RECORD.pack(state.user_id, state.expires_ts, idx)
+        count += 1
+
+    table = json.dumps(list(plans)).encode()
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(_SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, watermark, len(table), count))
+        f.write(table)
+        f.write(records)
+    os.replace(tmp, path)
+    return count
+
+
+def read_snapshot(path: str) -> Tuple[float, List[SubState]]:
+    with open(path, "rb") as f:
+        data = f.read()
+
+    magic, version, watermark, table_len, count = _SNAPSHOT_HEADER.unpack_from(data)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise ValueError(f"unsupported snapshot {magic!r} v{version}")
+
+    offset = _SNAPSHOT_HEADER.size
+    plans = json.loads(data[offset : offset + table_len])
+    offset += table_len
+    end = offset + count * _SNAPSHOT_RECORD.size
+    if len(data) < end:
+        raise ValueError("truncated snapshot")
+
+    states = [
+        SubState(user_id, plans[idx][0], plans[idx][1], expires_ts)
+        for user_id, expires_ts, idx in _SNAPSHOT_RECORD.iter_unpack(memoryview(data)[offset:end])
+    ]
+    return watermark, states
+
+
+class CacheWarmer:
+    """
+    Fills SUB_CACHE before the dispatcher starts consuming updates, so a
+    restart doesn't send every queued join request to Supabase at once.
+
+    A cold start bulk-loads active rows page by page (keyset on user_id, up to
+    the cache size). A warm start loads the snapshot file and only re-reads
+    rows updated since the snapshot's watermark.
+    """
+
+    def __init__(self, page_size: int = WARMUP_PAGE_SIZE, snapshot_path: str = SUB_SNAPSHOT_PATH):
+        self.page_size = max(1, page_size)
+        self.snapshot_path = snapshot_path
+        self.watermark = 0.0  # newest updated_at seen (epoch)
+        self.stats: Dict[str, Any] = {"snapshot": 0, "loaded": 0, "pages": 0, "elapsed_ms": 0.0}
+
+    async def _load_pages(self, bounded: bool, **filters) -> None:
+        after = 0
+        while not (bounded and len(SUB_CACHE) >= SUB_CACHE.maxsize):
+            rows = await sp_list_subscriptions(after, self.page_size, **filters)
+            self.stats["pages"] += 1
+            for row in rows:
+                state = SubState.from_row(row)
+                SUB_CACHE.put(state.user_id, state)
+                updated = parse_iso_utc(row.get("updated_at"))
+                if updated:
+                    self.watermark = max(self.watermark, updated.timestamp())
+            self.stats["loaded"] += len(rows)
+            if len(rows) < self.page_size:
+                break
+            after = int(rows[-1]["user_id"])
+
+    def _load_snapshot(self) -> bool:
+        if not (self.snapshot_path and os.path.exists(self.snapshot_path)):
+            return False
+        try:
+            watermark, states = read_snapshot(self.snapshot_path)
+        except (OSError, ValueError, struct.error) as ex:
+            log.warning("Snapshot load error: %s", ex)
+            return False
+
+        now = time.time()
+        for state in states:
+            if state.is_active(now):
+                SUB_CACHE.put(state.user_id, state)
+                self.stats["snapshot"] += 1
+        self.watermark = watermark
+        return watermark > 0
+
+    async def warm(self) -> Dict[str, Any]:
+        started = time.perf_counter()
+        if self._load_snapshot():
+            since = datetime.fromtimestamp(self.watermark - SNAPSHOT_SKEW, timezone.utc).isoformat()
+            await self._load_pages(bounded=False, updated_since=since)
+        else:
+            await self._load_pages(bounded=True, active_at=datetime.now(timezone.utc).isoformat())
+        self.stats["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return self.stats
+
+    def save_snapshot(self) -> None:
+        if not self.snapshot_path:
+            return
+        count = write_snapshot(self.snapshot_path, SUB_CACHE.active_states(), self.watermark)
+        log.info("Subscription snapshot saved: %d entries", count)